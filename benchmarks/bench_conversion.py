@@ -0,0 +1,196 @@
+"""Benchmark converting Up transactions into the JSON bodies of YNAB upload requests.
+
+Compares the batch conversion path (YNABTransaction.from_up_page, then
+YNABTransaction.encode_payloads for each chunk) against converting one transaction at
+a time into a dict the way up2ynab 0.1 did, reporting the time taken, the peak memory
+allocated while converting, and the memory held by the converted records. It
+also times the batch conversion with a set of synthetic payee and category --rules,
+and how long they take to compile and to load from the compiled rules cache.
+
+    $ python benchmarks/bench_conversion.py --count 200000
+"""
+
+import argparse
+import datetime
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import namedtuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from synthetic import up_transactions  # noqa: E402
+from up2ynab.clients.ynab import YNABTransaction  # noqa: E402
+from up2ynab.rules import load_rules  # noqa: E402
+
+_LegacyBase = namedtuple(
+    "LegacyBase",
+    ("date", "amount", "payee_name", "import_id", "is_foreign", "is_cleared"),
+)
+
+
+class LegacyTransaction(_LegacyBase):
+    """The transaction record of up2ynab 0.1, for comparison."""
+
+    @classmethod
+    def from_up_transaction_data(cls, transaction):
+        date = datetime.datetime.fromisoformat(transaction["attributes"]["createdAt"])
+        return cls(
+            date.date().isoformat(),
+            transaction["attributes"]["amount"]["valueInBaseUnits"] * 10,
+            transaction["attributes"]["description"],
+            f"up0:{transaction['id'].replace('-', '')}",
+            transaction["attributes"]["foreignAmount"] is not None,
+            True,
+        )
+
+
+# Request bodies are built one upload chunk at a time, as create_transactions does
+CHUNK_SIZE = 250
+
+
+def legacy_bodies(records, account_id):
+    """Return the request bodies of the records, built from a dict of each one and
+    encoded the way requests encodes json= data."""
+    return [
+        json.dumps(
+            {
+                "transactions": [
+                    {
+                        "date": tx.date,
+                        "amount": tx.amount,
+                        "payee_name": tx.payee_name,
+                        "import_id": tx.import_id,
+                        "flag": None,
+                        "account_id": account_id,
+                        "cleared": ("cleared" if tx.is_cleared else "uncleared"),
+                    }
+                    for tx in records[i : i + CHUNK_SIZE]
+                ]
+            },
+            allow_nan=False,
+        ).encode("utf-8")
+        for i in range(0, len(records), CHUNK_SIZE)
+    ]
+
+
+def batch_bodies(records, account_id):
+    """Return the request bodies of the records, as create_transactions builds them."""
+    return [
+        YNABTransaction.encode_payloads(records[i : i + CHUNK_SIZE], account_id)
+        for i in range(0, len(records), CHUNK_SIZE)
+    ]
+
+
+def legacy_convert(pages, account_id):
+    records = [
+        LegacyTransaction.from_up_transaction_data(tx) for page in pages for tx in page
+    ]
+    legacy_bodies(records, account_id)
+    return records
+
+
+def batch_convert(pages, account_id):
+    records = []
+    for page in pages:
+        records.extend(YNABTransaction.from_up_page(page))
+    batch_bodies(records, account_id)
+    return records
+
+
+def synthetic_rules(count):
+    """Return count rules of every kind, a few of which match the synthetic
+    transactions' descriptions ("Shop N")."""
+    kinds = (
+        lambda i: {"description_exact": f"Shop {i}", "payee": f"Exact {i}"},
+        lambda i: {"description_prefix": f"Store {i} ", "category_id": f"c{i}"},
+        lambda i: {"description": f"merchant {i}", "payee": f"Merchant {i}"},
+        lambda i: {"description_regex": rf"cafe {i}\b", "payee": f"Cafe {i}"},
+    )
+    return [kinds[i % len(kinds)](i) for i in range(count)]
+
+
+def compile_rules(count):
+    """Compile count synthetic rules, reporting how long compiling and loading them
+    from the cache take, and return the RuleSet."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "rules.json")
+        with open(path, "w") as f:
+            json.dump({"rules": synthetic_rules(count)}, f)
+
+        start = time.perf_counter()
+        load_rules(path, cache_dir=tmp)
+        compiled = time.perf_counter() - start
+        start = time.perf_counter()
+        rules = load_rules(path, cache_dir=tmp)
+        cached = time.perf_counter() - start
+    print(
+        f"Compiled {count:,} rules in {compiled:.3f} s, loaded from the cache in"
+        f" {cached:.3f} s"
+    )
+    return rules
+
+
+def measure(name, convert, pages, repeat):
+    """Time the best of repeat runs of convert, then measure its memory use once."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        convert(pages, "account")
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    records = convert(pages, "account")
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    count = len(records)
+    record_bytes = sum(sys.getsizeof(tx) for tx in records) / count
+    print(
+        f"{name:>8}: {best:7.3f} s  {count / best:>11,.0f} tx/s"
+        f"  peak {peak / 2**20:7.1f} MiB  {record_bytes:5.0f} B/record"
+    )
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=100_000)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--rules", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"Generating {args.count:,} synthetic transactions...")
+    data = up_transactions(args.count)
+    pages = [data[i : i + args.page_size] for i in range(0, len(data), args.page_size)]
+
+    legacy = measure("legacy", legacy_convert, pages, args.repeat)
+    batch = measure("batch", batch_convert, pages, args.repeat)
+
+    # Both paths must produce exactly the same transactions, without a category or
+    # transfer payee
+    assert [tuple(tx) + (None, None) for tx in legacy] == [tuple(tx) for tx in batch]
+    # and the same request bodies
+    assert [json.loads(body) for body in legacy_bodies(legacy, "account")] == [
+        json.loads(body) for body in batch_bodies(batch, "account")
+    ]
+
+    if args.rules:
+        rules = compile_rules(args.rules)
+
+        def rules_convert(pages, account_id):
+            records = []
+            for page in pages:
+                records.extend(YNABTransaction.from_up_page(page, rules))
+            batch_bodies(records, account_id)
+            return records
+
+        measure("rules", rules_convert, pages, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
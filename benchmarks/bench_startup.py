@@ -0,0 +1,107 @@
+"""Benchmark how long up2ynab takes to start, in fresh interpreters.
+
+Times importing the package and a few commands that do no network work, and checks
+that none of them load the modules that only syncing needs. Exits with an error if any
+of them does, or if any takes longer than --max-ms on average, e.g.:
+
+    $ python benchmarks/bench_startup.py --runs 20 --max-ms 150
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Modules that shouldn't be imported until a command actually needs them
+HEAVY_MODULES = ("requests", "urllib3", "http.server")
+
+# Each case is the Python code run in a fresh interpreter
+CASES = {
+    "import up2ynab": "import up2ynab",
+    "up2ynab --help": "import up2ynab; up2ynab.cli(['--help'])",
+    "up2ynab transactions --help": (
+        "import up2ynab; up2ynab.cli(['transactions', '--help'])"
+    ),
+    "up2ynab check (no tokens)": "import up2ynab; up2ynab.cli(['check'])",
+}
+
+# Reports which of the heavy modules were loaded, however the case exits
+_GUARD = """
+import atexit, sys
+atexit.register(
+    lambda: sys.stderr.write(
+        "LOADED " + ",".join(m for m in {modules!r} if m in sys.modules) + "\\n"
+    )
+)
+{code}
+"""
+
+
+def run_case(code, env):
+    """Return the wall time of running code in a fresh interpreter, and the heavy
+    modules it loaded."""
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", _GUARD.format(modules=HEAVY_MODULES, code=code)],
+        capture_output=True,
+        text=True,
+        cwd=ROOT,
+        env=env,
+    )
+    elapsed = time.perf_counter() - start
+    loaded = []
+    for line in result.stderr.splitlines():
+        if line.startswith("LOADED "):
+            loaded = [name for name in line[len("LOADED ") :].split(",") if name]
+    return elapsed, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--max-ms", type=float, help="fail if a mean is slower")
+    args = parser.parse_args()
+
+    # Don't pick up real tokens or settings from the environment
+    env = {
+        key: value
+        for key, value in os.environ.items()
+        if not key.startswith(("UP_", "YNAB_", "UP2YNAB_"))
+    }
+
+    # The time to start an interpreter that does nothing, to compare against
+    baseline = statistics.mean(run_case("pass", env)[0] for _ in range(args.runs))
+    print(f"{'python -c pass':<30} {baseline * 1000:>8.1f} ms")
+
+    failed = False
+    for name, code in CASES.items():
+        times = []
+        loaded = set()
+        for _ in range(args.runs):
+            elapsed, case_loaded = run_case(code, env)
+            times.append(elapsed)
+            loaded.update(case_loaded)
+        mean = statistics.mean(times)
+        print(
+            f"{name:<30} {mean * 1000:>8.1f} ms"
+            f" (min {min(times) * 1000:.1f}, +{(mean - baseline) * 1000:.1f} ms)"
+        )
+        if loaded:
+            print(f"  loaded {', '.join(sorted(loaded))}")
+            failed = True
+        if args.max_ms is not None and mean * 1000 > args.max_ms:
+            print(f"  slower than {args.max_ms:.0f} ms")
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
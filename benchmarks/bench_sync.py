@@ -0,0 +1,225 @@
+"""Benchmark syncing transactions against local stand-ins for the Up and YNAB APIs.
+
+Runs the UpClient and YNABClient stages on their own, then `up2ynab transactions`
+end to end, reporting the throughput, the latency of each kind of request as seen by
+the stand-in servers, and the peak memory allocated. Any arguments after -- are passed
+on to `up2ynab transactions`, e.g.:
+
+    $ python benchmarks/bench_sync.py --transactions 20000 --up-latency 0.05 -- -i
+"""
+
+import argparse
+import datetime
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import requests
+from click.testing import CliRunner
+from requests.exceptions import RequestException
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mock_servers import MockConfig, MockServerProcess  # noqa: E402
+from synthetic import UP_TIMEZONE, up_transactions  # noqa: E402
+import up2ynab  # noqa: E402
+from up2ynab.clients.scheduler import RequestScheduler  # noqa: E402
+from up2ynab.clients.session import PooledSession  # noqa: E402
+from up2ynab.clients.up import UpClient  # noqa: E402
+from up2ynab.clients.ynab import YNABClient, YNABTransaction  # noqa: E402
+
+
+def run_stage(server, name, count, function, *args):
+    """Run function once for its time and once for its peak memory, each against an
+    empty YNAB budget, and report both along with the latency of each kind of request
+    made during the first run."""
+    requests.get(server.base_url + "/_reset")
+    start = time.perf_counter()
+    try:
+        function(*args)
+    except RequestException as e:
+        print(f"{name}: failed with {e!r}")
+        return
+    elapsed = time.perf_counter() - start
+    stats = requests.get(server.base_url + "/_stats").json()
+
+    requests.get(server.base_url + "/_reset")
+    tracemalloc.start()
+    try:
+        function(*args)
+    except RequestException:
+        pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(
+        f"{name}: {count:,} transactions in {elapsed:.2f} s"
+        f" ({count / elapsed:,.0f} tx/s), peak {peak / 2**20:.1f} MiB"
+    )
+    print(f"  {'request':<26} {'count':>6} {'errors':>6} {'mean ms':>8} {'p95 ms':>8}")
+    for stage, times in sorted(stats["stages"].items()):
+        times = sorted(times)
+        p95 = times[min(len(times) - 1, int(len(times) * 0.95))]
+        print(
+            f"  {stage:<26} {len(times):>6} {stats['errors'].get(stage, 0):>6}"
+            f" {statistics.mean(times) * 1000:>8.1f} {p95 * 1000:>8.1f}"
+        )
+
+
+def fetch_stage(server, scheduler, since, page_size):
+    with PooledSession(scheduler=scheduler) as session:
+        client = UpClient("token", session=session, base_url=server.up_url)
+        pages = client.iter_transaction_pages(
+            since, page_size=page_size, account_id="transactional"
+        )
+        return [YNABTransaction.from_up_page(page) for page in pages]
+
+
+def scan_stage(server, scheduler, since, page_size, full):
+    # Only count the transactions, so that the peak memory is that of fetching and
+    # decoding the pages, which shouldn't grow with the number of transactions
+    with PooledSession(scheduler=scheduler) as session:
+        client = UpClient("token", session=session, base_url=server.up_url)
+        pages = client.iter_transaction_pages(
+            since, page_size=page_size, account_id="transactional", full=full
+        )
+        return sum(len(page) for page in pages)
+
+
+def upload_stage(server, scheduler, transactions, chunk_size, max_uploads):
+    with PooledSession(scheduler=scheduler) as session:
+        client = YNABClient("token", session=session, base_url=server.ynab_url)
+        client.create_transactions(
+            "ynab-spending",
+            transactions,
+            chunk_size=chunk_size,
+            max_workers=max_uploads,
+        )
+
+
+def cli_stage(server, days, extra_args):
+    with tempfile.TemporaryDirectory() as home:
+        # Keep the cache and state files out of the real app directory
+        env = {
+            "HOME": home,
+            "XDG_CONFIG_HOME": home,
+            "UP_API_TOKEN": "token",
+            "YNAB_API_TOKEN": "token",
+            "UP2YNAB_UP_API_URL": server.up_url,
+            "UP2YNAB_YNAB_API_URL": server.ynab_url,
+            "UP2YNAB_STATE_FILE": os.path.join(home, "state.sqlite3"),
+        }
+        result = CliRunner().invoke(
+            up2ynab.cli,
+            ["transactions", "--days", str(days), "-a", "Up Spending"] + extra_args,
+            env=env,
+        )
+    if result.exit_code != 0:
+        print(result.output)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--transactions", type=int, default=20000)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--max-page-size", type=int, default=100)
+    parser.add_argument("--chunk-size", type=int, default=250)
+    parser.add_argument("--max-uploads", type=int, default=4)
+    parser.add_argument("--up-latency", type=float, default=0.0, help="seconds")
+    parser.add_argument("--ynab-latency", type=float, default=0.0, help="seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-code", type=int, default=503)
+    parser.add_argument(
+        "--error-stages", nargs="*", help="the kinds of request to fail, default all"
+    )
+    parser.add_argument(
+        "--transfers", type=int, default=0, help="round ups to the Saver"
+    )
+    parser.add_argument(
+        "--no-compress", action="store_true", help="don't gzip the responses"
+    )
+    parser.add_argument("cli_args", nargs="*", help="passed to up2ynab transactions")
+    args = parser.parse_args()
+
+    config = MockConfig(
+        transactions=args.transactions,
+        up_latency=args.up_latency,
+        ynab_latency=args.ynab_latency,
+        error_rate=args.error_rate,
+        error_code=args.error_code,
+        error_stages=args.error_stages,
+        max_page_size=args.max_page_size,
+        transfers=args.transfers,
+        compress=not args.no_compress,
+    )
+
+    # The synthetic transactions are 10 minutes apart, ending now
+    days = args.transactions // (6 * 24) + 2
+    since = datetime.datetime.now(UP_TIMEZONE) - datetime.timedelta(days=days)
+
+    print(f"Starting the stand-in APIs with {args.transactions:,} transactions...")
+    count = args.transactions
+    transactions = YNABTransaction.from_up_page(up_transactions(count))
+    with MockServerProcess(config) as server, tempfile.TemporaryDirectory() as tmp:
+        # Retry failed requests as the CLI does, without sharing its rate limit state
+        scheduler = RequestScheduler(path=os.path.join(tmp, "rate_limits.json"))
+        run_stage(
+            server,
+            "Up fetch",
+            count,
+            fetch_stage,
+            server,
+            scheduler,
+            since,
+            args.page_size,
+        )
+        for name, full in (("Up scan", False), ("Up scan, full pages", True)):
+            run_stage(
+                server,
+                name,
+                count,
+                scan_stage,
+                server,
+                scheduler,
+                since,
+                args.page_size,
+                full,
+            )
+        run_stage(
+            server,
+            "YNAB upload",
+            count,
+            upload_stage,
+            server,
+            scheduler,
+            transactions,
+            args.chunk_size,
+            args.max_uploads,
+        )
+        run_stage(
+            server,
+            "up2ynab transactions",
+            count,
+            cli_stage,
+            server,
+            days,
+            [
+                "--page-size",
+                str(args.page_size),
+                "--chunk-size",
+                str(args.chunk_size),
+                "--max-uploads",
+                str(args.max_uploads),
+            ]
+            + args.cli_args,
+        )
+
+
+if __name__ == "__main__":
+    main()
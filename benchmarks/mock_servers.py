@@ -0,0 +1,626 @@
+"""Local stand-ins for the Up and YNAB APIs, for benchmarking up2ynab offline.
+
+Both APIs are served by one HTTP server, under /up and /ynab, implementing just the
+endpoints up2ynab uses. Each can be given a fixed latency, and a fraction of requests
+can be made to fail. Run it on its own with:
+
+    $ python benchmarks/mock_servers.py --transactions 10000 --port 8000
+
+and point up2ynab at it with the UP2YNAB_UP_API_URL and UP2YNAB_YNAB_API_URL
+environment variables, e.g. http://127.0.0.1:8000/up and http://127.0.0.1:8000/ynab.
+"""
+
+import argparse
+import bisect
+import datetime
+import gzip
+import json
+import multiprocessing
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from synthetic import up_transactions, up_transfers
+
+UP_ACCOUNTS = [
+    ("transactional", "Spending", "TRANSACTIONAL"),
+    ("saver", "Savings", "SAVER"),
+]
+
+YNAB_ACCOUNTS = [("ynab-spending", "Up Spending"), ("ynab-savings", "Up Savings")]
+
+YNAB_BUDGET_ID = "budget-last-used"
+
+YNAB_CATEGORIES = [("category-savings", "Savings"), ("category-groceries", "Groceries")]
+
+
+class MockConfig:
+    """The behaviour of the stand-in APIs.
+
+    transactions is the number of synthetic transactions in the Up transactional
+    account (the Saver has a tenth as many). Latencies are in seconds, and are added to
+    every request to that API. A random error_rate fraction of requests fail with
+    error_code, with a Retry-After header for 429s; error_stages limits the failures
+    to the named kinds of request (e.g. "ynab_create"), otherwise any can fail.
+    max_page_size caps the page size Up returns, as the real API does at 100.
+    transfers is the number of transfers from the transactional account to the Saver,
+    with a transaction for each side, and creating a YNAB transfer creates its other
+    side as YNAB does. If compress is True, responses are gzipped for clients that
+    accept it.
+    """
+
+    def __init__(
+        self,
+        transactions=10000,
+        up_latency=0.0,
+        ynab_latency=0.0,
+        error_rate=0.0,
+        error_code=503,
+        error_stages=None,
+        max_page_size=100,
+        transfers=0,
+        compress=True,
+        seed=0,
+    ):
+        self.transactions = transactions
+        self.up_latency = up_latency
+        self.ynab_latency = ynab_latency
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self.error_stages = error_stages
+        self.max_page_size = max_page_size
+        self.transfers = transfers
+        self.compress = compress
+        self.seed = seed
+
+
+class MockState:
+    """The data behind the stand-in APIs, and the record of requests made to them."""
+
+    def __init__(self, config):
+        self.config = config
+        self.random = random.Random(config.seed)
+        self.lock = threading.Lock()
+        outgoing, incoming = up_transfers(config.transfers, "transactional", "saver")
+        self.up_accounts = {
+            "transactional": _UpAccountTransactions(
+                _newest_first(
+                    up_transactions(config.transactions, "transactional") + outgoing
+                )
+            ),
+            "saver": _UpAccountTransactions(
+                _newest_first(
+                    # Offset the IDs from those of the transactional account, and
+                    # of the transfers (which start at 1 << 64)
+                    up_transactions(
+                        config.transactions // 10, "saver", id_offset=2 << 64
+                    )
+                    + incoming
+                )
+            ),
+        }
+        # Each account's balance is the total of its transactions
+        self.up_balances = {
+            account_id: sum(
+                tx["attributes"]["amount"]["valueInBaseUnits"]
+                for tx in account.transactions
+            )
+            for account_id, account in self.up_accounts.items()
+        }
+        self.up_by_id = {
+            tx["id"]: tx
+            for account in self.up_accounts.values()
+            for tx in account.transactions
+        }
+        self.reset()
+
+    def reset(self):
+        """Forget everything created in YNAB, and every request made."""
+        with self.lock:
+            self.ynab_transactions = {}
+            self.ynab_categories = {
+                category_id: {
+                    "id": category_id,
+                    "name": name,
+                    "budgeted": 0,
+                    "activity": 0,
+                    "balance": 0,
+                    "deleted": False,
+                    "knowledge": 0,
+                }
+                for category_id, name in YNAB_CATEGORIES
+            }
+            self.server_knowledge = 0
+            self.stage_times = defaultdict(list)
+            self.errors = defaultdict(int)
+
+    def should_fail(self, stage):
+        if self.config.error_stages and stage not in self.config.error_stages:
+            return False
+        with self.lock:
+            return self.random.random() < self.config.error_rate
+
+    def record(self, stage, duration, failed):
+        with self.lock:
+            self.stage_times[stage].append(duration)
+            if failed:
+                self.errors[stage] += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "stages": dict(self.stage_times),
+                "errors": dict(self.errors),
+                "ynab_transactions": len(self.ynab_transactions),
+            }
+
+
+def _newest_first(transactions):
+    return sorted(
+        transactions,
+        key=lambda tx: _parse_utc_timestamp(tx["attributes"]["createdAt"]),
+        reverse=True,
+    )
+
+
+def _parse_utc_timestamp(value):
+    return datetime.datetime.fromisoformat(value).timestamp()
+
+
+class _UpAccountTransactions:
+    """The transactions in an Up account, newest first, indexed by creation time so
+    that pages of a filtered range can be served without scanning them all."""
+
+    def __init__(self, transactions):
+        self.transactions = transactions
+        # Negated so that the keys are in ascending order, for bisect
+        self.keys = [
+            -_parse_utc_timestamp(tx["attributes"]["createdAt"]) for tx in transactions
+        ]
+
+    def bounds(self, query):
+        """Return the start and end indices of the transactions matching the
+        filter[since] and filter[until] parameters in query."""
+        start, end = 0, len(self.transactions)
+        if "filter[until]" in query:
+            start = bisect.bisect_right(
+                self.keys, -_parse_utc_timestamp(query["filter[until]"])
+            )
+        if "filter[since]" in query:
+            end = bisect.bisect_right(
+                self.keys, -_parse_utc_timestamp(query["filter[since]"])
+            )
+        return start, max(start, end)
+
+
+def make_server(state, host="127.0.0.1", port=0):
+    """Return a ThreadingHTTPServer serving the stand-in APIs from state."""
+
+    class MockHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # The headers and a small (e.g. compressed) body are written separately, which
+        # Nagle's algorithm would hold back until the client's delayed ACK
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, code, data=None, headers=()):
+            body = json.dumps(data).encode() if data is not None else b""
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            accepted = self.headers.get("Accept-Encoding", "")
+            if body and state.config.compress and "gzip" in accepted:
+                body = gzip.compress(body, compresslevel=6)
+                self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _json_body(self):
+            length = int(self.headers.get("Content-Length", 0))
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def _handle(self, method):
+            start = time.perf_counter()
+            url = urlparse(self.path)
+            path = url.path
+            query = {k: v[0] for k, v in parse_qs(url.query).items()}
+
+            # Benchmark control endpoints aren't part of either API
+            if path == "/_stats":
+                return self._send(200, state.stats())
+            elif path == "/_reset":
+                state.reset()
+                return self._send(200, {})
+
+            if path.startswith("/up/"):
+                api, route = "up", path[3:]
+                time.sleep(state.config.up_latency)
+            elif path.startswith("/ynab/"):
+                api, route = "ynab", path[5:]
+                time.sleep(state.config.ynab_latency)
+            else:
+                return self._send(404, {})
+
+            stage, handler = self._route(api, method, route)
+            body = self._json_body() if method in ("POST", "PATCH") else None
+
+            failed = handler is None or state.should_fail(stage)
+            if handler is None:
+                self._send(404, {"errors": [{"status": "404"}]})
+            elif failed:
+                code = state.config.error_code
+                self._send(code, {}, [("Retry-After", "1")] if code == 429 else ())
+            else:
+                handler(route, query, body)
+            state.record(stage, time.perf_counter() - start, failed)
+
+        def _route(self, api, method, route):
+            """Return the stage name and handler method for a request."""
+            parts = route.strip("/").split("/")
+            if api == "up" and method == "GET":
+                if parts == ["util", "ping"]:
+                    return "up_ping", self._up_ping
+                elif parts == ["accounts"]:
+                    return "up_accounts", self._up_accounts
+                elif parts == ["transactions"] or (
+                    len(parts) == 3 and parts[0] == "accounts"
+                ):
+                    return "up_transactions", self._up_transactions
+                elif len(parts) == 2 and parts[0] == "transactions":
+                    return "up_transaction", self._up_transaction
+            elif api == "ynab":
+                if method == "GET" and parts == ["user"]:
+                    return "ynab_user", self._ynab_user
+                elif method == "GET" and len(parts) == 2:
+                    return "ynab_budget", self._ynab_budget
+                elif method == "GET" and parts[2:] == ["accounts"]:
+                    return "ynab_accounts", self._ynab_accounts
+                elif method == "GET" and parts[2:] == ["categories"]:
+                    return "ynab_categories", self._ynab_categories
+                elif method == "PATCH" and parts[2:3] == ["months"]:
+                    return "ynab_month_category", self._ynab_month_category
+                elif method == "GET" and parts[-1] == "transactions":
+                    return "ynab_account_transactions", self._ynab_account_transactions
+                elif method == "POST" and parts[2:] == ["transactions"]:
+                    return "ynab_create", self._ynab_create
+                elif method == "PATCH" and parts[2:] == ["transactions"]:
+                    return "ynab_update", self._ynab_update
+                elif method == "DELETE" and parts[2:3] == ["transactions"]:
+                    return "ynab_delete", self._ynab_delete
+            return f"{api}_unknown", None
+
+        def do_GET(self):
+            self._handle("GET")
+
+        def do_POST(self):
+            self._handle("POST")
+
+        def do_PATCH(self):
+            self._handle("PATCH")
+
+        def do_DELETE(self):
+            self._handle("DELETE")
+
+        def _up_ping(self, route, query, body):
+            self._send(200, {"meta": {"id": str(uuid.uuid4()), "statusEmoji": "⚡️"}})
+
+        def _up_accounts(self, route, query, body):
+            accounts = [
+                {
+                    "type": "accounts",
+                    "id": account_id,
+                    "attributes": {
+                        "displayName": name,
+                        "accountType": account_type,
+                        "balance": {"valueInBaseUnits": state.up_balances[account_id]},
+                    },
+                }
+                for account_id, name, account_type in UP_ACCOUNTS
+            ]
+            self._send(200, {"data": accounts, "links": {"prev": None, "next": None}})
+
+        def _up_transactions(self, route, query, body):
+            # Every transaction is served from the transactional account
+            parts = route.strip("/").split("/")
+            account_id = parts[1] if parts[0] == "accounts" else "transactional"
+            account = state.up_accounts.get(account_id)
+            if account is None:
+                return self._send(404, {"errors": [{"status": "404"}]})
+
+            # Up's real cursors are opaque, but here page[after] is just an offset
+            start, end = account.bounds(query)
+            size = min(int(query.get("page[size]", 20)), state.config.max_page_size)
+            offset = start + int(query.get("page[after]", 0))
+            page = account.transactions[offset : min(offset + size, end)]
+
+            next_url = None
+            if offset + size < end:
+                next_query = dict(query, **{"page[after]": offset + size - start})
+                host, port = self.server.server_address[:2]
+                next_url = f"http://{host}:{port}/up{route}?{urlencode(next_query)}"
+            self._send(200, {"data": page, "links": {"prev": None, "next": next_url}})
+
+        def _up_transaction(self, route, query, body):
+            tx = state.up_by_id.get(route.strip("/").split("/")[1])
+            if tx is None:
+                return self._send(404, {"errors": [{"status": "404"}]})
+            self._send(200, {"data": tx})
+
+        def _ynab_headers(self):
+            return [("X-Rate-Limit", "1/200")]
+
+        def _ynab_user(self, route, query, body):
+            self._send(200, {"data": {"user": {"id": "user"}}}, self._ynab_headers())
+
+        def _ynab_accounts(self, route, query, body):
+            accounts = [
+                {
+                    "id": account_id,
+                    "name": name,
+                    "transfer_payee_id": f"payee-{account_id}",
+                    "deleted": False,
+                }
+                for account_id, name in YNAB_ACCOUNTS
+            ]
+            self._send(
+                200,
+                {"data": {"accounts": accounts, "server_knowledge": 0}},
+                self._ynab_headers(),
+            )
+
+        def _ynab_categories(self, route, query, body):
+            last_knowledge = int(query.get("last_knowledge_of_server", 0))
+            with state.lock:
+                categories = [
+                    {k: v for k, v in category.items() if k != "knowledge"}
+                    for category in state.ynab_categories.values()
+                    if category["knowledge"] > last_knowledge
+                    or "last_knowledge_of_server" not in query
+                ]
+                server_knowledge = state.server_knowledge
+            group = {"id": "group", "name": "Goals", "categories": categories}
+            self._send(
+                200,
+                {
+                    "data": {
+                        "category_groups": [group],
+                        "server_knowledge": server_knowledge,
+                    }
+                },
+                self._ynab_headers(),
+            )
+
+        def _ynab_budget(self, route, query, body):
+            # Only the budget's ID and name are sent, as nothing else is used
+            with state.lock:
+                server_knowledge = state.server_knowledge
+            self._send(
+                200,
+                {
+                    "data": {
+                        "budget": {"id": YNAB_BUDGET_ID, "name": "Budget"},
+                        "server_knowledge": server_knowledge,
+                    }
+                },
+                self._ynab_headers(),
+            )
+
+        def _ynab_month_category(self, route, query, body):
+            category_id = route.strip("/").split("/")[5]
+            with state.lock:
+                category = state.ynab_categories.get(category_id)
+                if category is None:
+                    return self._send(404, {"error": {"id": "404.2"}})
+                state.server_knowledge += 1
+                budgeted = body["category"]["budgeted"]
+                category.update(
+                    budgeted=budgeted,
+                    balance=category["balance"] + budgeted - category["budgeted"],
+                    knowledge=state.server_knowledge,
+                )
+                category = {k: v for k, v in category.items() if k != "knowledge"}
+                server_knowledge = state.server_knowledge
+            self._send(
+                200,
+                {"data": {"category": category, "server_knowledge": server_knowledge}},
+                self._ynab_headers(),
+            )
+
+        def _ynab_account_transactions(self, route, query, body):
+            account_id = route.strip("/").split("/")[3]
+            last_knowledge = int(query.get("last_knowledge_of_server", 0))
+            with state.lock:
+                transactions = [
+                    {k: v for k, v in tx.items() if k != "knowledge"}
+                    for tx in state.ynab_transactions.values()
+                    if tx["account_id"] == account_id
+                    and tx["knowledge"] > last_knowledge
+                ]
+                server_knowledge = state.server_knowledge
+            self._send(
+                200,
+                {
+                    "data": {
+                        "transactions": transactions,
+                        "server_knowledge": server_knowledge,
+                    }
+                },
+                self._ynab_headers(),
+            )
+
+        def _ynab_create(self, route, query, body):
+            transaction_ids = []
+            duplicate_import_ids = []
+            with state.lock:
+                state.server_knowledge += 1
+                for tx in body["transactions"]:
+                    if tx["import_id"] in state.ynab_transactions:
+                        duplicate_import_ids.append(tx["import_id"])
+                        continue
+                    transaction_id = str(uuid.uuid4())
+                    state.ynab_transactions[tx["import_id"]] = dict(
+                        tx,
+                        id=transaction_id,
+                        deleted=False,
+                        knowledge=state.server_knowledge,
+                    )
+                    transaction_ids.append(transaction_id)
+
+                    # Create the other side of a transfer in the payee's account
+                    payee_id = tx.get("payee_id") or ""
+                    if payee_id.startswith("payee-"):
+                        other_id = str(uuid.uuid4())
+                        state.ynab_transactions[other_id] = dict(
+                            tx,
+                            id=other_id,
+                            account_id=payee_id[len("payee-") :],
+                            amount=-tx["amount"],
+                            payee_id=f"payee-{tx['account_id']}",
+                            import_id=None,
+                            deleted=False,
+                            knowledge=state.server_knowledge,
+                        )
+                server_knowledge = state.server_knowledge
+            self._send(
+                201,
+                {
+                    "data": {
+                        "transaction_ids": transaction_ids,
+                        "duplicate_import_ids": duplicate_import_ids,
+                        "server_knowledge": server_knowledge,
+                    }
+                },
+                self._ynab_headers(),
+            )
+
+        def _ynab_update(self, route, query, body):
+            transaction_ids = []
+            with state.lock:
+                state.server_knowledge += 1
+                by_id = {tx["id"]: tx for tx in state.ynab_transactions.values()}
+                for update in body["transactions"]:
+                    tx = by_id.get(update.get("id")) or state.ynab_transactions.get(
+                        update.get("import_id")
+                    )
+                    if tx is not None:
+                        tx.update(update, knowledge=state.server_knowledge)
+                        transaction_ids.append(tx["id"])
+                server_knowledge = state.server_knowledge
+            self._send(
+                209,
+                {
+                    "data": {
+                        "transaction_ids": transaction_ids,
+                        "server_knowledge": server_knowledge,
+                    }
+                },
+                self._ynab_headers(),
+            )
+
+        def _ynab_delete(self, route, query, body):
+            transaction_id = route.strip("/").split("/")[3]
+            with state.lock:
+                by_id = {tx["id"]: tx for tx in state.ynab_transactions.values()}
+                tx = by_id.get(transaction_id)
+                if tx is None:
+                    return self._send(404, {"error": {"id": "404.2"}})
+                state.server_knowledge += 1
+                tx.update(deleted=True, knowledge=state.server_knowledge)
+                transaction = {k: v for k, v in tx.items() if k != "knowledge"}
+                server_knowledge = state.server_knowledge
+            self._send(
+                200,
+                {
+                    "data": {
+                        "transaction": transaction,
+                        "server_knowledge": server_knowledge,
+                    }
+                },
+                self._ynab_headers(),
+            )
+
+    return ThreadingHTTPServer((host, port), MockHandler)
+
+
+def _serve(config, connection):
+    server = make_server(MockState(config))
+    connection.send(server.server_address[1])
+    server.serve_forever()
+
+
+class MockServerProcess:
+    """Runs the stand-in APIs in a separate process, so that they share neither the
+    GIL nor the memory measurements of the code being benchmarked.
+
+    Use as a context manager; up_url and ynab_url are the base URLs of the APIs.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.process = None
+        self.port = None
+
+    def __enter__(self):
+        parent, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=_serve, args=(self.config, child), daemon=True
+        )
+        self.process.start()
+        self.port = parent.recv()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.process.terminate()
+        self.process.join()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    @property
+    def up_url(self):
+        return self.base_url + "/up"
+
+    @property
+    def ynab_url(self):
+        return self.base_url + "/ynab"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--transactions", type=int, default=10000)
+    parser.add_argument("--up-latency", type=float, default=0.0)
+    parser.add_argument("--ynab-latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-code", type=int, default=503)
+    parser.add_argument("--error-stages", nargs="*")
+    parser.add_argument("--transfers", type=int, default=0)
+    parser.add_argument("--no-compress", action="store_true")
+    args = parser.parse_args()
+
+    config = MockConfig(
+        transactions=args.transactions,
+        up_latency=args.up_latency,
+        ynab_latency=args.ynab_latency,
+        error_rate=args.error_rate,
+        error_code=args.error_code,
+        error_stages=args.error_stages,
+        transfers=args.transfers,
+        compress=not args.no_compress,
+    )
+    server = make_server(MockState(config), port=args.port)
+    print(f"Serving the stand-in APIs at http://127.0.0.1:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
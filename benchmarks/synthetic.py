@@ -0,0 +1,101 @@
+"""Generators of synthetic Up API data for the benchmarks."""
+
+import datetime
+import uuid
+
+# Up reports times in Australian local time
+UP_TIMEZONE = datetime.timezone(datetime.timedelta(hours=10))
+
+
+def up_transaction(i, created_at, account_id="transactional", id_offset=0):
+    """Return the data of a single synthetic Up transaction, as in the API. Its ID is
+    made from i plus id_offset, which keeps the IDs of different accounts apart."""
+    created = created_at.isoformat(timespec="seconds")
+    return {
+        "type": "transactions",
+        "id": str(uuid.UUID(int=id_offset + i + 1)),
+        "attributes": {
+            "status": "SETTLED",
+            "rawText": f"SHOP {i % 500} SYDNEY",
+            "description": f"Shop {i % 500}",
+            "message": None,
+            "holdInfo": None,
+            "roundUp": None,
+            "cashback": None,
+            "amount": {
+                "currencyCode": "AUD",
+                "value": f"-{(i % 10000 + 1) / 100:.2f}",
+                "valueInBaseUnits": -(i % 10000 + 1),
+            },
+            # Roughly one in fifty transactions is in a foreign currency
+            "foreignAmount": (
+                None
+                if i % 50
+                else {"currencyCode": "USD", "value": "-1.00", "valueInBaseUnits": -100}
+            ),
+            "settledAt": created,
+            "createdAt": created,
+        },
+        "relationships": {
+            "account": {"data": {"type": "accounts", "id": account_id}},
+            "transferAccount": {"data": None},
+            "category": {"data": None},
+            "parentCategory": {"data": None},
+            "tags": {"data": []},
+        },
+        "links": {"self": f"https://api.up.com.au/api/v1/transactions/{i}"},
+    }
+
+
+def up_transactions(
+    count, account_id="transactional", end=None, spacing=None, id_offset=0
+):
+    """Return a list of count synthetic Up transactions in the account, newest first
+    as the API returns them, spaced spacing apart (default 10 minutes) up to end
+    (default now). Transactions of another account need a different id_offset (such
+    as 2 << 64), so that their IDs don't collide."""
+    if end is None:
+        end = datetime.datetime.now(UP_TIMEZONE).replace(microsecond=0)
+    if spacing is None:
+        spacing = datetime.timedelta(minutes=10)
+    return [
+        up_transaction(i, end - i * spacing, account_id=account_id, id_offset=id_offset)
+        for i in range(count)
+    ]
+
+
+def up_transfers(count, from_account, to_account, end=None, spacing=None):
+    """Return the outgoing and incoming sides of count synthetic transfers between two
+    Up accounts, as two lists newest first, such as round ups to a Saver. Both sides of
+    each are created at the same time, 5 minutes after those of up_transactions with
+    the same end and spacing."""
+    if end is None:
+        end = datetime.datetime.now(UP_TIMEZONE).replace(microsecond=0)
+    if spacing is None:
+        spacing = datetime.timedelta(minutes=10)
+    end -= datetime.timedelta(minutes=5)
+
+    outgoing = []
+    incoming = []
+    for i in range(count):
+        for sides, account_id, other_id, sign in (
+            (outgoing, from_account, to_account, -1),
+            (incoming, to_account, from_account, 1),
+        ):
+            transaction = up_transaction(i, end - i * spacing, account_id=account_id)
+            # Keep the IDs apart from those of up_transactions and each other
+            transaction["id"] = str(uuid.UUID(int=(1 << 64) + 2 * i + (sign > 0)))
+            transaction["attributes"].update(
+                description="Round Up" if sign > 0 else f"Transfer to {other_id}",
+                foreignAmount=None,
+                amount={
+                    "currencyCode": "AUD",
+                    "value": f"{sign * (i % 99 + 1) / 100:.2f}",
+                    "valueInBaseUnits": sign * (i % 99 + 1),
+                },
+            )
+            transaction["relationships"]["transferAccount"] = {
+                "data": {"type": "accounts", "id": other_id}
+            }
+            sides.append(transaction)
+    return outgoing, incoming
@@ -1,6 +1,17 @@
 import click
 
-from up2ynab.commands import *
+from up2ynab.clients import DEFAULT_POOL_SIZE, DEFAULT_TIMEOUT
+from up2ynab.clients.scheduler import (
+    DEFAULT_MAX_WAIT,
+    DEFAULT_RETRIES,
+    RequestScheduler,
+)
+from up2ynab.clients.up import UP_API_URL
+from up2ynab.clients.ynab import YNAB_API_URL
+from up2ynab.util.json_echo import JSONEchoManager
+from up2ynab.util.lazy import LazyDict, LazyGroup
+from up2ynab.util.metadata_cache import MetadataCache
+from up2ynab.util.metrics import Metrics
 from up2ynab.util.pretty_echo import EchoManager
 
 # The required=False flags for the two API tokens are set that way to bypass click's
@@ -8,7 +19,24 @@ from up2ynab.util.pretty_echo import EchoManager
 # specific error/help information if they are unset, and other commands will fail with
 # an authentication error, which also directs users to `up2ynab check` (if
 # up2ynab.util.http_error_handler is used).
-@click.group()
+# The subcommands are imported when they're run, rather than all up front, so that
+# the CLI starts quickly
+@click.group(
+    cls=LazyGroup,
+    lazy_subcommands={
+        "apply": "up2ynab.commands.apply.apply",
+        "backfill": "up2ynab.commands.backfill.backfill",
+        "batch": "up2ynab.commands.batch.batch",
+        "check": "up2ynab.commands.check.check",
+        "export": "up2ynab.commands.export.export",
+        "import-file": "up2ynab.commands.import_file.import_file",
+        "plan": "up2ynab.commands.plan.plan",
+        "savers": "up2ynab.commands.savers.savers",
+        "transactions": "up2ynab.commands.transactions.transactions",
+        "watch": "up2ynab.commands.watch.watch",
+        "serve": "up2ynab.commands.serve.serve",
+    },
+)
 @click.option(
     "--up-api-token",
     required=False,
@@ -21,8 +49,88 @@ from up2ynab.util.pretty_echo import EchoManager
     envvar="YNAB_API_TOKEN",
     help="Your personal access token for the YNAB API.",
 )
+@click.option(
+    "--http-timeout",
+    default=DEFAULT_TIMEOUT,
+    envvar="UP2YNAB_HTTP_TIMEOUT",
+    help="Seconds to wait for a response from either API before giving up.",
+    show_default=True,
+    type=float,
+)
+@click.option(
+    "--http-pool-size",
+    default=DEFAULT_POOL_SIZE,
+    envvar="UP2YNAB_HTTP_POOL_SIZE",
+    help="Maximum number of kept-alive connections to each API host.",
+    show_default=True,
+    type=click.IntRange(min=1),
+)
+@click.option(
+    "--http-retries",
+    default=DEFAULT_RETRIES,
+    envvar="UP2YNAB_HTTP_RETRIES",
+    help="Number of times to retry a request that fails with a network error, rate"
+    + " limit or server error, after a growing delay.",
+    show_default=True,
+    type=click.IntRange(min=0),
+)
+@click.option(
+    "--max-rate-limit-wait",
+    default=DEFAULT_MAX_WAIT,
+    envvar="UP2YNAB_MAX_RATE_LIMIT_WAIT",
+    help="Maximum number of seconds to hold back a request so that it stays within an"
+    + " API's rate limit, which is shared by every up2ynab command running at once."
+    + " Past this, the request is sent anyway and fails if the limit is exceeded.",
+    show_default=True,
+    type=click.FloatRange(min=0),
+)
+@click.option(
+    "--refresh-cache",
+    is_flag=True,
+    help="Fetch account IDs from the APIs instead of using the ones cached locally"
+    + " from previous runs.",
+)
+@click.option(
+    "--metrics-json",
+    envvar="UP2YNAB_METRICS_JSON",
+    help="Write the timings of each stage of the command, and statistics of the HTTP"
+    + " requests it made, as JSON to this file (or - for stdout) when it finishes."
+    + " Can also be set by UP2YNAB_METRICS_JSON environment variable.",
+    type=click.Path(dir_okay=False, allow_dash=True),
+)
+@click.option(
+    "--output",
+    type=click.Choice(["auto", "text", "json"], case_sensitive=False),
+    default="auto",
+    envvar="UP2YNAB_OUTPUT",
+    help="How to show progress: as styled text with a spinner, or as a JSON object"
+    + " per line for logs. With auto, JSON is used when the output isn't a terminal."
+    + " Can also be set by UP2YNAB_OUTPUT environment variable.",
+    show_default=True,
+)
+# The API URLs are hidden, as they only need changing to run against stand-in servers
+# for benchmarking
+@click.option(
+    "--up-api-url", default=UP_API_URL, envvar="UP2YNAB_UP_API_URL", hidden=True
+)
+@click.option(
+    "--ynab-api-url", default=YNAB_API_URL, envvar="UP2YNAB_YNAB_API_URL", hidden=True
+)
 @click.pass_context
-def cli(ctx, up_api_token, ynab_api_token):
+def cli(
+    ctx,
+    up_api_token,
+    ynab_api_token,
+    http_timeout,
+    http_pool_size,
+    http_retries,
+    max_rate_limit_wait,
+    refresh_cache,
+    metrics_json,
+    output,
+    up_api_url,
+    ynab_api_url,
+):
     """A command-line interface for synchronising the Up neobank with the budgeting
     app You Need A Budget.
     
@@ -33,13 +141,45 @@ def cli(ctx, up_api_token, ynab_api_token):
 
     for details on the recommended way of configuration using environment variables.
     """
-    ctx.obj = {
-        "up_token": up_api_token,
-        "ynab_token": ynab_api_token,
-        "echo_manager": EchoManager(),
-    }
+    # Don't fill logs with spinner frames when the output isn't going to a terminal
+    if output == "auto":
+        output = "text" if click.get_text_stream("stdout").isatty() else "json"
+    echo_manager = JSONEchoManager() if output == "json" else EchoManager()
+
+    # Metrics are always recorded, as it's cheap, but only written out if asked for
+    metrics = Metrics()
+    if metrics_json is not None:
+        ctx.call_on_close(
+            lambda: metrics.write(metrics_json, command=ctx.invoked_subcommand)
+        )
+
+    def make_session():
+        # A single session is shared by every client a command creates, so connections
+        # to each API are pooled and kept alive for the duration of the command. It's
+        # only created (and requests imported) once a command needs it.
+        from up2ynab.clients.session import PooledSession
 
+        # Requests are paced to stay within the rate limits, and retried if they fail
+        # for a transient reason
+        scheduler = RequestScheduler(
+            retries=http_retries, max_wait=max_rate_limit_wait, metrics=metrics
+        )
+        session = PooledSession(
+            pool_size=http_pool_size, timeout=http_timeout, scheduler=scheduler
+        )
+        session.hooks["response"].append(metrics.record_response)
+        ctx.call_on_close(session.close)
+        return session
 
-cli.add_command(check)
-cli.add_command(transactions)
-cli(obj={})
+    ctx.obj = LazyDict(
+        {
+            "up_token": up_api_token,
+            "ynab_token": ynab_api_token,
+            "up_api_url": up_api_url,
+            "ynab_api_url": ynab_api_url,
+            "echo_manager": echo_manager,
+            "cache": MetadataCache(refresh=refresh_cache),
+            "metrics": metrics,
+        },
+        factories={"session": make_session},
+    )
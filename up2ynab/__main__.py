@@ -0,0 +1,5 @@
+from up2ynab import cli
+
+# Guarded, as the worker processes of `up2ynab batch` import the main module
+if __name__ == "__main__":
+    cli(prog_name="up2ynab")
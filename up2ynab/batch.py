@@ -0,0 +1,211 @@
+import contextlib
+import io
+import json
+import os
+import re
+import time
+import traceback
+from collections import namedtuple
+
+import click
+
+from up2ynab.util.app_dir import APP_DIR_ENVVAR, app_dir
+
+# Tenant names are used in file and directory names, so are limited to these
+# characters, and can't be only dots
+_TENANT_NAME = re.compile(r"^(?!\.+$)[A-Za-z0-9_.-]+$")
+
+# The keys a tenant can have in a batch file
+_TENANT_KEYS = frozenset(
+    (
+        "name",
+        "up_api_token",
+        "up_api_token_env",
+        "ynab_api_token",
+        "ynab_api_token_env",
+        "args",
+    )
+)
+
+# A household synced by a batch, with its own API tokens. args are the arguments given
+# to up2ynab after the tokens, i.e. the command and its options.
+Tenant = namedtuple("Tenant", ("name", "up_api_token", "ynab_api_token", "args"))
+
+# The result of running a tenant's command: its exit code (0 if it succeeded), how long
+# it took, the counts of its final success message, and its last error message
+TenantResult = namedtuple(
+    "TenantResult", ("name", "exit_code", "seconds", "counts", "error")
+)
+
+
+def default_log_dir():
+    """Return the default directory for the output of each tenant in a batch, in the
+    user's app directory."""
+    return os.path.join(app_dir(), "batch-logs")
+
+
+def default_data_dir():
+    """Return the default directory for the local files of each tenant in a batch, in
+    the user's app directory."""
+    return os.path.join(app_dir(), "tenants")
+
+
+def _token(tenant, index, name, environ):
+    """Return a tenant's API token, given either directly or as the name of an
+    environment variable holding it."""
+    if name in tenant:
+        token = tenant[name]
+    elif f"{name}_env" in tenant:
+        token = environ.get(tenant[f"{name}_env"])
+        if not token:
+            raise ValueError(
+                f"tenant {index}'s {name}_env variable"
+                f" {tenant[f'{name}_env']} isn't set"
+            )
+    else:
+        raise ValueError(f"tenant {index} has neither {name} nor {name}_env")
+    if not isinstance(token, str):
+        raise ValueError(f"tenant {index}'s {name} is not a string")
+    return token
+
+
+def load_tenants(path, environ=None):
+    """Read the list of Tenants in a JSON batch file. Raises a ValueError if the file
+    isn't a valid batch file.
+
+    The file is an object with a list of "tenants", each with a unique "name", its Up
+    and YNAB API tokens (or the names of environment variables in environ, by default
+    os.environ, holding them) and optionally the "args" to run up2ynab with, which
+    default to ["transactions"].
+    """
+    if environ is None:
+        environ = os.environ
+    with open(path, encoding="utf-8") as f:
+        try:
+            data = json.load(f)
+        except ValueError as e:
+            raise ValueError(f"not valid JSON: {e}")
+
+    if not isinstance(data, dict) or not isinstance(data.get("tenants"), list):
+        raise ValueError('it must be an object with a list of "tenants"')
+
+    tenants = []
+    names = set()
+    for index, tenant in enumerate(data["tenants"], start=1):
+        if not isinstance(tenant, dict):
+            raise ValueError(f"tenant {index} is not an object")
+        unknown = set(tenant) - _TENANT_KEYS
+        if unknown:
+            raise ValueError(f"tenant {index} has unknown keys {', '.join(unknown)}")
+
+        name = tenant.get("name")
+        if not isinstance(name, str) or not _TENANT_NAME.match(name):
+            raise ValueError(
+                f"tenant {index}'s name must be letters, digits, '.', '-' or '_'"
+            )
+        if name in names:
+            raise ValueError(f"more than one tenant is called {name}")
+        names.add(name)
+
+        args = tenant.get("args", ["transactions"])
+        if (
+            not isinstance(args, list)
+            or not args
+            or not all(isinstance(arg, str) for arg in args)
+        ):
+            raise ValueError(f"tenant {index}'s args must be a list of strings")
+        if args[0] == "batch":
+            raise ValueError(f"tenant {index} can't run another batch")
+
+        tenants.append(
+            Tenant(
+                name,
+                _token(tenant, index, "up_api_token", environ),
+                _token(tenant, index, "ynab_api_token", environ),
+                args,
+            )
+        )
+    return tenants
+
+
+def _summarise(output):
+    """Return the counts of the final success event and the message of the last error
+    in the JSON Lines output of a command."""
+    counts = None
+    error = None
+    for line in output.splitlines():
+        try:
+            event = json.loads(line)
+        except ValueError:
+            # e.g. a usage error or traceback
+            if line.strip():
+                error = line.strip()
+            continue
+        if not isinstance(event, dict):
+            continue
+        if event.get("event") == "success":
+            counts = event.get("counts")
+        elif event.get("event") in ("error", "fatal"):
+            error = event.get("message")
+    return counts, error
+
+
+def run_tenant(tenant, log_dir, data_dir):
+    """Run a Tenant's command in this process, with its output written to a log file
+    in log_dir and its local files (such as its incremental import state, YNAB mirror
+    and caches) kept in its own directory in data_dir, and return its TenantResult.
+
+    This is run in the worker processes of a batch, one tenant at a time, so that the
+    interpreter and up2ynab are only loaded once for each worker. The command's output
+    is JSON Lines, and its metrics are written alongside it. Any error is caught and
+    recorded in the result, so one tenant failing doesn't affect the others.
+    """
+    # Imported here, as the worker processes import this module before up2ynab itself
+    from up2ynab import cli
+
+    log_path = os.path.join(log_dir, f"{tenant.name}.log")
+    args = [
+        "--output",
+        "json",
+        "--metrics-json",
+        os.path.join(log_dir, f"{tenant.name}.metrics.json"),
+        "--up-api-token",
+        tenant.up_api_token,
+        "--ynab-api-token",
+        tenant.ynab_api_token,
+    ] + tenant.args
+
+    # Point the command at the tenant's own app directory, as the worker process runs
+    # other tenants before and after this one
+    previous_app_dir = os.environ.get(APP_DIR_ENVVAR)
+    os.environ[APP_DIR_ENVVAR] = os.path.join(data_dir, tenant.name)
+
+    output = io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+        try:
+            exit_code = cli.main(args, prog_name="up2ynab", standalone_mode=False)
+            if not isinstance(exit_code, int):
+                exit_code = 0
+        except SystemExit as e:
+            exit_code = e.code if isinstance(e.code, int) else 1
+        except click.ClickException as e:
+            e.show()
+            exit_code = e.exit_code
+        except click.Abort:
+            exit_code = 1
+        except Exception:
+            traceback.print_exc()
+            exit_code = 1
+        finally:
+            if previous_app_dir is None:
+                del os.environ[APP_DIR_ENVVAR]
+            else:
+                os.environ[APP_DIR_ENVVAR] = previous_app_dir
+    seconds = time.perf_counter() - start
+
+    text = output.getvalue()
+    with open(log_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    counts, error = _summarise(text)
+    return TenantResult(tenant.name, exit_code, seconds, counts, error)
@@ -0,0 +1,12 @@
+# Defaults for the HTTP session shared by the clients. They are defined here rather than
+# in session.py so that the CLI can show them without importing requests.
+DEFAULT_TIMEOUT = 30
+DEFAULT_POOL_SIZE = 10
+
+
+class MissingTokenError(Exception):
+    """Raised when a client needs the API token of an API that wasn't given one."""
+
+    def __init__(self, api_name):
+        super().__init__(f"No {api_name} API token was given")
+        self.api_name = api_name
@@ -0,0 +1,291 @@
+import email.utils
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+from up2ynab.util.app_dir import app_dir
+from up2ynab.util.metadata_cache import token_key
+
+try:
+    import fcntl
+except ImportError:
+    # Without file locks (i.e. on Windows), the budget is only shared between the
+    # threads of one process
+    fcntl = None
+
+# The period that the limit in YNAB's X-Rate-Limit header applies to, in seconds
+RATE_LIMIT_WINDOW = 60 * 60
+
+# The number of times to retry a request that failed for a transient reason
+DEFAULT_RETRIES = 3
+
+# The longest time to wait for a rate limit before sending a request anyway (and
+# letting it fail), in seconds
+DEFAULT_MAX_WAIT = 60 * 60
+
+# The delay before the first retry, which doubles for each one after, up to the max
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 60
+
+# Requests that can be sent again without changing the result. Both APIs' PATCH
+# endpoints set fields to the values given, so they are safe to repeat too.
+IDEMPOTENT_METHODS = frozenset(("GET", "HEAD", "OPTIONS", "PUT", "DELETE", "PATCH"))
+
+# Response codes worth retrying after a delay
+RETRY_STATUS_CODES = frozenset((429, 500, 502, 503, 504))
+
+
+def default_state_path():
+    """Return the default location of the shared rate limit state in the user's app
+    directory."""
+    return os.path.join(app_dir(), "rate_limits.json")
+
+
+def parse_rate_limit(value):
+    """Return the (used, limit) pair from a rate limit header like "36/200", or None if
+    it can't be parsed."""
+    used, _, limit = (value or "").partition("/")
+    if used.isdigit() and limit.isdigit() and int(limit) > 0:
+        return int(used), int(limit)
+    return None
+
+
+def rate_limit_remaining(headers):
+    """Return the (remaining, limit) pair of requests from an API's rate limit response
+    headers, or None if there aren't any.
+
+    YNAB reports the requests used in the current hour as "X-Rate-Limit: 36/200",
+    while Up (like many other APIs) uses separate X-RateLimit-Remaining and
+    X-RateLimit-Limit headers, where the limit may be missing.
+    """
+    rate_limit = parse_rate_limit(headers.get("X-Rate-Limit"))
+    if rate_limit is not None:
+        used, limit = rate_limit
+        return limit - used, limit
+
+    remaining = headers.get("X-RateLimit-Remaining", "")
+    limit = headers.get("X-RateLimit-Limit", "")
+    if remaining.isdigit():
+        return int(remaining), int(limit) if limit.isdigit() else None
+    return None
+
+
+def parse_retry_after(value):
+    """Return the number of seconds to wait from a Retry-After header, which is either
+    a number of seconds or an HTTP date, or None if it can't be parsed."""
+    value = (value or "").strip()
+    if value.isdigit():
+        return int(value)
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class RequestScheduler:
+    """Paces the requests to each API to stay within its rate limit, and retries
+    requests that fail for a transient reason.
+
+    Each API token's budget at each API host is a token bucket, which is refilled at the
+    rate given by the rate limit headers of the API's responses, and set to what the
+    API says is remaining each time one arrives. When an API (such as Up) only reports
+    what's remaining, the most it has ever reported stands in for the limit, refilled
+    over an hour. A 429 (or 503) response's Retry-After holds back every request to
+    that API until it has passed. The budgets are kept in a JSON file locked for each
+    update, so that several up2ynab processes running at once share them. The file is
+    only read again when it has been changed by another process.
+
+    Idempotent requests that fail with a connection error, timeout, rate limit or
+    server error are retried up to retries times, after a jittered exponential backoff.
+    A request is never held back for longer than max_wait seconds in total.
+    """
+
+    def __init__(
+        self,
+        path=None,
+        retries=DEFAULT_RETRIES,
+        max_wait=DEFAULT_MAX_WAIT,
+        metrics=None,
+    ):
+        self.path = path if path is not None else default_state_path()
+        self.retries = retries
+        self.max_wait = max_wait
+        self.metrics = metrics
+        self.lock = threading.Lock()
+        # The last state read or written, and the stat of the file it was in
+        self.state = {}
+        self.state_stat = None
+
+    def _file_stat(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _load(self):
+        """Return the budgets of every API, only reading the file if it has changed
+        since it was last read or written. Must be called with the lock held."""
+        stat = self._file_stat()
+        if stat is None:
+            self.state, self.state_stat = {}, None
+        elif stat != self.state_stat:
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    self.state = json.load(f)
+            except (OSError, ValueError):
+                self.state = {}
+            self.state_stat = stat
+        return self.state
+
+    def _has_budget(self, key):
+        """Return whether there's a budget for key, without locking the file."""
+        with self.lock:
+            return key in self._load()
+
+    @contextmanager
+    def _shared_state(self):
+        """Yield the budgets of every API, locked against other threads and processes,
+        and save them afterwards if they were changed."""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        with self.lock:
+            os.makedirs(directory, exist_ok=True)
+            with open(self.path + ".lock", "a") as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                state = self._load()
+                saved = json.dumps(state)
+                try:
+                    yield state
+                except BaseException:
+                    # The state may have been left half changed, so read it again
+                    self.state_stat = None
+                    raise
+
+                if json.dumps(state) != saved:
+                    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+                    with os.fdopen(fd, "w", encoding="utf-8") as f:
+                        json.dump(state, f)
+                    os.replace(tmp_path, self.path)
+                    self.state_stat = self._file_stat()
+
+    @staticmethod
+    def _key(url, headers):
+        """Return the name of the budget for requests to url with the given headers,
+        which is shared by requests made with the same API token."""
+        authorization = (headers or {}).get("Authorization", "")
+        return token_key(authorization, urlparse(url).netloc)
+
+    @staticmethod
+    def _refill(bucket, now):
+        limit = bucket.get("limit")
+        if limit is not None:
+            elapsed = max(0.0, now - bucket["updated"])
+            tokens = bucket["tokens"] + elapsed * limit / RATE_LIMIT_WINDOW
+            bucket["tokens"] = min(limit, tokens)
+        bucket["updated"] = now
+
+    def acquire(self, url, headers=None):
+        """Wait until a request to url can be sent within its API's rate limit, then
+        take a token for it from the budget. Returns the number of seconds waited."""
+        key = self._key(url, headers)
+        # Until an API has reported its rate limit, there's nothing to wait for
+        if not self._has_budget(key):
+            return 0.0
+        waited = 0.0
+        while True:
+            with self._shared_state() as state:
+                bucket = state.get(key)
+                if bucket is None:
+                    return waited
+                now = time.time()
+                self._refill(bucket, now)
+                wait = bucket.get("blocked_until", 0) - now
+                if bucket.get("limit") is not None and bucket["tokens"] < 1:
+                    refill_time = RATE_LIMIT_WINDOW / bucket["limit"]
+                    wait = max(wait, (1 - bucket["tokens"]) * refill_time)
+                if wait <= 0 or waited + wait > self.max_wait:
+                    if bucket.get("limit") is not None:
+                        bucket["tokens"] -= 1
+                    return waited
+            # Check again after waiting, as other processes may have used the budget
+            time.sleep(wait)
+            waited += wait
+
+    def update(self, response):
+        """Update the budget of the response's API from its rate limit headers.
+        Returns the number of seconds the response asked to wait before retrying, or
+        None if it didn't."""
+        rate_limit = rate_limit_remaining(response.headers)
+        retry_after = None
+        if response.status_code in (429, 503):
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        if rate_limit is None and retry_after is None:
+            return None
+
+        key = self._key(response.request.url, response.request.headers)
+        with self._shared_state() as state:
+            now = time.time()
+            bucket = state.setdefault(key, {"updated": now})
+            self._refill(bucket, now)
+            if rate_limit is not None:
+                remaining, limit = rate_limit
+                if limit is None:
+                    limit = max(bucket.get("limit") or 0, remaining)
+                if limit > 0:
+                    bucket["limit"] = limit
+                bucket["tokens"] = remaining
+            if retry_after is not None:
+                blocked_until = max(bucket.get("blocked_until", 0), now + retry_after)
+                bucket["blocked_until"] = blocked_until
+        return retry_after
+
+    @staticmethod
+    def backoff(attempt):
+        """Return the delay before retry number attempt (from 0), which is between
+        half and all of an exponentially increasing delay."""
+        delay = min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _add_time(self, stage, seconds):
+        if self.metrics is not None and seconds:
+            self.metrics.add_stage_time(stage, seconds)
+
+    def send(self, method, url, send, headers=None):
+        """Send a request by calling send(), once the rate limit of its API allows it,
+        and retry it if it is idempotent and fails for a transient reason. Returns the
+        last response, or raises the last connection error."""
+        from requests.exceptions import ConnectionError, Timeout
+
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        attempt = 0
+        while True:
+            self._add_time("rate_limit_wait", self.acquire(url, headers))
+            try:
+                r = send()
+            except (ConnectionError, Timeout):
+                if not idempotent or attempt >= self.retries:
+                    raise
+            else:
+                retry_after = self.update(r)
+                if (
+                    not idempotent
+                    or r.status_code not in RETRY_STATUS_CODES
+                    or attempt >= self.retries
+                    or (retry_after or 0) > self.max_wait
+                ):
+                    return r
+                # Let the connection go back to the pool before retrying
+                r.close()
+
+            # Any Retry-After is waited for by acquire, as it applies to every request
+            delay = self.backoff(attempt)
+            time.sleep(delay)
+            self._add_time("retry_backoff", delay)
+            attempt += 1
@@ -0,0 +1,39 @@
+import requests
+from requests.adapters import HTTPAdapter
+
+from up2ynab.clients import DEFAULT_POOL_SIZE, DEFAULT_TIMEOUT
+
+
+class PooledSession(requests.Session):
+    """A requests.Session with a sized connection pool and a default timeout.
+
+    A single PooledSession is intended to be shared by the Up and YNAB clients, so that
+    TCP/TLS connections are kept alive and reused between requests rather than opened
+    afresh for every call. Any object with the same get/post/request interface can be
+    passed to the clients in its place.
+
+    If a RequestScheduler is given, every request is sent through it, so that requests
+    are paced to stay within the APIs' rate limits and retried if they fail for a
+    transient reason.
+    """
+
+    def __init__(
+        self, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT, scheduler=None
+    ):
+        super().__init__()
+        self.timeout = timeout
+        self.scheduler = scheduler
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        if self.scheduler is None:
+            return super().request(method, url, **kwargs)
+        return self.scheduler.send(
+            method,
+            url,
+            lambda: super(PooledSession, self).request(method, url, **kwargs),
+            headers=kwargs.get("headers"),
+        )
@@ -1,22 +1,111 @@
-import requests
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from up2ynab.clients import MissingTokenError
+from up2ynab.util.json_stream import load_streamed
+from up2ynab.util.metadata_cache import token_key
+from up2ynab.util.metrics import Metrics
+
+# The base URL of every Up API endpoint
+UP_API_URL = "https://api.up.com.au/api/v1"
+
+# The number of transactions to request per page. The Up API allows at most 100.
+DEFAULT_PAGE_SIZE = 100
+
+# The fields of each transaction that are kept when pages are decoded for syncing. The
+# rest, such as rawText, roundUp, cashback and every link, are dropped as they arrive.
+TRANSACTION_ATTRIBUTES = (
+    "status",
+    "description",
+    "amount",
+    "foreignAmount",
+    "createdAt",
+    "settledAt",
+)
+TRANSACTION_RELATIONSHIPS = (
+    "account",
+    "transferAccount",
+    "category",
+    "parentCategory",
+    "tags",
+)
+
+# The number of bytes of a streamed page to decode at a time
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def _up_timestamp(dt):
+    """Format a datetime as a UTC timestamp for the Up API's filters, treating a naive
+    datetime as being in local time."""
+    return dt.astimezone(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S+00:00")
+
+
+def _created_at(transaction):
+    return datetime.datetime.fromisoformat(transaction["attributes"]["createdAt"])
+
+
+def trim_transaction(transaction):
+    """Return Up API transaction data with only the TRANSACTION_ATTRIBUTES and
+    TRANSACTION_RELATIONSHIPS that up2ynab uses, the latter without their links."""
+    attributes = transaction["attributes"]
+    relationships = transaction.get("relationships", {})
+    return {
+        "id": transaction["id"],
+        "attributes": {name: attributes.get(name) for name in TRANSACTION_ATTRIBUTES},
+        "relationships": {
+            name: {"data": relationships[name].get("data")}
+            for name in TRANSACTION_RELATIONSHIPS
+            if name in relationships
+        },
+    }
 
 
 class UpClient:
-    def __init__(self, api_token):
+    def __init__(
+        self, api_token, session=None, cache=None, base_url=UP_API_URL, metrics=None
+    ):
+        """session is the requests.Session-like object used for all HTTP requests. If
+        not provided, a new PooledSession is created for this client.
+
+        cache is an optional MetadataCache used to remember the accounts between runs.
+
+        base_url is the URL the API endpoints are relative to, which only needs to be
+        changed to use a stand-in for the Up API, e.g. for benchmarking.
+
+        metrics is the Metrics that the timings of the client's operations are recorded
+        in. If not provided, a new one is created for this client.
+        """
+        self.base_url = base_url
+        self.metrics = metrics if metrics is not None else Metrics()
         self.api_token = api_token
-        self.headers = {"Authorization": f"Bearer {self.api_token}"}
+        # Ask for compressed responses, as pages of transactions compress very well
+        self.headers = {
+            "Authorization": f"Bearer {self.api_token}",
+            "Accept-Encoding": "gzip",
+        }
+        if session is None:
+            # Only import requests once it's needed, to keep the CLI quick to start
+            from up2ynab.clients.session import PooledSession
 
-    @staticmethod
-    def up_url(endpoint):
+            session = PooledSession()
+        self.session = session
+        self.cache = cache
+        self.accounts_cached = False
+        self.tx_acct_id = None
+
+    def up_url(self, endpoint):
         """Return the full URL corresponding to the specified Up API endpoint."""
-        return "https://api.up.com.au/api/v1" + endpoint
+        return self.base_url + endpoint
 
     def up_get(self, endpoint, **kwargs):
-        """Use requests.get to get data from the specified Up API endpoint."""
-        return requests.get(UpClient.up_url(endpoint), headers=self.headers, **kwargs)
+        """Use the session to get data from the specified Up API endpoint."""
+        return self.session.get(self.up_url(endpoint), headers=self.headers, **kwargs)
 
-    def is_authenticated(self):
-        r = self.up_get("/util/ping")
+    def is_authenticated(self, timeout=None):
+        """Return whether the API token is accepted. timeout is the number of seconds
+        to wait for a response, if not the session's default."""
+        kwargs = {} if timeout is None else {"timeout": timeout}
+        r = self.up_get("/util/ping", **kwargs)
 
         # 401 means not authenticated properly, 200 means good to go
         if r.status_code == 401:
@@ -27,13 +116,64 @@ class UpClient:
         # If it's neither 200 nor 401, raise it as an error
         r.raise_for_status()
 
-    def get_transactional_account_id(self):
-        r = self.up_get("/accounts")
-        r.raise_for_status()
-        json_data = r.json()
+    def get_accounts(self, refresh=False):
+        """Return the data of every account, both transactional and Savers.
+
+        If the client has a cache, the ID, display name and type of each account are
+        returned from it unless refresh is True, and accounts_cached is set to whether
+        they were.
+        """
+        # The cache is keyed by the token, so check it's there before using it
+        if self.api_token is None:
+            raise MissingTokenError("Up")
+        if self.cache is not None and not refresh:
+            accounts = self.cache.get(token_key(self.api_token, "up_accounts"))
+            if accounts is not None:
+                self.accounts_cached = True
+                return accounts
+
+        # Ask for the largest page, so that every account usually comes in one request
+        json_response = self._get_page(
+            self.up_url("/accounts"), params={"page[size]": DEFAULT_PAGE_SIZE}
+        )
+        accounts = json_response["data"]
+        while json_response["links"]["next"] is not None:
+            json_response = self._get_page(json_response["links"]["next"])
+            accounts.extend(json_response["data"])
+
+        self.accounts_cached = False
+        if self.cache is not None:
+            self.cache.set(
+                token_key(self.api_token, "up_accounts"),
+                [
+                    {
+                        "id": acc["id"],
+                        "attributes": {
+                            "displayName": acc["attributes"]["displayName"],
+                            "accountType": acc["attributes"]["accountType"],
+                        },
+                    }
+                    for acc in accounts
+                ],
+            )
+        return accounts
+
+    def invalidate_cache(self):
+        """Forget any cached accounts, so they are fetched again next time."""
+        if self.cache is not None and self.api_token is not None:
+            self.cache.invalidate(token_key(self.api_token, "up_accounts"))
+
+    def get_transactional_account_id(self, accounts=None):
+        """Find the ID of the single transactional account and store it as tx_acct_id.
+
+        accounts is the account data as returned by get_accounts, which is fetched if
+        not provided.
+        """
+        if accounts is None:
+            accounts = self.get_accounts()
         ids = [
             acc["id"]
-            for acc in json_data["data"]
+            for acc in accounts
             if acc["attributes"]["accountType"] == "TRANSACTIONAL"
         ]
 
@@ -41,24 +181,131 @@ class UpClient:
             raise ValueError(f"found {len(ids)} transactional accounts, should be 1")
 
         self.tx_acct_id = ids[0]
+        return self.tx_acct_id
 
-    def get_transactions(self, since):
-        assert self.tx_acct_id is not None
-        r = self.up_get(
-            f"/accounts/{self.tx_acct_id}/transactions",
-            params={"filter[since]": since.strftime("%Y-%m-%dT%H:%M:%S+00:00")},
-        )
+    def account_id_from_name(self, name, accounts=None):
+        """Return the ID of the account (transactional or Saver) with the given display
+        name.
+
+        accounts is the account data as returned by get_accounts, which is fetched if
+        not provided.
+        """
+        if accounts is None:
+            accounts = self.get_accounts()
+        matching_ids = [
+            acc["id"] for acc in accounts if acc["attributes"]["displayName"] == name
+        ]
+
+        if len(matching_ids) == 0:
+            raise ValueError(f"no accounts found for name {name}")
+        elif len(matching_ids) > 1:
+            raise ValueError(f"more than one account found for {name}")
+        else:
+            return matching_ids[0]
+
+    def get_transaction(self, transaction_id):
+        """Return the data of the transaction with the specified ID, or None if there is
+        no such transaction (e.g. it has since been deleted)."""
+        r = self.up_get(f"/transactions/{transaction_id}")
+        if r.status_code == 404:
+            return None
         r.raise_for_status()
+        return r.json()["data"]
+
+    def _get_page(self, url, params=None, trim=False):
+        """Get and decode a single page of data from a full Up API URL.
+
+        If trim is True, the page is decoded as it streams in, and each transaction in
+        it is trimmed with trim_transaction as soon as it's decoded, so that the whole
+        page is never held in memory at once.
+
+        A 404 response invalidates the cached accounts, as it most likely means that a
+        cached account ID is no longer valid.
+        """
+        with self.metrics.stage("up_page"):
+            r = self.session.get(url, headers=self.headers, params=params, stream=trim)
+            with r:
+                if r.status_code == 404:
+                    self.invalidate_cache()
+                r.raise_for_status()
+                if not trim:
+                    return r.json()
+                return load_streamed(
+                    r.iter_content(STREAM_CHUNK_SIZE), "data", trim_transaction
+                )
 
-        json_response = r.json()
-        transactions_json = json_response["data"]
+    def iter_transaction_pages(
+        self,
+        since,
+        page_size=DEFAULT_PAGE_SIZE,
+        prefetch=True,
+        account_id=None,
+        until=None,
+        full=False,
+    ):
+        """Yield the data of the transactions in an account created at or after since,
+        and before until if given, as one list per page of results.
+
+        account_id defaults to the transactional account. If prefetch is True, the next
+        page is requested in the background while the caller works on the current one.
+        A naive since or until is treated as being in local time.
+
+        Each transaction only has the fields kept by trim_transaction, unless full is
+        True, in which case it's exactly as returned by the Up API.
+        """
+        if account_id is None:
+            assert self.tx_acct_id is not None
+            account_id = self.tx_acct_id
+        params = {"filter[since]": _up_timestamp(since), "page[size]": page_size}
+        if until is not None:
+            until = until.astimezone()
+            params["filter[until]"] = _up_timestamp(until)
+        trim = not full
+        json_response = self._get_page(
+            self.up_url(f"/accounts/{account_id}/transactions"),
+            params=params,
+            trim=trim,
+        )
 
         # Keep following the 'next' links and retrieving the data until all the
         # transactions are retrieved
-        while json_response["links"]["next"] is not None:
-            r = requests.get(json_response["links"]["next"], headers=self.headers)
-            r.raise_for_status()
-            json_response = r.json()
-            transactions_json.extend(json_response["data"])
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            while True:
+                next_url = json_response["links"]["next"]
+                next_page = None
+                if next_url is not None and prefetch:
+                    next_page = executor.submit(self._get_page, next_url, trim=trim)
+
+                page = json_response["data"]
+                if until is not None:
+                    # In case Up's until is inclusive, leave out any transaction
+                    # created exactly at until, which belongs to the range after it
+                    page = [tx for tx in page if _created_at(tx) < until]
+                yield page
 
-        return transactions_json
+                if next_url is None:
+                    return
+                elif next_page is not None:
+                    json_response = next_page.result()
+                else:
+                    json_response = self._get_page(next_url, trim=trim)
+
+    def iter_transactions(self, since, page_size=DEFAULT_PAGE_SIZE, account_id=None):
+        """Yield the data of each transaction in an account (by default the
+        transactional account) created at or after since, fetching pages as they are
+        needed."""
+        pages = self.iter_transaction_pages(
+            since, page_size=page_size, account_id=account_id
+        )
+        for page in pages:
+            yield from page
+
+    def get_transactions(self, since, page_size=DEFAULT_PAGE_SIZE, account_id=None):
+        """Return the data of all transactions in an account (by default the
+        transactional account) created at or after since.
+
+        A naive since is treated as being in local time.
+        """
+        return list(
+            self.iter_transactions(since, page_size=page_size, account_id=account_id)
+        )
@@ -1,64 +1,282 @@
-import requests
+import time
 from collections import namedtuple
-import datetime
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from json.encoder import encode_basestring_ascii as _json_string
+
+from up2ynab.clients import MissingTokenError
+from up2ynab.clients.scheduler import (
+    RequestScheduler,
+    parse_rate_limit,
+    parse_retry_after,
+)
+from up2ynab.util.metadata_cache import token_key
+from up2ynab.util.metrics import Metrics
+
+# The base URL of every YNAB API endpoint
+YNAB_API_URL = "https://api.youneedabudget.com/v1"
+
+# The maximum number of transactions to send to YNAB in a single request
+DEFAULT_CHUNK_SIZE = 250
+
+# The maximum number of chunks of transactions to be uploading at once
+DEFAULT_MAX_UPLOADS = 4
+
+# The number of times to retry uploading a chunk that failed for a transient reason
+DEFAULT_UPLOAD_RETRIES = 2
+
+# The longest Retry-After to wait for before retrying a chunk, in seconds. A chunk
+# that's asked to wait longer fails instead, to be uploaded on a later run.
+MAX_UPLOAD_RETRY_WAIT = 5 * 60
 
 _YNABTransactionBase = namedtuple(
     "YNABTransactionBase",
-    ("date", "amount", "payee_name", "import_id", "is_foreign", "is_cleared"),
+    (
+        "date",
+        "amount",
+        "payee_name",
+        "import_id",
+        "is_foreign",
+        "is_cleared",
+        "category_id",
+        "payee_id",
+    ),
+    defaults=(None, None),
+)
+
+YNABUploadResult = namedtuple(
+    "YNABUploadResult", ("transaction_ids", "duplicate_import_ids", "failed_chunks")
 )
 
+# A chunk of YNABTransactions that could not be uploaded, and the error that occurred
+FailedChunk = namedtuple("FailedChunk", ("transactions", "error"))
+
+
+def _is_retryable(error):
+    """Whether an error from uploading a chunk is worth retrying."""
+    from requests.exceptions import HTTPError
+
+    if isinstance(error, HTTPError):
+        code = error.response.status_code
+        return code == 429 or code >= 500
+    return True
+
+
+def _retry_delay(error, attempt):
+    """Return the number of seconds to wait before retry number attempt (from 0) of a
+    chunk that failed with error, or None if it shouldn't be retried.
+
+    The delay is a jittered exponential backoff, or the response's Retry-After if
+    that's longer.
+    """
+    if not _is_retryable(error):
+        return None
+    delay = RequestScheduler.backoff(attempt)
+    response = getattr(error, "response", None)
+    if response is not None:
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        if retry_after is not None:
+            if retry_after > MAX_UPLOAD_RETRY_WAIT:
+                return None
+            delay = max(delay, retry_after)
+    return delay
+
+
+# Distinguishes the import IDs of transactions imported by up2ynab from those of YNAB's
+# own imports
+_IMPORT_ID_PREFIX = "up0:"
+
+
+# The encoded values of the cleared field of a transaction's payload
+_CLEARED = '"cleared"'
+_UNCLEARED = '"uncleared"'
+
+
+def import_id_from_up_id(up_id):
+    """Return the YNAB import ID used for the Up transaction with the specified ID."""
+    return _IMPORT_ID_PREFIX + up_id.replace("-", "")
+
+
+def is_up_import_id(import_id):
+    """Whether a YNAB import ID is one that up2ynab gave an Up transaction."""
+    return import_id is not None and import_id.startswith(_IMPORT_ID_PREFIX)
+
+
+def _chunked(iterable, size):
+    """Yield lists of up to size consecutive items from iterable."""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
 
 class YNABTransaction(_YNABTransactionBase):
+    # Don't give every transaction its own __dict__, as there can be a lot of them
+    __slots__ = ()
+
     @classmethod
-    def from_up_transaction_data(cls, transaction):
+    def from_up_transaction_data(cls, transaction, rules=None):
         """Create a YNABTransaction from Up API transaction data.
     
         transaction should be the dict representation of the JSON data representing a 
         single transaction from the Up API.
         """
+        return cls.from_up_page([transaction], rules)[0]
 
-        date = datetime.datetime.fromisoformat(transaction["attributes"]["createdAt"])
+    @classmethod
+    def from_up_page(cls, transactions, rules=None):
+        """Create a list of YNABTransactions from a list of Up API transaction data,
+        such as a page of results.
 
-        # Convert from cents to millidollars
-        amount = transaction["attributes"]["amount"]["valueInBaseUnits"] * 10
+        This is the fast path for converting many transactions at once: each one is
+        built straight from the raw data, without parsing any timestamps.
 
-        payee_name = transaction["attributes"]["description"]
+        rules is an optional up2ynab.rules.RuleSet giving the payee and category of
+        each transaction.
+        """
+        new = tuple.__new__
+        converted = []
+        payee = category_id = None
+        for transaction in transactions:
+            attributes = transaction["attributes"]
+            if rules is not None:
+                payee, category_id = rules.match(transaction)
+            converted.append(
+                new(
+                    cls,
+                    (
+                        # createdAt is in local time, so its date is the first 10
+                        # characters, e.g. 2021-03-04 in 2021-03-04T20:01:02+11:00
+                        attributes["createdAt"][:10],
+                        # Convert from cents to millidollars
+                        attributes["amount"]["valueInBaseUnits"] * 10,
+                        payee or attributes["description"],
+                        _IMPORT_ID_PREFIX + transaction["id"].replace("-", ""),
+                        attributes["foreignAmount"] is not None,
+                        # Even if it's pending, Up counts it as part of the available
+                        # value
+                        True,
+                        category_id,
+                        None,
+                    ),
+                )
+            )
+        return converted
 
-        import_id = f"up0:{transaction['id'].replace('-', '')}"
+    def to_payload(self, account_id, foreign_flag=None):
+        """Return the data of this transaction for creating it in the specified YNAB
+        account through the API."""
+        payload = {
+            "date": self.date,
+            "amount": self.amount,
+            "payee_name": self.payee_name,
+            "import_id": self.import_id,
+            "flag": (foreign_flag if self.is_foreign else None),
+            "account_id": account_id,
+            "cleared": ("cleared" if self.is_cleared else "uncleared"),
+        }
+        # Leave the category to YNAB unless a rule set one
+        if self.category_id is not None:
+            payload["category_id"] = self.category_id
+        # A transfer payee makes this a transfer from the payee's account
+        if self.payee_id is not None:
+            payload["payee_id"] = self.payee_id
+        return payload
 
-        is_foreign = transaction["attributes"]["foreignAmount"] is not None
+    @staticmethod
+    def encode_payloads(transactions, account_id, foreign_flag=None):
+        """Return the JSON body of a request creating the YNABTransactions in the
+        specified YNAB account through the API, as bytes.
 
-        # Even if it's pending, Up counts it as part of the available value
-        is_cleared = True
+        This is the fast path for uploading many transactions at once: each
+        transaction's JSON is written straight from its fields, rather than from a
+        dict of its to_payload data, which it's otherwise identical to.
+        """
+        # The fields that are the same for every transaction, already encoded
+        account = _json_string(account_id)
+        flag = "null" if foreign_flag is None else _json_string(foreign_flag)
 
-        return cls(
-            date.date().isoformat(),
+        rows = []
+        for (
+            date,
             amount,
             payee_name,
             import_id,
             is_foreign,
             is_cleared,
-        )
+            category_id,
+            payee_id,
+        ) in transactions:
+            row = (
+                f'{{"date":{_json_string(date)},"amount":{amount:d},'
+                f'"payee_name":{_json_string(payee_name)},'
+                f'"import_id":{_json_string(import_id)},'
+                f'"flag":{flag if is_foreign else "null"},"account_id":{account},'
+                f'"cleared":{_CLEARED if is_cleared else _UNCLEARED}'
+            )
+            if category_id is not None:
+                row += f',"category_id":{_json_string(category_id)}'
+            if payee_id is not None:
+                row += f',"payee_id":{_json_string(payee_id)}'
+            rows.append(row + "}")
+        return ('{"transactions":[' + ",".join(rows) + "]}").encode("ascii")
 
 
 class YNABClient:
-    def __init__(self, api_token):
+    def __init__(
+        self, api_token, session=None, cache=None, base_url=YNAB_API_URL, metrics=None
+    ):
+        """session is the requests.Session-like object used for all HTTP requests. If
+        not provided, a new PooledSession is created for this client.
+
+        cache is an optional MetadataCache used to remember the accounts between runs.
+
+        base_url is the URL the API endpoints are relative to, which only needs to be
+        changed to use a stand-in for the YNAB API, e.g. for benchmarking.
+
+        metrics is the Metrics that the timings of the client's operations are recorded
+        in. If not provided, a new one is created for this client.
+        """
+        self.base_url = base_url
+        self.metrics = metrics if metrics is not None else Metrics()
         self.api_token = api_token
         self.headers = {"Authorization": f"Bearer {self.api_token}"}
+        if session is None:
+            # Only import requests once it's needed, to keep the CLI quick to start
+            from up2ynab.clients.session import PooledSession
 
-    @staticmethod
-    def ynab_url(endpoint):
+            session = PooledSession()
+        self.session = session
+        self.cache = cache
+        self.accounts_cached = False
+
+        # The (used, limit) pair from the rate limit header of the last response
+        self.rate_limit = None
+
+    def ynab_url(self, endpoint):
         """Return the full URL corresponding to the specified YNAB API endpoint."""
-        return "https://api.youneedabudget.com/v1" + endpoint
+        return self.base_url + endpoint
+
+    def _record_rate_limit(self, r):
+        """Remember the rate limit usage reported by a response, e.g. "36/200"."""
+        rate_limit = parse_rate_limit(r.headers.get("X-Rate-Limit"))
+        if rate_limit is not None:
+            self.rate_limit = rate_limit
 
     def ynab_get(self, endpoint, **kwargs):
-        """Use requests.get to get data from the specified Up API endpoint."""
-        return requests.get(
-            YNABClient.ynab_url(endpoint), headers=self.headers, **kwargs
-        )
+        """Use the session to get data from the specified YNAB API endpoint."""
+        r = self.session.get(self.ynab_url(endpoint), headers=self.headers, **kwargs)
+        self._record_rate_limit(r)
+        return r
 
-    def is_authenticated(self):
-        r = self.ynab_get("/user")
+    def is_authenticated(self, timeout=None):
+        """Return whether the API token is accepted. timeout is the number of seconds
+        to wait for a response, if not the session's default."""
+        kwargs = {} if timeout is None else {"timeout": timeout}
+        r = self.ynab_get("/user", **kwargs)
 
         # 401 means not authenticated properly, 200 means good to go
         if r.status_code == 401:
@@ -69,13 +287,56 @@ class YNABClient:
         # If it's neither 200 nor 401, raise it as an error
         r.raise_for_status()
 
-    def account_id_from_name(self, name):
+    def get_accounts(self, refresh=False):
+        """Return the data of every account in the last-used budget.
+
+        If the client has a cache, the ID, name and transfer payee ID of each account
+        are returned from it unless refresh is True, and accounts_cached is set to
+        whether they were.
+        """
+        # The cache is keyed by the token, so check it's there before using it
+        if self.api_token is None:
+            raise MissingTokenError("YNAB")
+        if self.cache is not None and not refresh:
+            accounts = self.cache.get(token_key(self.api_token, "ynab_accounts"))
+            if accounts is not None:
+                self.accounts_cached = True
+                return accounts
+
         r = self.ynab_get("/budgets/last-used/accounts")
         r.raise_for_status()
+        accounts = r.json()["data"]["accounts"]
 
-        matching_ids = [
-            acc["id"] for acc in r.json()["data"]["accounts"] if acc["name"] == name
-        ]
+        self.accounts_cached = False
+        if self.cache is not None:
+            self.cache.set(
+                token_key(self.api_token, "ynab_accounts"),
+                [
+                    {
+                        "id": acc["id"],
+                        "name": acc["name"],
+                        "transfer_payee_id": acc["transfer_payee_id"],
+                    }
+                    for acc in accounts
+                ],
+            )
+        return accounts
+
+    def invalidate_cache(self):
+        """Forget any cached accounts, so they are fetched again next time."""
+        if self.cache is not None and self.api_token is not None:
+            self.cache.invalidate(token_key(self.api_token, "ynab_accounts"))
+
+    def account_id_from_name(self, name, accounts=None):
+        """Return the ID of the account with the given name.
+
+        accounts is the account data as returned by get_accounts, which is fetched if
+        not provided.
+        """
+        if accounts is None:
+            accounts = self.get_accounts()
+
+        matching_ids = [acc["id"] for acc in accounts if acc["name"] == name]
 
         if len(matching_ids) == 0:
             raise ValueError(f"no accounts found for name {name}")
@@ -84,32 +345,186 @@ class YNABClient:
         else:
             return matching_ids[0]
 
-    def create_transactions(self, account_id, transactions, foreign_flag=None):
-        """Create the provided YNABTransactions in the account with the specified ID.
+    def get_account_transactions(self, account_id, last_knowledge=None):
+        """Return the data of the transactions in the account with the specified ID,
+        along with the server knowledge of the response.
 
-        foreign_flag is the colour of the flag that should be set for transactions in a
-        foreign currency.
-        
-        Returns a list of IDs that had already been imported.
+        If last_knowledge is provided, only the transactions that have changed since
+        that server knowledge (including deleted ones) are returned.
+        """
+        params = {}
+        if last_knowledge is not None:
+            params["last_knowledge_of_server"] = last_knowledge
+        r = self.ynab_get(
+            f"/budgets/last-used/accounts/{account_id}/transactions", params=params
+        )
+        if r.status_code == 404:
+            self.invalidate_cache()
+        r.raise_for_status()
+        json_data = r.json()["data"]
+        return json_data["transactions"], json_data["server_knowledge"]
+
+    def get_categories(self, last_knowledge=None):
+        """Return the data of the categories in every category group, with their
+        amounts in the current month, along with the server knowledge of the response.
+
+        If last_knowledge is provided, only the categories that have changed since
+        that server knowledge (including deleted ones) are returned.
         """
-        transactions_data = [
-            {
-                "date": tx.date,
-                "amount": tx.amount,
-                "payee_name": tx.payee_name,
-                "import_id": tx.import_id,
-                "flag": (foreign_flag if tx.is_foreign else None),
-                "account_id": account_id,
-                "cleared": ("cleared" if tx.is_cleared else "uncleared"),
-            }
-            for tx in transactions
+        params = {}
+        if last_knowledge is not None:
+            params["last_knowledge_of_server"] = last_knowledge
+        r = self.ynab_get("/budgets/last-used/categories", params=params)
+        r.raise_for_status()
+        json_data = r.json()["data"]
+        categories = [
+            category
+            for group in json_data["category_groups"]
+            for category in group["categories"]
         ]
+        return categories, json_data["server_knowledge"]
+
+    def get_budget_id(self, last_knowledge):
+        """Return the ID of the last-used budget.
 
-        r = requests.post(
-            YNABClient.ynab_url("/budgets/last-used/transactions"),
+        The budget is returned along with everything in it that changed since
+        last_knowledge, so to keep the response small this should be the server
+        knowledge of a response that was just received.
+        """
+        r = self.ynab_get(
+            "/budgets/last-used", params={"last_knowledge_of_server": last_knowledge}
+        )
+        r.raise_for_status()
+        return r.json()["data"]["budget"]["id"]
+
+    def update_month_category(self, category_id, budgeted, month="current"):
+        """Set the amount budgeted (in millidollars) to the category with the specified
+        ID in month, an ISO date within it or "current". Returns the updated data of the
+        category."""
+        r = self.session.patch(
+            self.ynab_url(
+                f"/budgets/last-used/months/{month}/categories/{category_id}"
+            ),
             headers=self.headers,
-            json={"transactions": transactions_data},
+            json={"category": {"budgeted": budgeted}},
         )
+        self._record_rate_limit(r)
         r.raise_for_status()
-        json_data = r.json()["data"]
-        return json_data["duplicate_import_ids"]
+        return r.json()["data"]["category"]
+
+    def update_transactions(self, updates, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Update existing transactions, where updates is a list of dicts each with the
+        "id" or "import_id" of a transaction and the fields to change.
+
+        Returns the list of IDs of the updated transactions.
+        """
+        transaction_ids = []
+        for chunk in _chunked(updates, chunk_size):
+            r = self.session.patch(
+                self.ynab_url("/budgets/last-used/transactions"),
+                headers=self.headers,
+                json={"transactions": chunk},
+            )
+            self._record_rate_limit(r)
+            r.raise_for_status()
+            transaction_ids.extend(r.json()["data"]["transaction_ids"])
+        return transaction_ids
+
+    def delete_transaction(self, transaction_id):
+        """Delete the transaction with the specified ID."""
+        r = self.session.delete(
+            self.ynab_url(f"/budgets/last-used/transactions/{transaction_id}"),
+            headers=self.headers,
+        )
+        self._record_rate_limit(r)
+        r.raise_for_status()
+
+    def _upload_chunk(self, account_id, transactions, foreign_flag, delay=0):
+        """POST a single chunk of YNABTransactions after waiting delay seconds (e.g.
+        before retrying it), returning the response data."""
+        if delay:
+            time.sleep(delay)
+            self.metrics.add_stage_time("retry_backoff", delay)
+        body = YNABTransaction.encode_payloads(transactions, account_id, foreign_flag)
+
+        with self.metrics.stage("ynab_chunk"):
+            r = self.session.post(
+                self.ynab_url("/budgets/last-used/transactions"),
+                headers={**self.headers, "Content-Type": "application/json"},
+                data=body,
+            )
+        self._record_rate_limit(r)
+
+        # The account ID is most likely cached and no longer valid
+        if r.status_code == 404:
+            self.invalidate_cache()
+        r.raise_for_status()
+        return r.json()["data"]
+
+    def create_transactions(
+        self,
+        account_id,
+        transactions,
+        foreign_flag=None,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        max_workers=DEFAULT_MAX_UPLOADS,
+        retries=DEFAULT_UPLOAD_RETRIES,
+    ):
+        """Create the provided YNABTransactions in the account with the specified ID.
+
+        foreign_flag is the colour of the flag that should be set for transactions in a
+        foreign currency.
+
+        The transactions are uploaded in chunks of at most chunk_size, with up to
+        max_workers chunks in flight at once. transactions may be any iterable, and is
+        consumed lazily: each chunk starts uploading as soon as it is full, so a
+        generator that is still fetching or converting transactions overlaps with the
+        upload. A chunk that fails with a connection error, rate limit or server error
+        is retried up to retries more times, after a jittered exponential backoff (or
+        the response's Retry-After, if longer), without resending the chunks that
+        succeeded.
+
+        Returns a YNABUploadResult aggregating the results of every chunk.
+        """
+        from requests.exceptions import RequestException
+
+        transaction_ids = []
+        duplicate_import_ids = []
+        failed_chunks = []
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            in_flight = {}
+
+            def submit(chunk, attempt, delay=0):
+                future = executor.submit(
+                    self._upload_chunk, account_id, chunk, foreign_flag, delay
+                )
+                in_flight[future] = (chunk, attempt)
+
+            def collect():
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    chunk, attempt = in_flight.pop(future)
+                    try:
+                        data = future.result()
+                    except RequestException as e:
+                        delay = _retry_delay(e, attempt) if attempt < retries else None
+                        if delay is not None:
+                            submit(chunk, attempt + 1, delay)
+                        else:
+                            failed_chunks.append(FailedChunk(chunk, e))
+                    else:
+                        transaction_ids.extend(data["transaction_ids"])
+                        duplicate_import_ids.extend(data["duplicate_import_ids"])
+
+            for chunk in _chunked(transactions, chunk_size):
+                # Wait for a chunk to finish before starting another, so that no more
+                # than max_workers chunks are being held in memory at once
+                while len(in_flight) >= max_workers:
+                    collect()
+                submit(chunk, 0)
+
+            while in_flight:
+                collect()
+
+        return YNABUploadResult(transaction_ids, duplicate_import_ids, failed_chunks)
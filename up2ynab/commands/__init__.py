@@ -1,2 +0,0 @@
-from .check import check
-from .transactions import transactions
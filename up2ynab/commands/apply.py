@@ -0,0 +1,147 @@
+import sys
+import time
+
+import click
+
+import up2ynab.clients.ynab as ynab_api
+from up2ynab.commands.transactions import chunk_size_option, max_uploads_option
+from up2ynab.plan import SyncPlan
+from up2ynab.util.http_error_handler import handle_http_errors
+
+
+@click.command()
+@click.argument("file", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--delete-missing",
+    is_flag=True,
+    help="Also delete the transactions in YNAB that the plan found missing from Up.",
+)
+@chunk_size_option
+@max_uploads_option
+@click.pass_context
+@handle_http_errors
+def apply(ctx, file, delete_missing, chunk_size, max_uploads):
+    """Make the changes in a plan saved by `up2ynab plan` in YNAB.
+
+    Only the planned changes are sent: the new transactions are created, and the ones
+    that changed in Up are updated, without fetching anything from Up or YNAB again.
+    Transactions missing from Up are only deleted with --delete-missing. Only a YNAB API
+    token is needed to apply a plan.
+    """
+
+    # Get the context-provided echo manager for printing output
+    out = ctx.obj["echo_manager"]
+    metrics = ctx.obj["metrics"]
+
+    # Fetch the current time, to print the execution time at the end of the script
+    start_time = time.perf_counter()
+
+    try:
+        sync_plan = SyncPlan.load(file)
+    except ValueError as e:
+        out.fatal(f"Couldn't read the plan in `{file}`: {e}.")
+        sys.exit(2)
+
+    out.section(f"Applying the plan in `{file}`")
+    out.info(f"The plan was made at *{sync_plan.created_at:%Y-%m-%d %H:%M}*.")
+
+    ynab_client = ynab_api.YNABClient(
+        ctx.obj["ynab_token"],
+        session=ctx.obj["session"],
+        cache=ctx.obj["cache"],
+        base_url=ctx.obj["ynab_api_url"],
+        metrics=metrics,
+    )
+
+    counts = {"new": 0, "duplicate": 0, "updated": 0, "deleted": 0, "failed": 0}
+    for account_plan in sync_plan.accounts:
+        name = account_plan.account.up_name
+        ynab_id = account_plan.account.ynab_id
+
+        if account_plan.create:
+            out.start_task(f"Creating the new transactions from *{name}*...")
+            result = ynab_client.create_transactions(
+                ynab_id,
+                account_plan.create,
+                foreign_flag=sync_plan.foreign_flag,
+                chunk_size=chunk_size,
+                max_workers=max_uploads,
+            )
+            counts["new"] += len(result.transaction_ids)
+            counts["duplicate"] += len(result.duplicate_import_ids)
+            failed_count = sum(
+                len(chunk.transactions) for chunk in result.failed_chunks
+            )
+            counts["failed"] += failed_count
+            if result.failed_chunks:
+                out.task_error(
+                    f"Failed to create *{failed_count} transactions* from *{name}*."
+                )
+                for chunk in result.failed_chunks:
+                    out.comment(
+                        f"A chunk of *{len(chunk.transactions)} transactions* failed:"
+                        f" {chunk.error}"
+                    )
+            else:
+                out.task_success(
+                    f"Created *{len(result.transaction_ids)} new transactions* from"
+                    f" *{name}*."
+                )
+            if result.duplicate_import_ids:
+                out.comment(
+                    f"*{len(result.duplicate_import_ids)} transactions* had been"
+                    " imported since the plan was made."
+                )
+
+        if account_plan.update:
+            out.start_task(f"Updating the changed transactions from *{name}*...")
+            with metrics.stage("ynab_update"):
+                updated_ids = ynab_client.update_transactions(
+                    [
+                        {
+                            "id": update.id,
+                            "amount": update.transaction.amount,
+                            "date": update.transaction.date,
+                        }
+                        for update in account_plan.update
+                    ],
+                    chunk_size=chunk_size,
+                )
+            counts["updated"] += len(updated_ids)
+            out.task_success(
+                f"Updated *{len(updated_ids)} changed transactions* from *{name}*."
+            )
+
+        if account_plan.missing and delete_missing:
+            out.start_task(f"Deleting the transactions missing from *{name}*...")
+            for mirrored_tx in account_plan.missing:
+                ynab_client.delete_transaction(mirrored_tx.id)
+            counts["deleted"] += len(account_plan.missing)
+            out.task_success(
+                f"Deleted *{len(account_plan.missing)} transactions* missing from"
+                f" *{name}*."
+            )
+        elif account_plan.missing:
+            out.info(
+                f"Left *{len(account_plan.missing)} transactions* missing from"
+                f" *{name}* in YNAB. Use --delete-missing to delete them."
+            )
+
+    out.end_section()
+
+    if counts["failed"]:
+        out.fatal(
+            f"*{counts['failed']} transactions* couldn't be created in YNAB.",
+            "Apply the plan again to retry them.",
+        )
+        sys.exit(2)
+
+    # Calculate the execution time
+    time_delta = time.perf_counter() - start_time
+
+    # Display the final script result
+    out.success(
+        f"Created *{counts['new']}*, updated *{counts['updated']}* and deleted"
+        f" *{counts['deleted']}* transactions in {time_delta:.2f} seconds.",
+        counts=counts,
+    )
@@ -0,0 +1,227 @@
+import datetime
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import click
+
+import up2ynab.clients.up as up_api
+import up2ynab.clients.ynab as ynab_api
+from up2ynab.commands.transactions import (
+    account_option,
+    chunk_size_option,
+    flag_foreign_option,
+    max_uploads_option,
+    page_size_option,
+    resolve_accounts,
+    rules_option,
+    state_file_option,
+    ynab_account_name_option,
+)
+from up2ynab.sync import TransactionSync
+from up2ynab.util.http_error_handler import handle_http_errors
+from up2ynab.util.state_store import StateStore
+
+# The number of days of transactions fetched from Up in each window
+DEFAULT_WINDOW_DAYS = 30
+
+# The number of windows to be fetching and uploading at once
+DEFAULT_CONCURRENCY = 4
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def backfill_windows(since, until, window_days):
+    """Split the time from since until until into (start, end) windows of window_days
+    days each, oldest first.
+
+    The windows start on multiples of window_days days since the Unix epoch, so the
+    first one starts a little before since, and the same windows are made every time a
+    backfill is run. The last window ends at until.
+    """
+    window = datetime.timedelta(days=window_days)
+    start = _EPOCH + (since - _EPOCH) // window * window
+    windows = []
+    while start < until:
+        windows.append((start, min(start + window, until)))
+        start += window
+    return windows
+
+
+@click.command()
+@click.option(
+    "-d",
+    "--days",
+    default=365,
+    help="Number of days before today (inclusive) to import transactions from.",
+    show_default=True,
+    required=True,
+)
+@click.option(
+    "--window-days",
+    default=DEFAULT_WINDOW_DAYS,
+    help="Number of days of transactions to fetch from Up in each window.",
+    show_default=True,
+    type=click.IntRange(min=1),
+)
+@click.option(
+    "--concurrency",
+    "-j",
+    default=DEFAULT_CONCURRENCY,
+    help="Number of windows to fetch and upload at once.",
+    show_default=True,
+    type=click.IntRange(min=1),
+)
+@ynab_account_name_option
+@flag_foreign_option
+@state_file_option
+@page_size_option
+@chunk_size_option
+@max_uploads_option
+@account_option
+@rules_option
+@click.pass_context
+@handle_http_errors
+def backfill(
+    ctx,
+    days,
+    window_days,
+    concurrency,
+    ynab_account_name,
+    account,
+    flag_foreign,
+    state_file,
+    page_size,
+    chunk_size,
+    max_uploads,
+    rules,
+):
+    """Import a long history of Up transactions into YNAB, several windows at a time.
+
+    The --days before today are split into windows of --window-days days, and
+    --concurrency windows are fetched from Up and uploaded to YNAB at once. Each window
+    is recorded in the incremental import database (see --state-file) as soon as all of
+    its transactions are in YNAB. If the backfill is interrupted, or some windows fail,
+    running the same command again skips the windows that were completed and any
+    transactions that were already imported.
+
+    Afterwards, keep up to date with
+
+      $ up2ynab transactions --incremental
+    """
+
+    # Get the context-provided echo manager for printing output
+    out = ctx.obj["echo_manager"]
+    metrics = ctx.obj["metrics"]
+
+    # Fetch the current time, to print the execution time at the end of the script
+    start_time = time.perf_counter()
+
+    state = StateStore(state_file)
+    ctx.call_on_close(state.close)
+
+    out.section(f"Backfilling the last *{days} days* of transactions")
+
+    # Display the selected foreign currency flag, if one has been selected
+    if flag_foreign is not None:
+        out.info(f"Any foreign currency transactions will be flagged *{flag_foreign}*.")
+
+    up_client = up_api.UpClient(
+        ctx.obj["up_token"],
+        session=ctx.obj["session"],
+        cache=ctx.obj["cache"],
+        base_url=ctx.obj["up_api_url"],
+        metrics=metrics,
+    )
+    ynab_client = ynab_api.YNABClient(
+        ctx.obj["ynab_token"],
+        session=ctx.obj["session"],
+        cache=ctx.obj["cache"],
+        base_url=ctx.obj["ynab_api_url"],
+        metrics=metrics,
+    )
+
+    # Without any --account mappings, backfill the transactional account into the
+    # account named by --ynab-account-name
+    mappings = list(account) if account else [(None, ynab_account_name)]
+
+    with metrics.stage("account_lookup"):
+        accounts = resolve_accounts(out, up_client, ynab_client, mappings)
+
+    until = datetime.datetime.now().astimezone()
+    windows = backfill_windows(
+        until - datetime.timedelta(days=days), until, window_days
+    )
+    pending = [
+        (synced_account, start, end)
+        for synced_account in accounts
+        for start, end in windows
+        if not state.window_completed(synced_account.up_id, start, end)
+    ]
+    total = len(accounts) * len(windows)
+    if len(pending) < total:
+        out.info(
+            f"Skipping *{total - len(pending)} of {total} windows* completed by a"
+            " previous backfill."
+        )
+
+    sync = TransactionSync(
+        out,
+        up_client,
+        ynab_client,
+        state=state,
+        foreign_flag=flag_foreign,
+        page_size=page_size,
+        chunk_size=chunk_size,
+        max_uploads=max_uploads,
+        metrics=metrics,
+        rules=rules,
+    )
+
+    def backfill_window(synced_account, start, end):
+        # Each window needs its own name, as several of an account's are in progress
+        name = (
+            f"{synced_account.up_name} from {start.astimezone():%Y-%m-%d}"
+            f" to {end.astimezone():%Y-%m-%d}"
+        )
+        with metrics.stage("backfill_window"):
+            result = sync.sync_account(
+                synced_account.up_id, synced_account.ynab_id, start, name, until=end
+            )
+        if not result.failed_chunks:
+            state.record_window(synced_account.up_id, start, end)
+        return result
+
+    results = []
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(backfill_window, *window) for window in pending]
+        try:
+            for future in as_completed(futures):
+                results.append(future.result())
+        except BaseException:
+            # Don't start any more windows, but let the ones in progress finish, so
+            # that they are recorded and don't need to be fetched again
+            for future in futures:
+                future.cancel()
+            raise
+
+    out.end_section()
+
+    new_count = sum(result.new_count for result in results)
+    failed_count = sum(1 for result in results if result.failed_chunks)
+    if failed_count:
+        out.fatal(
+            f"*{failed_count} windows* couldn't be fully uploaded to YNAB, after"
+            f" importing *{new_count} new transactions*.",
+            "Run the command again to resume the backfill.",
+        )
+        sys.exit(2)
+
+    # Calculate the execution time
+    time_delta = time.perf_counter() - start_time
+
+    # Display the final script result
+    out.success(
+        f"Backfilled *{new_count} new transactions* in {time_delta:.2f} seconds.",
+        counts={"new": new_count, "windows": len(pending)},
+    )
@@ -0,0 +1,183 @@
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import click
+
+from up2ynab.batch import (
+    TenantResult,
+    default_data_dir,
+    default_log_dir,
+    load_tenants,
+    run_tenant,
+)
+
+
+@click.command()
+@click.argument("file", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--jobs",
+    "-j",
+    help="Maximum number of tenants to sync at once, each in its own worker process."
+    + " Defaults to the number of CPUs.",
+    type=click.IntRange(min=1),
+)
+@click.option(
+    "--log-dir",
+    envvar="UP2YNAB_BATCH_LOG_DIR",
+    help="Directory to write the output of each tenant to, as NAME.log, along with its"
+    + " metrics as NAME.metrics.json. Defaults to a directory in your user app"
+    + " directory. Can also be set by UP2YNAB_BATCH_LOG_DIR environment variable.",
+    type=click.Path(file_okay=False),
+)
+@click.option(
+    "--data-dir",
+    envvar="UP2YNAB_BATCH_DATA_DIR",
+    help="Directory to keep the local files of each tenant in, such as its incremental"
+    + " import state, YNAB mirror and caches, in a subdirectory named after it."
+    + " Defaults to a directory in your user app directory. Can also be set by"
+    + " UP2YNAB_BATCH_DATA_DIR environment variable.",
+    type=click.Path(file_okay=False),
+)
+@click.option(
+    "--report",
+    help="Also write a JSON report of every tenant's result, and the totals of their"
+    + " counts, to this file (or - for stdout).",
+    type=click.Path(dir_okay=False, allow_dash=True),
+)
+@click.pass_context
+def batch(ctx, file, jobs, log_dir, data_dir, report):
+    """Sync many households at once, each with their own API tokens, as listed in the
+    JSON file FILE, e.g.
+
+    \b
+      {
+        "tenants": [
+          {
+            "name": "smith",
+            "up_api_token_env": "SMITH_UP_API_TOKEN",
+            "ynab_api_token_env": "SMITH_YNAB_API_TOKEN",
+            "args": ["transactions", "--incremental", "-A", "Spending=Up Spending"]
+          }
+        ]
+      }
+
+    Each tenant's tokens are given either directly (up_api_token, ynab_api_token) or
+    as the names of environment variables holding them, and args are the command and
+    options to run for it, `up2ynab transactions` by default. Options a tenant doesn't
+    give fall back to the environment variables as usual.
+
+    The tenants are run on a pool of worker processes, which each load up2ynab once
+    and then run one tenant after another. A tenant failing doesn't stop the others,
+    and each one's output is kept in its own log file. Each tenant also has its own
+    directory for its local files, so their incremental import state, YNAB mirrors,
+    caches and rate limits are kept apart.
+    """
+
+    # Get the context-provided echo manager for printing output
+    out = ctx.obj["echo_manager"]
+
+    # Fetch the current time, to print the execution time at the end of the script
+    start_time = time.perf_counter()
+
+    try:
+        tenants = load_tenants(file)
+    except ValueError as e:
+        out.fatal(f"Couldn't read the tenants in `{file}`: {e}.")
+        sys.exit(2)
+    if not tenants:
+        out.warning(f"There are no tenants in `{file}`.")
+        return
+
+    if log_dir is None:
+        log_dir = default_log_dir()
+    os.makedirs(log_dir, exist_ok=True)
+    if data_dir is None:
+        data_dir = default_data_dir()
+    jobs = min(jobs or os.cpu_count() or 1, len(tenants))
+
+    out.section(f"Syncing *{len(tenants)} tenants* with *{jobs} workers*")
+
+    results = {}
+    # The workers are spawned rather than forked, so that they don't inherit this
+    # process's threads, such as the spinner's
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=context) as executor:
+        futures = {}
+        for tenant in tenants:
+            out.start_task(f"Syncing *{tenant.name}*...", task=tenant.name)
+            futures[executor.submit(run_tenant, tenant, log_dir, data_dir)] = tenant
+
+        for future in as_completed(futures):
+            tenant = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                # e.g. the worker process was killed
+                result = TenantResult(
+                    tenant.name, 1, None, None, f"Its worker process failed: {e!r}"
+                )
+            results[tenant.name] = result
+
+            if result.exit_code == 0:
+                out.task_success(
+                    f"Synced *{tenant.name}* in {result.seconds:.2f} seconds.",
+                    task=tenant.name,
+                    counts=result.counts,
+                )
+            else:
+                with out.grouped():
+                    out.task_error(
+                        f"Syncing *{tenant.name}* failed.",
+                        task=tenant.name,
+                        counts=result.counts,
+                    )
+                    if result.error is not None:
+                        out.comment(result.error)
+
+    out.end_section()
+
+    # Add up the counts of every tenant, e.g. the total number of new transactions
+    totals = Counter()
+    for result in results.values():
+        for name, count in (result.counts or {}).items():
+            if isinstance(count, (int, float)) and not isinstance(count, bool):
+                totals[name] += count
+    failed = [tenant.name for tenant in tenants if results[tenant.name].exit_code]
+
+    # Calculate the execution time
+    time_delta = time.perf_counter() - start_time
+
+    if report is not None:
+        data = {
+            "seconds": round(time_delta, 6),
+            "succeeded": len(tenants) - len(failed),
+            "failed": len(failed),
+            "totals": dict(totals),
+            "tenants": [
+                {
+                    **results[tenant.name]._asdict(),
+                    "log": os.path.join(log_dir, f"{tenant.name}.log"),
+                }
+                for tenant in tenants
+            ],
+        }
+        with click.open_file(report, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+            f.write("\n")
+
+    # Display the final script result
+    if failed:
+        out.error(
+            f"*{len(failed)} of {len(tenants)} tenants* failed: {', '.join(failed)}.",
+            f"Their output is in `{log_dir}`.",
+        )
+        sys.exit(2)
+    out.success(
+        f"Synced *{len(tenants)} tenants* in {time_delta:.2f} seconds.",
+        counts=dict(totals),
+    )
@@ -1,17 +1,54 @@
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 import click
-import requests.exceptions
 
 import up2ynab.clients.up as up_api
 import up2ynab.clients.ynab as ynab_api
+from up2ynab.clients.scheduler import RequestScheduler
 from up2ynab.util.http_error_handler import handle_http_errors
 
+# The number of seconds to wait for each API to respond while checking, by default
+DEFAULT_CHECK_TIMEOUT = 10
+
+
+def _ms(seconds):
+    return round(seconds * 1000)
+
+
+def _check_session(ctx, timeout):
+    """Return a session for the requests of a check, which are each sent only once
+    and never held back for a rate limit, so that an API that doesn't respond is
+    reported after timeout seconds."""
+    # Imported here, as requests is only needed once there's a token to check
+    from up2ynab.clients.session import PooledSession
+
+    metrics = ctx.obj["metrics"]
+    scheduler = RequestScheduler(retries=0, max_wait=0, metrics=metrics)
+    session = PooledSession(timeout=timeout, scheduler=scheduler)
+    session.hooks["response"].append(metrics.record_response)
+    ctx.call_on_close(session.close)
+    return session
+
 
 @click.command()
+@click.option(
+    "--timeout",
+    default=DEFAULT_CHECK_TIMEOUT,
+    help="Seconds to wait for each API to respond before reporting it as unreachable.",
+    show_default=True,
+    type=click.FloatRange(min=0, min_open=True),
+)
+@click.option(
+    "--diagnose",
+    is_flag=True,
+    help="Also time each step of a request to each API (DNS lookup, connecting, TLS"
+    + " and the first byte of the response), how quickly a page of data downloads, and"
+    + " how much of each API's rate limit is left, to find out why syncs are slow.",
+)
 @click.pass_context
 @handle_http_errors
-def check(ctx):
+def check(ctx, timeout, diagnose):
     """Check that your API tokens are configured correctly.
 
     To get your Up API token, visit the following page:
@@ -42,47 +79,88 @@ def check(ctx):
     the subcommand to specify the tokens at runtime, e.g.:
 
       $ up2ynab --up-api-token xxxx --ynab-api-token xxxx check
+
+    Both tokens are checked at once. If syncs are slow, --diagnose shows whether the
+    time is going on the network, Up or YNAB.
     """
 
     out = ctx.obj["echo_manager"]
     out.section("Checking your API tokens")
 
-    # Check the Up API token
-    up_authenticated = None
-    out.start_task("Checking your Up API token...")
+    clients = {}
+    if ctx.obj["up_token"] is not None or ctx.obj["ynab_token"] is not None:
+        session = _check_session(ctx, timeout)
     if ctx.obj["up_token"] is not None:
-        up_client = up_api.UpClient(ctx.obj["up_token"])
-        up_authenticated = up_client.is_authenticated()
-        if up_authenticated:
-            out.task_success("Your Up API token is working.")
-        else:
-            out.task_error("Your Up API token returned an authentication error.")
-    else:
-        out.task_error("No Up API token was provided.")
-
-    # Check the YNAB API token
-    ynab_authenticated = None
-    out.start_task("Checking your YNAB token...")
+        clients["Up"] = up_api.UpClient(
+            ctx.obj["up_token"],
+            session=session,
+            base_url=ctx.obj["up_api_url"],
+            metrics=ctx.obj["metrics"],
+        )
     if ctx.obj["ynab_token"] is not None:
-        ynab_client = ynab_api.YNABClient(ctx.obj["ynab_token"])
-        ynab_authenticated = ynab_client.is_authenticated()
-        if ynab_authenticated:
-            out.task_success("Your YNAB API token is working.")
+        clients["YNAB"] = ynab_api.YNABClient(
+            ctx.obj["ynab_token"],
+            session=session,
+            base_url=ctx.obj["ynab_api_url"],
+            metrics=ctx.obj["metrics"],
+        )
+
+    def check_token(name):
+        # Returns whether the token works, or None if the API couldn't be reached.
+        # requests is imported here, as it's only needed once there's a token to check.
+        from requests.exceptions import ConnectionError, Timeout
+
+        try:
+            authenticated = clients[name].is_authenticated(timeout=timeout)
+        except Timeout:
+            out.task_error(
+                f"The {name} API didn't respond within *{timeout:g} seconds*.",
+                task=name,
+            )
+            return None
+        except ConnectionError:
+            out.task_error(f"The {name} API couldn't be connected to.", task=name)
+            return None
+
+        if authenticated:
+            out.task_success(f"Your {name} API token is working.", task=name)
         else:
-            out.task_error("Your YNAB API token returned an authentication error.")
-    else:
-        out.task_error("No YNAB API token was provided.")
+            out.task_error(
+                f"Your {name} API token returned an authentication error.", task=name
+            )
+        return authenticated
+
+    # Check both API tokens at once
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = {}
+        for name in ("Up", "YNAB"):
+            out.start_task(f"Checking your {name} API token...", task=name)
+            if name in clients:
+                futures[name] = executor.submit(check_token, name)
+            else:
+                out.task_error(f"No {name} API token was provided.", task=name)
+        results = {name: future.result() for name, future in futures.items()}
 
     out.end_section()
 
+    working = [name for name, authenticated in results.items() if authenticated]
+    if diagnose and working:
+        _diagnose(out, {name: clients[name] for name in working}, timeout)
+
     # Display the results
-    if up_authenticated is None or ynab_authenticated is None:
+    if len(results) < 2:
         out.error(
             "One or both of your API tokens were not provided.",
             "View `up2ynab check --help` for setup instructions.",
         )
         sys.exit(1)
-    elif up_authenticated and ynab_authenticated:
+    elif None in results.values():
+        out.warning(
+            "One or both of the APIs couldn't be reached.",
+            "Check your network connection and run `up2ynab check` again.",
+        )
+        sys.exit(2)
+    elif len(working) == 2:
         out.success("Both API tokens authenticated successfully - you're good to go!")
     else:
         out.warning(
@@ -90,3 +168,92 @@ def check(ctx):
             "Fix them and run `up2ynab check` again.",
         )
         sys.exit(2)
+
+
+def _diagnose(out, clients, timeout):
+    """Diagnose the connection to each API with an UpClient or YNABClient in clients,
+    by name, and show where the time goes."""
+    from up2ynab.diagnostics import diagnose_api, find_bottlenecks
+
+    out.section("Diagnosing the connections to the APIs")
+
+    def diagnose_one(name):
+        client = clients[name]
+        if name == "Up":
+            args = (client.up_url("/util/ping"), client.headers, client.up_get)
+            # A page of transactions, like the ones a sync fetches
+            kwargs = {"params": {"page[size]": up_api.DEFAULT_PAGE_SIZE}}
+            page_endpoint = "/transactions"
+        else:
+            args = (client.ynab_url("/user"), client.headers, client.ynab_get)
+            kwargs = {}
+            page_endpoint = "/budgets/last-used/accounts"
+
+        try:
+            diagnosis = diagnose_api(
+                name, *args, page_endpoint, timeout=timeout, **kwargs
+            )
+        except OSError as e:
+            out.task_error(
+                f"Couldn't diagnose the connection to {name}: {e}", task=name
+            )
+            return None
+
+        connection, page = diagnosis.connection, diagnosis.page
+        counts = {
+            "dns_ms": _ms(connection.dns),
+            "connect_ms": _ms(connection.connect),
+            "tls_ms": _ms(connection.tls) if connection.tls is not None else None,
+            "first_byte_ms": _ms(connection.first_byte),
+            "page_ms": _ms(page.seconds),
+            "page_bytes": page.size,
+        }
+        if diagnosis.rate_limit is not None:
+            counts["rate_limit_remaining"] = diagnosis.rate_limit[0]
+        out.task_success(
+            f"Diagnosed the connection to {name}.", task=name, counts=counts
+        )
+        return diagnosis
+
+    with ThreadPoolExecutor(max_workers=len(clients)) as executor:
+        futures = {}
+        for name in clients:
+            out.start_task(f"Diagnosing the connection to {name}...", task=name)
+            futures[name] = executor.submit(diagnose_one, name)
+        diagnoses = [future.result() for future in futures.values()]
+    diagnoses = [diagnosis for diagnosis in diagnoses if diagnosis is not None]
+
+    for diagnosis in diagnoses:
+        connection, page = diagnosis.connection, diagnosis.page
+        steps = [
+            f"DNS *{_ms(connection.dns)} ms*",
+            f"connect *{_ms(connection.connect)} ms*",
+        ]
+        if connection.tls is not None:
+            steps.append(f"TLS *{_ms(connection.tls)} ms*")
+        steps.append(f"first byte *{_ms(connection.first_byte)} ms*")
+        out.info(f"{diagnosis.name}: {', '.join(steps)}.")
+
+        throughput = page.size / 1024 / max(page.seconds, 1e-6)
+        out.comment(
+            f"Fetched a page of *{page.size / 1024:.1f} KB* in"
+            f" *{_ms(page.seconds)} ms* ({throughput:,.0f} KB/s)."
+        )
+        if diagnosis.rate_limit is None:
+            out.comment("No rate limit was reported.")
+        else:
+            remaining, limit = diagnosis.rate_limit
+            of_limit = f" of {limit}" if limit is not None else ""
+            out.comment(f"*{remaining}*{of_limit} requests are left in the rate limit.")
+
+    if diagnoses:
+        bottlenecks = find_bottlenecks(diagnoses)
+        if bottlenecks:
+            out.warning(
+                "Syncs are likely being slowed down by:",
+                *(f"- {bottleneck}" for bottleneck in bottlenecks),
+            )
+        else:
+            out.info("Nothing looks slow.")
+
+    out.end_section()
@@ -0,0 +1,108 @@
+import datetime
+import os
+import sys
+import time
+
+import click
+
+import up2ynab.clients.up as up_api
+from up2ynab.commands.transactions import page_size_option
+from up2ynab.export_file import ExportWriter
+from up2ynab.util.http_error_handler import handle_http_errors
+
+
+@click.command()
+@click.argument("file", type=click.Path(dir_okay=False))
+@click.option(
+    "-d",
+    "--days",
+    default=14,
+    help="Number of days before today (inclusive) to export transactions from.",
+    show_default=True,
+    required=True,
+)
+@click.option(
+    "--up-account",
+    "-u",
+    multiple=True,
+    help="The name of an Up account (transactional or Saver) to export. Can be given"
+    + " multiple times. Defaults to the transactional account.",
+)
+@page_size_option
+@click.pass_context
+@handle_http_errors
+def export(ctx, file, days, up_account, page_size):
+    """Export your Up transactions to a file, to import into YNAB later.
+
+    The file is in JSON Lines format, compressed with gzip if its name ends in .gz,
+    e.g.:
+
+      $ up2ynab export --days 365 up.jsonl.gz
+
+    It can then be imported into YNAB with `up2ynab import-file` as many times as
+    needed, without fetching the transactions from Up again. Only an Up API token is
+    needed to export.
+    """
+
+    # Get the context-provided echo manager for printing output
+    out = ctx.obj["echo_manager"]
+
+    # Fetch the current time, to print the execution time at the end of the script
+    start_time = time.perf_counter()
+
+    out.section(f"Exporting the last *{days} days* of transactions")
+
+    up_client = up_api.UpClient(
+        ctx.obj["up_token"],
+        session=ctx.obj["session"],
+        cache=ctx.obj["cache"],
+        base_url=ctx.obj["up_api_url"],
+        metrics=ctx.obj["metrics"],
+    )
+
+    out.start_task("Fetching the Up account IDs...")
+    accounts = up_client.get_accounts()
+    up_ids = {}
+    try:
+        if not up_account:
+            up_ids["transactional account"] = up_client.get_transactional_account_id(
+                accounts
+            )
+        for name in up_account:
+            up_ids[name] = up_client.account_id_from_name(name, accounts)
+    except ValueError as e:
+        out.task_error(f"Couldn't find an Up account: {e}.")
+        out.fatal("Couldn't find the accounts to export in Up.")
+        sys.exit(2)
+    out.task_success("Fetched the Up account IDs.")
+
+    since = datetime.datetime.now().astimezone() - datetime.timedelta(days=days)
+    with ExportWriter(file) as writer:
+        writer.write_accounts(accounts)
+        for name, up_id in up_ids.items():
+            out.start_task(f"Exporting the transactions from *{name}*...")
+            count = 0
+            # Export the transactions exactly as Up returns them
+            pages = up_client.iter_transaction_pages(
+                since, page_size=page_size, account_id=up_id, full=True
+            )
+            for page in pages:
+                writer.write_transactions(page)
+                count += len(page)
+            out.task_success(
+                f"Exported *{count} transactions* from *{name}*.",
+                counts={"exported": count},
+            )
+
+    out.end_section()
+
+    # Calculate the execution time
+    time_delta = time.perf_counter() - start_time
+
+    # Display the final script result
+    size = os.path.getsize(file)
+    out.success(
+        f"Exported *{writer.transaction_count} transactions* to `{file}`"
+        f" ({size / 1024:,.0f} KiB) in {time_delta:.2f} seconds.",
+        counts={"exported": writer.transaction_count, "bytes": size},
+    )
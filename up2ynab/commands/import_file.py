@@ -0,0 +1,101 @@
+import datetime
+import time
+
+import click
+
+from up2ynab.commands.transactions import (
+    account_option,
+    chunk_size_option,
+    flag_foreign_option,
+    import_transactions,
+    incremental_option,
+    match_transfers_option,
+    max_uploads_option,
+    mirror_option,
+    rules_option,
+    state_file_option,
+    ynab_account_name_option,
+)
+from up2ynab.export_file import UpExportFile
+from up2ynab.util.http_error_handler import handle_http_errors
+
+# The number of transactions read from the file and converted at a time. There's no
+# reason to keep this as small as Up's pages.
+FILE_PAGE_SIZE = 1000
+
+
+@click.command("import-file")
+@click.argument("file", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "-d",
+    "--days",
+    help="Only import transactions from this many days before today (inclusive)."
+    + " Defaults to every transaction in the file.",
+    type=click.IntRange(min=0),
+)
+@ynab_account_name_option
+@flag_foreign_option
+@incremental_option
+@state_file_option
+@mirror_option
+@chunk_size_option
+@max_uploads_option
+@account_option
+@rules_option
+@match_transfers_option
+@click.pass_context
+@handle_http_errors
+def import_file(
+    ctx,
+    file,
+    days,
+    ynab_account_name,
+    account,
+    flag_foreign,
+    incremental,
+    state_file,
+    mirror,
+    chunk_size,
+    max_uploads,
+    rules,
+    match_transfers,
+):
+    """Import the Up transactions in a file made by `up2ynab export` into YNAB.
+
+    This works just like `up2ynab transactions`, with the same options, except that the
+    transactions and account names come from the file instead of Up, e.g.:
+
+      $ up2ynab import-file up.jsonl.gz -A "Spending=Up Spending"
+
+    Only a YNAB API token is needed to import a file.
+    """
+
+    # Get the context-provided echo manager for printing output
+    out = ctx.obj["echo_manager"]
+
+    # Fetch the current time, to print the execution time at the end of the script
+    start_time = time.perf_counter()
+
+    out.section(f"Importing the transactions in `{file}`")
+
+    since = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+    if days is not None:
+        since = datetime.datetime.now().astimezone() - datetime.timedelta(days=days)
+
+    import_transactions(
+        ctx,
+        UpExportFile(file),
+        since,
+        start_time,
+        ynab_account_name=ynab_account_name,
+        account=account,
+        flag_foreign=flag_foreign,
+        incremental=incremental,
+        state_file=state_file,
+        mirror=mirror,
+        page_size=FILE_PAGE_SIZE,
+        chunk_size=chunk_size,
+        max_uploads=max_uploads,
+        rules=rules,
+        match_transfers=match_transfers,
+    )
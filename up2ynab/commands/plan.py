@@ -0,0 +1,195 @@
+import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+
+import up2ynab.clients.up as up_api
+import up2ynab.clients.ynab as ynab_api
+from up2ynab.commands.transactions import (
+    account_option,
+    flag_foreign_option,
+    page_size_option,
+    resolve_accounts,
+    rules_option,
+    ynab_account_name_option,
+)
+from up2ynab.plan import SyncPlan, plan_account
+from up2ynab.util.http_error_handler import handle_http_errors
+from up2ynab.util.ynab_mirror import YNABMirror
+
+# The number of each kind of change listed for each account, by default
+DEFAULT_SHOWN = 10
+
+
+def _describe_amount(date, amount):
+    """Return the date and amount (in millidollars) of a transaction as text, e.g.
+    "2021-03-04  -12.34"."""
+    return f"{date}  {amount / 1000:,.2f}"
+
+
+def _describe_create(tx):
+    return f"{_describe_amount(tx.date, tx.amount)}  {tx.payee_name}"
+
+
+def _describe_update(update):
+    tx = update.transaction
+    return (
+        f"{_describe_amount(update.old_date, update.old_amount)}  {tx.payee_name}"
+        f"  → {_describe_amount(tx.date, tx.amount)}"
+    )
+
+
+def _describe_missing(tx):
+    return _describe_amount(tx.date, tx.amount)
+
+
+def _show_changes(out, kind, changes, show, describe):
+    """List up to show of the changes of one kind, each described by describe."""
+    if not changes:
+        return
+    out.info(f"*{len(changes)} transactions* {kind}:")
+    for change in changes[:show]:
+        out.comment(describe(change))
+    if len(changes) > show:
+        out.comment(f"...and {len(changes) - show} more.")
+
+
+@click.command()
+@click.argument("file", required=False, type=click.Path(dir_okay=False))
+@click.option(
+    "-d",
+    "--days",
+    default=14,
+    help="Number of days before today (inclusive) to compare transactions from.",
+    show_default=True,
+    required=True,
+)
+@click.option(
+    "--show",
+    default=DEFAULT_SHOWN,
+    help="Maximum number of each kind of change to list for each account.",
+    show_default=True,
+    type=click.IntRange(min=0),
+)
+@ynab_account_name_option
+@flag_foreign_option
+@page_size_option
+@account_option
+@rules_option
+@click.pass_context
+@handle_http_errors
+def plan(
+    ctx, file, days, show, ynab_account_name, flag_foreign, page_size, account, rules
+):
+    """Show what importing your Up transactions would change in YNAB, without changing
+    anything, and optionally save the plan to FILE to apply later.
+
+    Both sides are compared locally: the YNAB account is kept in the same local mirror
+    as `up2ynab transactions --mirror`, indexed by import ID. The plan lists the
+    transactions that are new, the ones whose amount or date changed in Up, and the
+    ones in YNAB that are missing from Up. After reviewing it, send exactly those
+    changes with
+
+      $ up2ynab plan --days 30 plan.json
+      $ up2ynab apply plan.json
+    """
+
+    # Get the context-provided echo manager for printing output
+    out = ctx.obj["echo_manager"]
+    metrics = ctx.obj["metrics"]
+
+    # Fetch the current time, to print the execution time at the end of the script
+    start_time = time.perf_counter()
+
+    mirror = YNABMirror()
+    ctx.call_on_close(mirror.close)
+
+    out.section(f"Planning the last *{days} days* of transactions")
+
+    up_client = up_api.UpClient(
+        ctx.obj["up_token"],
+        session=ctx.obj["session"],
+        cache=ctx.obj["cache"],
+        base_url=ctx.obj["up_api_url"],
+        metrics=metrics,
+    )
+    ynab_client = ynab_api.YNABClient(
+        ctx.obj["ynab_token"],
+        session=ctx.obj["session"],
+        cache=ctx.obj["cache"],
+        base_url=ctx.obj["ynab_api_url"],
+        metrics=metrics,
+    )
+
+    # Without any --account mappings, plan the transactional account into the account
+    # named by --ynab-account-name
+    mappings = list(account) if account else [(None, ynab_account_name)]
+
+    with metrics.stage("account_lookup"):
+        accounts = resolve_accounts(out, up_client, ynab_client, mappings)
+
+    since = datetime.datetime.now().astimezone() - datetime.timedelta(days=days)
+
+    def plan_one(synced_account):
+        name = synced_account.up_name
+        out.start_task(f"Comparing *{name}* with YNAB...", task=(name, "plan"))
+        account_plan = plan_account(
+            up_client,
+            ynab_client,
+            mirror,
+            synced_account,
+            since,
+            page_size=page_size,
+            rules=rules,
+            metrics=metrics,
+        )
+        out.task_success(
+            f"Compared *{name}* with YNAB.",
+            task=(name, "plan"),
+            counts={
+                "create": len(account_plan.create),
+                "update": len(account_plan.update),
+                "missing": len(account_plan.missing),
+            },
+        )
+        return account_plan
+
+    with ThreadPoolExecutor(max_workers=len(accounts)) as executor:
+        sync_plan = SyncPlan(
+            list(executor.map(plan_one, accounts)), since, foreign_flag=flag_foreign
+        )
+    out.end_section()
+
+    for account_plan in sync_plan.accounts:
+        out.section(f"Changes to *{account_plan.account.up_name}*")
+        if not (account_plan.create or account_plan.update or account_plan.missing):
+            out.info("YNAB is up to date.")
+        _show_changes(out, "to create", account_plan.create, show, _describe_create)
+        _show_changes(out, "to update", account_plan.update, show, _describe_update)
+        _show_changes(
+            out,
+            "in YNAB are missing from Up",
+            account_plan.missing,
+            show,
+            _describe_missing,
+        )
+        out.end_section()
+
+    if file is not None:
+        sync_plan.save(file)
+
+    # Calculate the execution time
+    time_delta = time.perf_counter() - start_time
+
+    # Display the final script result
+    counts = sync_plan.counts()
+    summary = (
+        f"Planned *{counts['create']} new* and *{counts['update']} changed*"
+        f" transactions, with *{counts['missing']} missing* from Up,"
+        f" in {time_delta:.2f} seconds."
+    )
+    if file is not None:
+        out.success(summary, f"Apply it with `up2ynab apply {file}`.", counts=counts)
+    else:
+        out.success(summary, counts=counts)
@@ -0,0 +1,139 @@
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+
+import up2ynab.clients.up as up_api
+import up2ynab.clients.ynab as ynab_api
+from up2ynab.savers import (
+    budgeted_to_match,
+    current_month,
+    match_savers,
+    saver_balances,
+)
+from up2ynab.util.account_mapping import AccountMapping
+from up2ynab.util.http_error_handler import handle_http_errors
+from up2ynab.util.ynab_mirror import YNABMirror
+
+
+@click.command()
+@click.option(
+    "--saver",
+    "-s",
+    multiple=True,
+    envvar="UP2YNAB_SAVERS",
+    help="An Up Saver and the YNAB category to keep its balance in, as"
+    + " 'SAVER=CATEGORY'. Can be given multiple times. Without any, every Saver is kept"
+    + " in the category with the same name, if there is one. Can also be set by"
+    + " UP2YNAB_SAVERS environment variable, with pairs separated by semicolons.",
+    type=AccountMapping("SAVER", "CATEGORY"),
+)
+@click.pass_context
+@handle_http_errors
+def savers(ctx, saver):
+    """Budget to your YNAB categories so that their balances match your Up Savers.
+
+    The balance of every Saver comes from a single request to Up, and the categories
+    are kept in the same local mirror as `up2ynab transactions --mirror`, refreshed with
+    only the categories changed since the last run. Only the categories whose balance
+    differs from their Saver's are updated, by changing the amount budgeted to them this
+    month, so when nothing has changed no updates are sent. This makes it cheap enough
+    to run after every sync, e.g.
+
+      $ up2ynab transactions --account "Spending=Up Spending" && up2ynab savers
+    """
+
+    # Get the context-provided echo manager for printing output
+    out = ctx.obj["echo_manager"]
+    metrics = ctx.obj["metrics"]
+
+    # Fetch the current time, to print the execution time at the end of the script
+    start_time = time.perf_counter()
+
+    mirror = YNABMirror()
+    ctx.call_on_close(mirror.close)
+
+    out.section("Syncing your Saver balances with YNAB")
+
+    up_client = up_api.UpClient(
+        ctx.obj["up_token"],
+        session=ctx.obj["session"],
+        cache=ctx.obj["cache"],
+        base_url=ctx.obj["up_api_url"],
+        metrics=metrics,
+    )
+    ynab_client = ynab_api.YNABClient(
+        ctx.obj["ynab_token"],
+        session=ctx.obj["session"],
+        cache=ctx.obj["cache"],
+        base_url=ctx.obj["ynab_api_url"],
+        metrics=metrics,
+    )
+
+    def refresh_categories():
+        with metrics.stage("category_refresh"):
+            return mirror.refresh_categories(ynab_client, current_month())
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        # The categories don't depend on anything from Up, so refresh them in the
+        # background while the balances are fetched
+        out.start_task("Refreshing the YNAB categories...", task="ynab_categories")
+        categories_future = executor.submit(refresh_categories)
+
+        out.start_task("Fetching the Saver balances from Up...", task="up_savers")
+        with metrics.stage("saver_balances"):
+            # The cached accounts don't include balances, so always fetch them
+            balances = saver_balances(up_client.get_accounts(refresh=True))
+        out.task_success(
+            f"Fetched the balances of *{len(balances)} Savers*.", task="up_savers"
+        )
+
+        budget, changed_count = categories_future.result()
+        out.task_success(
+            f"Refreshed the YNAB categories, with *{changed_count}* changed since the"
+            " last run.",
+            task="ynab_categories",
+        )
+
+    try:
+        synced, unmatched = match_savers(
+            balances, mirror.categories(budget), list(saver) if saver else None
+        )
+    except ValueError as e:
+        out.fatal(f"Couldn't match the Savers with YNAB categories: {e}.")
+        sys.exit(2)
+    for name in unmatched:
+        out.comment(f"There's no category called *{name}*, so it was skipped.")
+
+    counts = {"updated": 0, "unchanged": 0}
+    for synced_saver in synced:
+        category_name = synced_saver.category.name
+        budgeted = budgeted_to_match(synced_saver)
+        if budgeted == synced_saver.category.budgeted:
+            counts["unchanged"] += 1
+            continue
+
+        out.start_task(f"Updating *{category_name}*...")
+        with metrics.stage("category_update"):
+            category = ynab_client.update_month_category(
+                synced_saver.category.id, budgeted
+            )
+        mirror.update_category(budget, category)
+        counts["updated"] += 1
+        out.task_success(
+            f"Updated *{category_name}* to match the *{synced_saver.name}* balance of"
+            f" *{synced_saver.balance / 1000:,.2f}*."
+        )
+
+    out.end_section()
+
+    # Calculate the execution time
+    time_delta = time.perf_counter() - start_time
+
+    # Display the final script result
+    out.success(
+        f"Updated *{counts['updated']} categories*, with *{counts['unchanged']}*"
+        f" already matching their Saver, in {time_delta:.2f} seconds.",
+        counts=counts,
+    )
@@ -0,0 +1,185 @@
+import signal
+import threading
+
+import click
+
+import up2ynab.clients.up as up_api
+import up2ynab.clients.ynab as ynab_api
+from up2ynab.commands.transactions import (
+    account_option,
+    chunk_size_option,
+    flag_foreign_option,
+    max_uploads_option,
+    mirror_option,
+    resolve_accounts,
+    rules_option,
+    state_file_option,
+    ynab_account_name_option,
+)
+from up2ynab.util.http_error_handler import handle_http_errors
+from up2ynab.util.state_store import StateStore
+from up2ynab.util.ynab_mirror import YNABMirror
+from up2ynab.webhooks import DEFAULT_BATCH_WINDOW, WebhookBatcher, make_server
+
+
+@click.command()
+@click.option(
+    "--webhook-secret",
+    envvar="UP2YNAB_WEBHOOK_SECRET",
+    required=True,
+    help="The secret key Up returned when the webhook was created, used to verify"
+    + " that events really come from Up. Can also be set by UP2YNAB_WEBHOOK_SECRET"
+    + " environment variable.",
+)
+@click.option(
+    "--host",
+    default="127.0.0.1",
+    help="The address to listen for webhook events on.",
+    show_default=True,
+)
+@click.option(
+    "--port",
+    envvar="UP2YNAB_PORT",
+    default=8080,
+    help="The port to listen for webhook events on. Can also be set by UP2YNAB_PORT"
+    + " environment variable.",
+    show_default=True,
+    type=click.IntRange(min=0, max=65535),
+)
+@click.option(
+    "--batch-window",
+    default=DEFAULT_BATCH_WINDOW,
+    help="Seconds to keep collecting events after the first arrives, before pushing"
+    + " them to YNAB together.",
+    show_default=True,
+    type=click.FloatRange(min=0),
+)
+@ynab_account_name_option
+@account_option
+@flag_foreign_option
+@state_file_option
+@mirror_option
+@chunk_size_option
+@max_uploads_option
+@rules_option
+@click.pass_context
+@handle_http_errors
+def serve(
+    ctx,
+    webhook_secret,
+    host,
+    port,
+    batch_window,
+    ynab_account_name,
+    account,
+    flag_foreign,
+    state_file,
+    mirror,
+    chunk_size,
+    max_uploads,
+    rules,
+):
+    """Import transactions into YNAB as Up sends webhook events for them.
+
+    This runs an HTTP server that receives Up webhook events, so new transactions reach
+    YNAB within seconds without polling. Events arriving close together are pushed to
+    YNAB in a single batch. Transactions that settle are updated in YNAB, and deleted
+    transactions are removed if --mirror is used.
+
+    The server must be reachable by Up, e.g. through a reverse proxy or tunnel, at the
+    URL the webhook was created with. Imported transactions are recorded in the same
+    local database as `up2ynab transactions --incremental`, so running that picks up
+    anything missed while the server wasn't running.
+
+    Stop the server with Ctrl+C or SIGTERM. Any events already received are pushed to
+    YNAB first.
+    """
+
+    # Get the context-provided echo manager for printing output
+    out = ctx.obj["echo_manager"]
+
+    state = StateStore(state_file)
+    ctx.call_on_close(state.close)
+
+    ynab_mirror = YNABMirror() if mirror else None
+    if ynab_mirror is not None:
+        ctx.call_on_close(ynab_mirror.close)
+
+    up_client = up_api.UpClient(
+        ctx.obj["up_token"],
+        session=ctx.obj["session"],
+        cache=ctx.obj["cache"],
+        base_url=ctx.obj["up_api_url"],
+        metrics=ctx.obj["metrics"],
+    )
+    ynab_client = ynab_api.YNABClient(
+        ctx.obj["ynab_token"],
+        session=ctx.obj["session"],
+        cache=ctx.obj["cache"],
+        base_url=ctx.obj["ynab_api_url"],
+        metrics=ctx.obj["metrics"],
+    )
+
+    # Without any --account mappings, sync the transactional account into the account
+    # named by --ynab-account-name
+    mappings = list(account) if account else [(None, ynab_account_name)]
+
+    out.section("Starting the webhook server")
+    with ctx.obj["metrics"].stage("account_lookup"):
+        accounts = resolve_accounts(out, up_client, ynab_client, mappings)
+
+    batcher = WebhookBatcher(
+        out,
+        up_client,
+        ynab_client,
+        accounts,
+        state=state,
+        mirror=ynab_mirror,
+        foreign_flag=flag_foreign,
+        batch_window=batch_window,
+        chunk_size=chunk_size,
+        max_uploads=max_uploads,
+        rules=rules,
+    )
+    try:
+        server = make_server(host, port, webhook_secret, batcher, out)
+    except OSError as e:
+        out.fatal(f"Couldn't listen on *{host}:{port}*: {e.strerror}.")
+        ctx.exit(2)
+
+    out.success(f"Listening for Up webhook events on `http://{host}:{port}`.")
+    out.end_section()
+
+    # Stop serving on Ctrl+C or SIGTERM
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        stop.set()
+
+    previous_handlers = {
+        signum: signal.signal(signum, request_stop)
+        for signum in (signal.SIGINT, signal.SIGTERM)
+    }
+
+    server_thread = threading.Thread(target=server.serve_forever)
+    batcher_thread = threading.Thread(target=batcher.run)
+    server_thread.start()
+    batcher_thread.start()
+
+    try:
+        stop.wait()
+    finally:
+        # Stop accepting events, then push the ones already received
+        server.shutdown()
+        server.server_close()
+        server_thread.join()
+        batcher.stop()
+        batcher_thread.join()
+
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+
+    out.success(
+        "Stopped the webhook server after pushing"
+        f" *{batcher.total_count} transactions*."
+    )
@@ -1,25 +1,21 @@
 import sys
 import datetime
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import click
-import requests.exceptions
 
 import up2ynab.clients.up as up_api
 import up2ynab.clients.ynab as ynab_api
+from up2ynab.sync import SyncedAccount, TransactionSync
+from up2ynab.util.account_mapping import AccountMapping
 from up2ynab.util.http_error_handler import handle_http_errors
+from up2ynab.util.rules_file import RulesFile
+from up2ynab.util.state_store import StateStore
+from up2ynab.util.ynab_mirror import YNABMirror
 
-
-@click.command()
-@click.option(
-    "-d",
-    "--days",
-    default=14,
-    help="Number of days before today (inclusive) to find transactions.",
-    show_default=True,
-    required=True,
-)
-@click.option(
+# Options shared by the commands that sync transactions
+ynab_account_name_option = click.option(
     "--ynab-account-name",
     "-a",
     required=True,
@@ -29,7 +25,8 @@ from up2ynab.util.http_error_handler import handle_http_errors
     default="Up Spending",
     show_default=True,
 )
-@click.option(
+
+flag_foreign_option = click.option(
     "--flag-foreign",
     "-ff",
     required=False,
@@ -40,20 +37,240 @@ from up2ynab.util.http_error_handler import handle_http_errors
         ["red", "orange", "yellow", "green", "blue", "purple"], case_sensitive=False
     ),
 )
+
+incremental_option = click.option(
+    "--incremental",
+    "-i",
+    is_flag=True,
+    envvar="UP2YNAB_INCREMENTAL",
+    help="Only fetch transactions newer than the last sync (within --days), and skip"
+    + " any that were previously imported. With --mirror, previously imported"
+    + " transactions are compared with the mirror instead, so that changes to them"
+    + " are still updated. Can also be set by UP2YNAB_INCREMENTAL environment"
+    + " variable.",
+)
+
+state_file_option = click.option(
+    "--state-file",
+    envvar="UP2YNAB_STATE_FILE",
+    help="The local database used to remember imported transactions."
+    + " Defaults to a file in your user app directory. Can also be set by"
+    + " UP2YNAB_STATE_FILE environment variable.",
+    type=click.Path(dir_okay=False),
+)
+
+mirror_option = click.option(
+    "--mirror",
+    "-m",
+    is_flag=True,
+    envvar="UP2YNAB_MIRROR",
+    help="Keep a local copy of the YNAB account's transactions, updated with only what"
+    + " changed since the last run. Only transactions missing from YNAB are uploaded,"
+    + " and ones whose amount or date changed in Up are updated. Can also be set by"
+    + " UP2YNAB_MIRROR environment variable.",
+)
+
+page_size_option = click.option(
+    "--page-size",
+    default=up_api.DEFAULT_PAGE_SIZE,
+    help="Number of transactions to request from Up at a time.",
+    show_default=True,
+    type=click.IntRange(min=1, max=100),
+)
+
+chunk_size_option = click.option(
+    "--chunk-size",
+    default=ynab_api.DEFAULT_CHUNK_SIZE,
+    help="Maximum number of transactions to upload to YNAB in a single request.",
+    show_default=True,
+    type=click.IntRange(min=1),
+)
+
+max_uploads_option = click.option(
+    "--max-uploads",
+    default=ynab_api.DEFAULT_MAX_UPLOADS,
+    help="Maximum number of upload requests to YNAB to have in flight at once.",
+    show_default=True,
+    type=click.IntRange(min=1),
+)
+
+account_option = click.option(
+    "--account",
+    "-A",
+    multiple=True,
+    envvar="UP2YNAB_ACCOUNTS",
+    help="An Up account (transactional or Saver) to sync and the YNAB account to sync"
+    + " it into, as 'UP ACCOUNT=YNAB ACCOUNT'. Can be given multiple times to sync"
+    + " several accounts at once, in place of --ynab-account-name. Can also be set by"
+    + " UP2YNAB_ACCOUNTS environment variable, with pairs separated by semicolons.",
+    type=AccountMapping(),
+)
+
+rules_option = click.option(
+    "--rules",
+    envvar="UP2YNAB_RULES",
+    help="A JSON file of rules setting the YNAB payee and category of transactions"
+    + " based on their Up description, category and tags. Can also be set by"
+    + " UP2YNAB_RULES environment variable.",
+    type=RulesFile(),
+)
+
+match_transfers_option = click.option(
+    "--match-transfers",
+    "-t",
+    is_flag=True,
+    envvar="UP2YNAB_MATCH_TRANSFERS",
+    help="Import moves between the Up accounts given with --account, such as to a"
+    + " Saver or round ups, as YNAB transfers, once each, instead of as spending in"
+    + " both accounts. Can also be set by UP2YNAB_MATCH_TRANSFERS environment"
+    + " variable.",
+)
+
+
+def _resolve_account_ids(client, names, lookup):
+    """Return a client's accounts, and the ID of each of the named accounts as found by
+    lookup(name, accounts), or None for any that can't be found.
+
+    If any can't be found among accounts that came from the cache, the accounts are
+    fetched again before giving up, in case the cache is out of date.
+    """
+
+    def ids_from(accounts):
+        ids = []
+        for name in names:
+            try:
+                ids.append(lookup(name, accounts))
+            except ValueError:
+                ids.append(None)
+        return ids
+
+    accounts = client.get_accounts()
+    ids = ids_from(accounts)
+    if None in ids and client.accounts_cached:
+        accounts = client.get_accounts(refresh=True)
+        ids = ids_from(accounts)
+    return accounts, ids
+
+
+def resolve_accounts(out, up_client, ynab_client, mappings):
+    """Find the IDs of the accounts in each (up_name, ynab_name) mapping, where an
+    up_name of None means the transactional account, and return them as a list of
+    SyncedAccounts.
+
+    If any of the accounts can't be found, the error is displayed and the command exits.
+    """
+
+    def up_account_id(up_name, accounts):
+        if up_name is None:
+            return up_client.get_transactional_account_id(accounts)
+        return up_client.account_id_from_name(up_name, accounts)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        # Looking up the accounts in YNAB doesn't depend on anything from Up, so do it
+        # in the background while the Up accounts are found. Each side's accounts are
+        # only fetched once (if they aren't cached), however many are being synced.
+        out.start_task("Fetching the account IDs in YNAB...", task="ynab_accounts")
+        ynab_future = executor.submit(
+            _resolve_account_ids,
+            ynab_client,
+            [ynab_name for _, ynab_name in mappings],
+            ynab_client.account_id_from_name,
+        )
+
+        out.start_task("Fetching the Up account IDs...", task="up_accounts")
+        up_accounts, up_ids = _resolve_account_ids(
+            up_client, [up_name for up_name, _ in mappings], up_account_id
+        )
+        for (up_name, _), up_id in zip(mappings, up_ids):
+            if up_id is not None:
+                continue
+            elif up_name is None:
+                out.task_error(
+                    "More or less than 1 transactional account found.",
+                    task="up_accounts",
+                )
+                out.fatal("Couldn't determine the Up transactional account ID.")
+            else:
+                out.task_error(
+                    f"An Up account called *{up_name}* cannot be found.",
+                    task="up_accounts",
+                )
+                out.fatal("Couldn't find the named account in Up.")
+            sys.exit(2)
+        out.task_success("Fetched the Up account IDs.", task="up_accounts")
+        up_names = {acc["id"]: acc["attributes"]["displayName"] for acc in up_accounts}
+
+        _, ynab_ids = ynab_future.result()
+        for (_, ynab_name), ynab_id in zip(mappings, ynab_ids):
+            if ynab_id is None:
+                out.task_error(
+                    f"A YNAB account called *{ynab_name}* cannot be found.",
+                    task="ynab_accounts",
+                )
+                out.fatal(f"Couldn't find the named Up account in YNAB.")
+                sys.exit(2)
+        out.task_success("Fetched the account IDs in YNAB.", task="ynab_accounts")
+
+    return [
+        SyncedAccount(up_id, up_names[up_id], ynab_id)
+        for up_id, ynab_id in zip(up_ids, ynab_ids)
+    ]
+
+
+@click.command()
+@click.option(
+    "-d",
+    "--days",
+    default=14,
+    help="Number of days before today (inclusive) to find transactions.",
+    show_default=True,
+    required=True,
+)
+@ynab_account_name_option
+@flag_foreign_option
+@incremental_option
+@state_file_option
+@mirror_option
+@page_size_option
+@chunk_size_option
+@max_uploads_option
+@account_option
+@rules_option
+@match_transfers_option
 @click.pass_context
 @handle_http_errors
-def transactions(ctx, days, ynab_account_name, flag_foreign):
+def transactions(
+    ctx,
+    days,
+    ynab_account_name,
+    account,
+    flag_foreign,
+    incremental,
+    state_file,
+    mirror,
+    page_size,
+    chunk_size,
+    max_uploads,
+    rules,
+    match_transfers,
+):
     """Import your Up transactions into YNAB.
 
-    This command only imports transactions from the transactional account in Up, not
-    from any Savers.
-    
+    By default this command only imports transactions from the transactional account in
+    Up, not from any Savers. To sync several accounts, including Savers, give each pair
+    of Up and YNAB accounts with --account, e.g.:
+
+      $ up2ynab transactions -A "Spending=Up Spending" -A "Holiday=Up Holiday"
+
+    With --incremental, a record of the imported transactions is kept locally so that
+    each run only fetches and uploads what is new since the last one.
+
     Make sure your API tokens are setup correctly! Recommended use is by setting the
     environment variables UP_API_TOKEN and YNAB_API_TOKEN. You can check they are
     configured properly by running
 
       $ up2ynab check
-    
+
     For more information about setting the tokens, view
 
       $ up2ynab check --help
@@ -67,64 +284,121 @@ def transactions(ctx, days, ynab_account_name, flag_foreign):
 
     out.section(f"Checking the last *{days} days* of transactions")
 
-    # Display the selected foreign currency flag, if one has been selected
-    if flag_foreign is not None:
-        out.info(f"Any foreign currency transactions will be flagged *{flag_foreign}*.")
+    up_client = up_api.UpClient(
+        ctx.obj["up_token"],
+        session=ctx.obj["session"],
+        cache=ctx.obj["cache"],
+        base_url=ctx.obj["up_api_url"],
+        metrics=ctx.obj["metrics"],
+    )
 
-    out.start_task("Fetching the Up transactional account ID...")
+    # Fetch the transactions from Up from the past proved number of days, or from just
+    # before the last synced transaction if that is more recent, and sync every account
+    since = datetime.datetime.now().astimezone() - datetime.timedelta(days=days)
+    import_transactions(
+        ctx,
+        up_client,
+        since,
+        start_time,
+        ynab_account_name=ynab_account_name,
+        account=account,
+        flag_foreign=flag_foreign,
+        incremental=incremental,
+        state_file=state_file,
+        mirror=mirror,
+        page_size=page_size,
+        chunk_size=chunk_size,
+        max_uploads=max_uploads,
+        rules=rules,
+        match_transfers=match_transfers,
+    )
 
-    # Create the Up client and try to get the ID of the transactional account
-    up_client = up_api.UpClient(ctx.obj["up_token"])
-    try:
-        up_client.get_transactional_account_id()
-    except ValueError:
-        out.task_error("More or less than 1 transactional account found.")
-        out.fatal("Couldn't determine the Up transactional account ID.")
-        sys.exit(2)
-    out.task_success("Fetched the Up transactional account ID.")
 
-    # Fetch the transactions from Up from the past proved number of days using the
-    # client
-    out.start_task("Fetching transactions from Up...")
-    transactions = up_client.get_transactions(
-        datetime.datetime.now() - datetime.timedelta(days=days)
-    )
+def import_transactions(
+    ctx,
+    up_client,
+    since,
+    start_time,
+    ynab_account_name,
+    account,
+    flag_foreign,
+    incremental,
+    state_file,
+    mirror,
+    page_size,
+    chunk_size,
+    max_uploads,
+    rules=None,
+    match_transfers=False,
+):
+    """Sync the transactions created since since from up_client into YNAB, given the
+    options of the transactions command, then end the current section and show the
+    result.
 
-    # Convert the transaction data to the format required by the YNAB client
-    ynab_transactions = [
-        ynab_api.YNABTransaction.from_up_transaction_data(tx) for tx in transactions
-    ]
+    up_client is an UpClient, or anything with the same interface such as an
+    up2ynab.export_file.UpExportFile. start_time is the perf_counter time the command
+    started, for reporting how long it took.
+    """
+    out = ctx.obj["echo_manager"]
 
-    out.task_success(f"Fetched the *{len(transactions)} transactions* from Up.")
+    state = StateStore(state_file) if incremental else None
+    if state is not None:
+        ctx.call_on_close(state.close)
 
-    out.start_task("Fetching the Up account ID in YNAB...")
+    ynab_mirror = YNABMirror() if mirror else None
+    if ynab_mirror is not None:
+        ctx.call_on_close(ynab_mirror.close)
 
-    # Create the YNAB client and try to get the ID of the up account
-    ynab_client = ynab_api.YNABClient(ctx.obj["ynab_token"])
-    account_id = None
-    try:
-        account_id = ynab_client.account_id_from_name(ynab_account_name)
-        out.task_success(f"Fetched ID for YNAB account *{ynab_account_name}*.")
-    except ValueError:
-        out.task_error(f"A YNAB account called *{ynab_account_name}* cannot be found.")
-        out.fatal(f"Couldn't find the named Up account in YNAB.")
-        sys.exit(2)
+    # Display the selected foreign currency flag, if one has been selected
+    if flag_foreign is not None:
+        out.info(f"Any foreign currency transactions will be flagged *{flag_foreign}*.")
 
-    out.start_task("Uploading the transactions to YNAB...")
+    ynab_client = ynab_api.YNABClient(
+        ctx.obj["ynab_token"],
+        session=ctx.obj["session"],
+        cache=ctx.obj["cache"],
+        base_url=ctx.obj["ynab_api_url"],
+        metrics=ctx.obj["metrics"],
+    )
+
+    # Without any --account mappings, sync the transactional account into the account
+    # named by --ynab-account-name
+    mappings = list(account) if account else [(None, ynab_account_name)]
+
+    with ctx.obj["metrics"].stage("account_lookup"):
+        accounts = resolve_accounts(out, up_client, ynab_client, mappings)
 
-    # Import the transactions to YNAB via the client
-    ids = ynab_client.create_transactions(account_id, ynab_transactions)
-    out.task_success(
-        f"Uploaded *{len(transactions)-len(ids)} new transactions* to YNAB."
+    sync = TransactionSync(
+        out,
+        up_client,
+        ynab_client,
+        state=state,
+        mirror=ynab_mirror,
+        foreign_flag=flag_foreign,
+        page_size=page_size,
+        chunk_size=chunk_size,
+        max_uploads=max_uploads,
+        metrics=ctx.obj["metrics"],
+        rules=rules,
+        match_transfers=match_transfers,
     )
-    out.comment(f"*{len(ids)} transactions* were previously imported.")
+    results = sync.sync_accounts(accounts, since)
 
     out.end_section()
 
+    new_count = sum(result.new_count for result in results)
+    if any(result.failed_chunks for result in results):
+        out.fatal(
+            f"Only *{new_count} new transactions* could be uploaded to YNAB.",
+            "Run the command again to retry the rest.",
+        )
+        sys.exit(2)
+
     # Calculate the execution time
     time_delta = time.perf_counter() - start_time
 
     # Display the final script result
     out.success(
-        f"Imported *{len(transactions)-len(ids)} new transactions* in {time_delta:.2f} seconds."
+        f"Imported *{new_count} new transactions* in {time_delta:.2f} seconds.",
+        counts={"new": new_count},
     )
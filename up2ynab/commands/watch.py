@@ -0,0 +1,295 @@
+import datetime
+import json
+import os
+import signal
+import tempfile
+import threading
+
+import click
+
+import up2ynab.clients.up as up_api
+import up2ynab.clients.ynab as ynab_api
+from up2ynab.commands.transactions import (
+    account_option,
+    chunk_size_option,
+    flag_foreign_option,
+    match_transfers_option,
+    max_uploads_option,
+    mirror_option,
+    page_size_option,
+    resolve_accounts,
+    rules_option,
+    state_file_option,
+    ynab_account_name_option,
+)
+from up2ynab.sync import TransactionSync
+from up2ynab.util.http_error_handler import handle_http_errors
+from up2ynab.util.state_store import StateStore
+from up2ynab.util.ynab_mirror import YNABMirror
+
+DEFAULT_MIN_INTERVAL = 60
+DEFAULT_MAX_INTERVAL = 15 * 60
+
+# How much the polling interval grows after each poll that finds nothing new
+BACKOFF_FACTOR = 2
+
+# The fraction of the YNAB rate limit beyond which polling slows down
+RATE_LIMIT_PRESSURE = 0.75
+
+# How far before the last synced transaction each poll starts looking. This is much
+# shorter than for one-off imports, as the watcher is never far behind.
+WATCH_OVERLAP = datetime.timedelta(hours=1)
+
+
+class PollSchedule:
+    """An adaptive polling interval, in seconds.
+
+    The interval drops to min_interval after a poll that finds new transactions, and
+    grows by BACKOFF_FACTOR after each poll that doesn't, up to max_interval. Under
+    rate-limit pressure it goes straight to max_interval, or longer if the API asks.
+    """
+
+    def __init__(self, min_interval, max_interval):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+
+    def activity(self):
+        self.interval = self.min_interval
+
+    def idle(self):
+        self.interval = min(self.interval * BACKOFF_FACTOR, self.max_interval)
+
+    def rate_limited(self, retry_after=None):
+        self.interval = max(self.max_interval, retry_after or 0)
+
+
+def _write_heartbeat(path, heartbeat):
+    """Atomically replace the heartbeat file with the given dict as JSON."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(heartbeat, f)
+    os.replace(tmp_path, path)
+
+
+@click.command()
+@click.option(
+    "-d",
+    "--days",
+    default=14,
+    help="Number of days before today (inclusive) to find transactions in on the first"
+    + " poll, for accounts that haven't been synced before.",
+    show_default=True,
+)
+@ynab_account_name_option
+@account_option
+@flag_foreign_option
+@state_file_option
+@mirror_option
+@page_size_option
+@chunk_size_option
+@max_uploads_option
+@rules_option
+@match_transfers_option
+@click.option(
+    "--min-interval",
+    default=DEFAULT_MIN_INTERVAL,
+    help="Seconds to wait before polling again after new transactions are found.",
+    show_default=True,
+    type=click.IntRange(min=1),
+)
+@click.option(
+    "--max-interval",
+    default=DEFAULT_MAX_INTERVAL,
+    help="Longest number of seconds to wait between polls while there is no activity.",
+    show_default=True,
+    type=click.IntRange(min=1),
+)
+@click.option(
+    "--heartbeat-file",
+    envvar="UP2YNAB_HEARTBEAT_FILE",
+    help="A file to rewrite with the time and result of every poll, for health checks."
+    + " Can also be set by UP2YNAB_HEARTBEAT_FILE environment variable.",
+    type=click.Path(dir_okay=False),
+)
+@click.pass_context
+@handle_http_errors
+def watch(
+    ctx,
+    days,
+    ynab_account_name,
+    account,
+    flag_foreign,
+    state_file,
+    mirror,
+    page_size,
+    chunk_size,
+    max_uploads,
+    rules,
+    match_transfers,
+    min_interval,
+    max_interval,
+    heartbeat_file,
+):
+    """Keep importing new Up transactions into YNAB as they appear.
+
+    This is a long-running alternative to running `up2ynab transactions --incremental`
+    on a schedule. The API clients, connections and account IDs are kept between polls,
+    and only transactions newer than the last poll are fetched.
+
+    Up is polled every --min-interval seconds after new transactions are found. While
+    nothing new turns up the interval doubles, up to --max-interval, and it goes
+    straight to --max-interval when close to the YNAB rate limit.
+
+    Stop watching with Ctrl+C or SIGTERM. The poll in progress, if any, is finished
+    first.
+    """
+
+    from requests.exceptions import ConnectionError, HTTPError, Timeout
+
+    # Get the context-provided echo manager for printing output
+    out = ctx.obj["echo_manager"]
+
+    state = StateStore(state_file)
+    ctx.call_on_close(state.close)
+
+    ynab_mirror = YNABMirror() if mirror else None
+    if ynab_mirror is not None:
+        ctx.call_on_close(ynab_mirror.close)
+
+    up_client = up_api.UpClient(
+        ctx.obj["up_token"],
+        session=ctx.obj["session"],
+        cache=ctx.obj["cache"],
+        base_url=ctx.obj["up_api_url"],
+        metrics=ctx.obj["metrics"],
+    )
+    ynab_client = ynab_api.YNABClient(
+        ctx.obj["ynab_token"],
+        session=ctx.obj["session"],
+        cache=ctx.obj["cache"],
+        base_url=ctx.obj["ynab_api_url"],
+        metrics=ctx.obj["metrics"],
+    )
+
+    # Without any --account mappings, sync the transactional account into the account
+    # named by --ynab-account-name
+    mappings = list(account) if account else [(None, ynab_account_name)]
+
+    out.section("Starting to watch for new transactions")
+    with ctx.obj["metrics"].stage("account_lookup"):
+        accounts = resolve_accounts(out, up_client, ynab_client, mappings)
+    out.end_section()
+
+    sync = TransactionSync(
+        out,
+        up_client,
+        ynab_client,
+        state=state,
+        mirror=ynab_mirror,
+        foreign_flag=flag_foreign,
+        page_size=page_size,
+        chunk_size=chunk_size,
+        max_uploads=max_uploads,
+        overlap=WATCH_OVERLAP,
+        metrics=ctx.obj["metrics"],
+        rules=rules,
+        match_transfers=match_transfers,
+    )
+
+    # Finish the current poll and stop cleanly on Ctrl+C or SIGTERM
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        stop.set()
+
+    previous_handlers = {
+        signum: signal.signal(signum, request_stop)
+        for signum in (signal.SIGINT, signal.SIGTERM)
+    }
+
+    schedule = PollSchedule(min_interval, max_interval)
+    since = datetime.datetime.now().astimezone() - datetime.timedelta(days=days)
+    total_count = 0
+
+    try:
+        while not stop.is_set():
+            poll_time = datetime.datetime.now().astimezone()
+            out.section(f"Polling at *{poll_time:%H:%M:%S}*")
+            poll_ok = False
+
+            try:
+                # The cached account IDs have been invalidated by a 404, so find them
+                # again in case they've changed
+                with ctx.obj["metrics"].stage("poll"):
+                    if accounts is None:
+                        accounts = resolve_accounts(
+                            out, up_client, ynab_client, mappings
+                        )
+                    results = sync.sync_accounts(accounts, since)
+            except HTTPError as e:
+                out.cancel_tasks()
+                code = e.response.status_code
+                if code == 401:
+                    raise
+                elif code == 429:
+                    retry_after = e.response.headers.get("Retry-After", "")
+                    schedule.rate_limited(
+                        int(retry_after) if retry_after.isdigit() else None
+                    )
+                    out.warning("The rate limit has been exceeded, slowing down.")
+                else:
+                    if code == 404:
+                        accounts = None
+                    schedule.idle()
+                    out.warning(
+                        f"Polling failed with an HTTP {code} error:",
+                        f"  *{e.request.method}* `{e.response.url}`",
+                    )
+            except (ConnectionError, Timeout) as e:
+                out.cancel_tasks()
+                schedule.idle()
+                out.warning("Polling failed with a network error:", str(e))
+            else:
+                new_count = sum(r.new_count + r.updated_count for r in results)
+                total_count += new_count
+                poll_ok = not any(r.failed_chunks for r in results)
+                if new_count:
+                    schedule.activity()
+                else:
+                    schedule.idle()
+
+            # Slow right down if this process is using up the YNAB rate limit
+            if ynab_client.rate_limit is not None:
+                used, limit = ynab_client.rate_limit
+                if used >= RATE_LIMIT_PRESSURE * limit:
+                    schedule.rate_limited()
+
+            out.end_section()
+            out.info(
+                f"Imported *{total_count} new transactions* so far. Polling again in"
+                f" *{schedule.interval} seconds*.",
+                counts={"new": total_count},
+            )
+
+            if heartbeat_file is not None:
+                _write_heartbeat(
+                    heartbeat_file,
+                    {
+                        "time": poll_time.isoformat(),
+                        "ok": poll_ok,
+                        "imported": total_count,
+                        "next_poll_seconds": schedule.interval,
+                    },
+                )
+
+            stop.wait(schedule.interval)
+    finally:
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+
+    out.success(
+        f"Stopped watching after importing *{total_count} new transactions*.",
+        counts={"new": total_count},
+    )
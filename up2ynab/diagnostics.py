@@ -0,0 +1,133 @@
+import socket
+import ssl
+import time
+from collections import namedtuple
+from urllib.parse import urlparse
+
+from up2ynab.clients.scheduler import rate_limit_remaining
+
+# Above these times (in seconds), the network or an API is reported as slow
+SLOW_NETWORK = 0.5
+SLOW_RESPONSE = 1.0
+
+# Below this fraction of its rate limit left, an API is reported as the bottleneck
+LOW_RATE_LIMIT = 0.1
+
+# The time taken by each step of a single request on a new connection, in seconds. tls
+# is None for plain HTTP, and first_byte is measured from when the request was sent.
+ConnectionTimings = namedtuple(
+    "ConnectionTimings", ("dns", "connect", "tls", "first_byte")
+)
+
+# How long fetching a page of data took over an open connection, and its size in bytes
+PageTimings = namedtuple("PageTimings", ("seconds", "size"))
+
+# The diagnosis of the connection to one API. rate_limit is the (remaining, limit)
+# pair of requests it reported, or None if it didn't report one.
+APIDiagnosis = namedtuple("APIDiagnosis", ("name", "connection", "page", "rate_limit"))
+
+
+def time_connection(url, headers=None, timeout=None):
+    """Send a GET request to url on a new connection, and return the ConnectionTimings
+    of each step."""
+    parsed = urlparse(url)
+    is_https = parsed.scheme == "https"
+    port = parsed.port or (443 if is_https else 80)
+    path = (parsed.path or "/") + (f"?{parsed.query}" if parsed.query else "")
+
+    start = time.perf_counter()
+    family, type_, proto, _, address = socket.getaddrinfo(
+        parsed.hostname, port, type=socket.SOCK_STREAM
+    )[0]
+    resolved = time.perf_counter()
+
+    sock = socket.socket(family, type_, proto)
+    try:
+        sock.settimeout(timeout)
+        sock.connect(address)
+        connected = time.perf_counter()
+
+        tls = None
+        if is_https:
+            context = ssl.create_default_context()
+            sock = context.wrap_socket(sock, server_hostname=parsed.hostname)
+            tls = time.perf_counter() - connected
+
+        lines = [f"GET {path} HTTP/1.1", f"Host: {parsed.netloc}"]
+        lines.extend(f"{name}: {value}" for name, value in (headers or {}).items())
+        lines.append("Connection: close")
+        sock.sendall(("\r\n".join(lines) + "\r\n\r\n").encode())
+        sent = time.perf_counter()
+        sock.recv(1)
+        first_byte = time.perf_counter() - sent
+
+        # Read the rest of the response, so the connection is closed cleanly
+        while sock.recv(65536):
+            pass
+    finally:
+        sock.close()
+
+    return ConnectionTimings(resolved - start, connected - resolved, tls, first_byte)
+
+
+def time_page(get, endpoint, **kwargs):
+    """Fetch an API endpoint with get (e.g. UpClient.up_get), and return its
+    PageTimings along with the response."""
+    start = time.perf_counter()
+    r = get(endpoint, **kwargs)
+    r.raise_for_status()
+    size = len(r.content)
+    return PageTimings(time.perf_counter() - start, size), r
+
+
+def diagnose_api(name, ping_url, headers, get, page_endpoint, timeout=None, **kwargs):
+    """Diagnose the connection to an API, and return its APIDiagnosis.
+
+    The steps of a request are timed on a new connection to ping_url, sent with
+    headers, and then a page of data is fetched from page_endpoint with get (passing
+    any other keyword arguments) to time it over an open connection. Raises an OSError
+    (including requests' errors) if either fails.
+    """
+    connection = time_connection(ping_url, headers, timeout)
+    page, r = time_page(get, page_endpoint, timeout=timeout, **kwargs)
+    return APIDiagnosis(name, connection, page, rate_limit_remaining(r.headers))
+
+
+def _network_time(timings):
+    return timings.dns + timings.connect + (timings.tls or 0)
+
+
+def find_bottlenecks(diagnoses):
+    """Return a list describing each thing that looks slow in a list of APIDiagnoses,
+    which is empty if nothing does.
+
+    The time to first byte includes a round trip over the network, so the connect time
+    (another round trip) is taken off it to estimate how long the API took to respond.
+    """
+    found = []
+
+    slow_network = [
+        diagnosis.name
+        for diagnosis in diagnoses
+        if _network_time(diagnosis.connection) > SLOW_NETWORK
+    ]
+    if len(slow_network) > 1 and len(slow_network) == len(diagnoses):
+        found.append("the network, as connecting to every API is slow")
+    else:
+        found.extend(f"the network path to {name}" for name in slow_network)
+
+    for diagnosis in diagnoses:
+        response_time = max(
+            0.0, diagnosis.connection.first_byte - diagnosis.connection.connect
+        )
+        if response_time > SLOW_RESPONSE or diagnosis.page.seconds > SLOW_RESPONSE:
+            found.append(f"{diagnosis.name}, as it is slow to respond")
+        if diagnosis.rate_limit is not None:
+            remaining, limit = diagnosis.rate_limit
+            if limit and remaining < limit * LOW_RATE_LIMIT:
+                found.append(
+                    f"{diagnosis.name}'s rate limit, as only {remaining} of {limit}"
+                    " requests are left"
+                )
+
+    return found
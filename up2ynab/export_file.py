@@ -0,0 +1,183 @@
+import datetime
+import gzip
+import json
+import os
+
+import up2ynab.clients.up as up_api
+
+# The level gzip compresses exports at, which is much faster than the maximum of 9 for
+# almost the same size
+COMPRESS_LEVEL = 6
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def open_export(path, mode="r", compressed=None):
+    """Open an export file for reading ("r") or writing ("w") as text, compressed with
+    gzip if compressed is True, or by default if its name ends in .gz."""
+    if compressed is None:
+        compressed = path.endswith(".gz")
+    if compressed:
+        return gzip.open(
+            path, mode + "t", encoding="utf-8", compresslevel=COMPRESS_LEVEL
+        )
+    return open(path, mode, encoding="utf-8")
+
+
+def _compact(resource):
+    """Return an Up API resource without its links, which aren't needed offline."""
+    compact = {key: value for key, value in resource.items() if key != "links"}
+    if "relationships" in resource:
+        compact["relationships"] = {
+            name: {"data": relationship.get("data")}
+            for name, relationship in resource["relationships"].items()
+        }
+    return compact
+
+
+class ExportWriter:
+    """Writes Up accounts and transactions to an export file.
+
+    An export is a JSON Lines file (gzipped if its name ends in .gz) of the Up API's own
+    account and transaction resources, less their links, one per line. The accounts
+    come first, so that they can be found without reading the whole file.
+
+    The export is written to a separate file that only replaces path once it is
+    complete, when the writer is closed. If the with block it is used in raises an
+    exception, the incomplete export is removed instead.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.partial_path = path + ".partial"
+        self.file = open_export(self.partial_path, "w", compressed=path.endswith(".gz"))
+        self.transaction_count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+            os.remove(self.partial_path)
+
+    def close(self):
+        self.file.close()
+        os.replace(self.partial_path, self.path)
+
+    def _write(self, resource):
+        self.file.write(json.dumps(_compact(resource), separators=(",", ":")))
+        self.file.write("\n")
+
+    def write_accounts(self, accounts):
+        for account in accounts:
+            # Cached accounts don't include their type
+            self._write({"type": "accounts", **account})
+
+    def write_transactions(self, transactions):
+        for transaction in transactions:
+            self._write(transaction)
+        self.transaction_count += len(transactions)
+
+
+class UpExportFile:
+    """Reads the Up accounts and transactions in an export file, with the same
+    interface as the UpClient methods used to sync them, so that they can be imported
+    into YNAB with TransactionSync without any requests to Up."""
+
+    def __init__(self, path):
+        self.path = path
+        self.accounts_cached = False
+        self.tx_acct_id = None
+        self.accounts = None
+
+    def get_accounts(self, refresh=False):
+        """Return the data of every account in the export."""
+        if self.accounts is None:
+            self.accounts = []
+            with open_export(self.path) as f:
+                for line in f:
+                    resource = json.loads(line)
+                    # The accounts are all written before any transactions
+                    if resource["type"] != "accounts":
+                        break
+                    self.accounts.append(resource)
+        return self.accounts
+
+    def get_transactional_account_id(self, accounts=None):
+        """Find the ID of the single transactional account and store it as
+        tx_acct_id."""
+        if accounts is None:
+            accounts = self.get_accounts()
+        ids = [
+            acc["id"]
+            for acc in accounts
+            if acc["attributes"]["accountType"] == "TRANSACTIONAL"
+        ]
+
+        if len(ids) != 1:
+            raise ValueError(f"found {len(ids)} transactional accounts, should be 1")
+
+        self.tx_acct_id = ids[0]
+        return self.tx_acct_id
+
+    def account_id_from_name(self, name, accounts=None):
+        """Return the ID of the account with the given display name."""
+        if accounts is None:
+            accounts = self.get_accounts()
+        matching_ids = [
+            acc["id"] for acc in accounts if acc["attributes"]["displayName"] == name
+        ]
+
+        if len(matching_ids) == 0:
+            raise ValueError(f"no accounts found for name {name}")
+        elif len(matching_ids) > 1:
+            raise ValueError(f"more than one account found for {name}")
+        else:
+            return matching_ids[0]
+
+    def iter_transaction_pages(
+        self,
+        since=_EPOCH,
+        page_size=up_api.DEFAULT_PAGE_SIZE,
+        prefetch=True,
+        account_id=None,
+        until=None,
+    ):
+        """Yield the data of the exported transactions in an account created at or
+        after since, and before until if given, as lists of up to page_size.
+
+        account_id defaults to the transactional account. prefetch is ignored, as
+        reading the file is fast.
+        """
+        if account_id is None:
+            assert self.tx_acct_id is not None
+            account_id = self.tx_acct_id
+        since = since.astimezone()
+        until = until.astimezone() if until is not None else None
+
+        page = []
+        with open_export(self.path) as f:
+            for line in f:
+                # Only decode the lines that could be transactions in the account
+                if account_id not in line:
+                    continue
+                resource = json.loads(line)
+                if (
+                    resource["type"] != "transactions"
+                    or resource["relationships"]["account"]["data"]["id"] != account_id
+                ):
+                    continue
+                created_at = datetime.datetime.fromisoformat(
+                    resource["attributes"]["createdAt"]
+                )
+                if created_at < since or (until is not None and created_at >= until):
+                    continue
+                page.append(resource)
+                if len(page) == page_size:
+                    yield page
+                    page = []
+        if page:
+            yield page
@@ -0,0 +1,209 @@
+import datetime
+import json
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import up2ynab.clients.up as up_api
+import up2ynab.clients.ynab as ynab_api
+from up2ynab.sync import SyncedAccount
+from up2ynab.util.metrics import Metrics
+from up2ynab.util.ynab_mirror import MirroredTransaction
+
+# Bumped whenever the format of plan files changes, so that older plans aren't applied
+PLAN_VERSION = 1
+
+# A transaction to change in YNAB: its YNAB ID, the YNABTransaction it should match,
+# and the amount and date it has in YNAB now
+PlannedUpdate = namedtuple(
+    "PlannedUpdate", ("id", "transaction", "old_amount", "old_date")
+)
+
+
+class AccountPlan:
+    """The changes that would bring a YNAB account in line with an Up account.
+
+    create is the list of YNABTransactions that aren't in YNAB yet, update the list of
+    PlannedUpdates for those whose amount or date differ, and missing the list of
+    MirroredTransactions imported into YNAB that are no longer in Up, e.g. because the
+    hold they were for was cancelled.
+    """
+
+    def __init__(self, account, create=(), update=(), missing=()):
+        self.account = account
+        self.create = list(create)
+        self.update = list(update)
+        self.missing = list(missing)
+
+    def to_json(self):
+        """Return the plan as JSON-compatible data."""
+        return {
+            "up_id": self.account.up_id,
+            "up_name": self.account.up_name,
+            "ynab_id": self.account.ynab_id,
+            "create": [tx._asdict() for tx in self.create],
+            "update": [
+                {
+                    "id": update.id,
+                    "old_amount": update.old_amount,
+                    "old_date": update.old_date,
+                    **update.transaction._asdict(),
+                }
+                for update in self.update
+            ],
+            "missing": [tx._asdict() for tx in self.missing],
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        """Create an AccountPlan from the data returned by to_json."""
+        account = SyncedAccount(data["up_id"], data["up_name"], data["ynab_id"])
+        updates = [
+            PlannedUpdate(
+                update["id"],
+                ynab_api.YNABTransaction(
+                    **{
+                        field: update[field]
+                        for field in ynab_api.YNABTransaction._fields
+                        if field in update
+                    }
+                ),
+                update["old_amount"],
+                update["old_date"],
+            )
+            for update in data["update"]
+        ]
+        return cls(
+            account,
+            create=[ynab_api.YNABTransaction(**tx) for tx in data["create"]],
+            update=updates,
+            missing=[MirroredTransaction(**tx) for tx in data["missing"]],
+        )
+
+
+class SyncPlan:
+    """The changes to YNAB planned for a set of accounts, which can be saved to a JSON
+    file to review and apply later.
+
+    since is when the Up transactions that were compared start, and foreign_flag the
+    flag for new foreign currency transactions.
+    """
+
+    def __init__(self, accounts, since, foreign_flag=None, created_at=None):
+        self.accounts = accounts
+        self.since = since
+        self.foreign_flag = foreign_flag
+        self.created_at = (
+            created_at
+            if created_at is not None
+            else datetime.datetime.now().astimezone().replace(microsecond=0)
+        )
+
+    def counts(self):
+        """Return the total number of transactions to create, update and that are
+        missing from Up."""
+        return {
+            "create": sum(len(plan.create) for plan in self.accounts),
+            "update": sum(len(plan.update) for plan in self.accounts),
+            "missing": sum(len(plan.missing) for plan in self.accounts),
+        }
+
+    def save(self, path):
+        """Write the plan to a JSON file at path."""
+        data = {
+            "version": PLAN_VERSION,
+            "created_at": self.created_at.isoformat(),
+            "since": self.since.isoformat(),
+            "foreign_flag": self.foreign_flag,
+            "accounts": [plan.to_json() for plan in self.accounts],
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+            f.write("\n")
+
+    @classmethod
+    def load(cls, path):
+        """Read a plan saved by save. Raises a ValueError if the file isn't a valid
+        plan."""
+        with open(path, encoding="utf-8") as f:
+            try:
+                data = json.load(f)
+            except ValueError as e:
+                raise ValueError(f"not valid JSON: {e}")
+
+        if not isinstance(data, dict) or data.get("version") != PLAN_VERSION:
+            raise ValueError("not a plan made by this version of up2ynab")
+        try:
+            return cls(
+                [AccountPlan.from_json(plan) for plan in data["accounts"]],
+                datetime.datetime.fromisoformat(data["since"]),
+                foreign_flag=data["foreign_flag"],
+                created_at=datetime.datetime.fromisoformat(data["created_at"]),
+            )
+        except (KeyError, TypeError) as e:
+            raise ValueError(f"the plan is malformed: {e}")
+
+
+def plan_account(
+    up_client,
+    ynab_client,
+    mirror,
+    account,
+    since,
+    page_size=up_api.DEFAULT_PAGE_SIZE,
+    rules=None,
+    metrics=None,
+):
+    """Compare the transactions created since since in a SyncedAccount's Up account
+    with its YNAB account, and return the AccountPlan to bring YNAB in line.
+
+    The YNAB side comes from mirror, a YNABMirror, which is refreshed while the Up
+    transactions are fetched and indexes them by import ID. rules is an optional
+    RuleSet for the new transactions' payees and categories.
+    """
+    if metrics is None:
+        metrics = Metrics()
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        refresh_future = executor.submit(mirror.refresh, ynab_client, account.ynab_id)
+
+        converted = {}
+        pages = up_client.iter_transaction_pages(
+            since, page_size=page_size, account_id=account.up_id
+        )
+        for page in pages:
+            with metrics.stage("conversion"):
+                for ynab_tx in ynab_api.YNABTransaction.from_up_page(page, rules):
+                    converted[ynab_tx.import_id] = ynab_tx
+
+        with metrics.stage("mirror_refresh"):
+            refresh_future.result()
+
+    with metrics.stage("mirror_lookup"):
+        existing = mirror.by_import_id(account.ynab_id, converted)
+        # Transactions on the first day may have been created before since, so only
+        # look for missing ones from the day after
+        imported = mirror.imported_after(
+            account.ynab_id, since.astimezone().date().isoformat()
+        )
+
+    plan = AccountPlan(account)
+    for import_id, ynab_tx in converted.items():
+        mirrored_tx = existing.get(import_id)
+        if mirrored_tx is None:
+            plan.create.append(ynab_tx)
+        elif mirrored_tx.deleted:
+            # It was deleted in YNAB on purpose, so don't bring it back
+            continue
+        elif (mirrored_tx.amount, mirrored_tx.date) != (ynab_tx.amount, ynab_tx.date):
+            plan.update.append(
+                PlannedUpdate(
+                    mirrored_tx.id, ynab_tx, mirrored_tx.amount, mirrored_tx.date
+                )
+            )
+    plan.missing = [
+        mirrored_tx
+        for mirrored_tx in imported
+        if ynab_api.is_up_import_id(mirrored_tx.import_id)
+        and mirrored_tx.import_id not in converted
+    ]
+    return plan
@@ -0,0 +1,351 @@
+import functools
+import hashlib
+import json
+import os
+import re
+import tempfile
+
+from up2ynab.util.app_dir import app_dir
+
+# Bumped whenever the compiled form of a RuleSet changes, so old caches aren't used
+COMPILED_VERSION = 2
+
+# The number of distinct descriptions whose matching rules are remembered (the most
+# recently used ones), as most transactions are at a handful of places
+DESCRIPTION_CACHE_SIZE = 1 << 16
+
+# The conditions a rule can have, at most one of which is on the description
+DESCRIPTION_CONDITIONS = (
+    "description",
+    "description_prefix",
+    "description_exact",
+    "description_regex",
+)
+CONDITIONS = DESCRIPTION_CONDITIONS + ("up_category", "up_tag")
+
+# What a rule sets in the YNAB transaction
+ACTIONS = ("payee", "category_id")
+
+
+def default_cache_dir():
+    """Return the default location of the compiled rules cache in the user's app
+    directory."""
+    return os.path.join(app_dir(), "rules")
+
+
+class _Automaton:
+    """An Aho-Corasick automaton, which finds every occurrence of any of a set of
+    strings in a text in a single pass over the text, however many strings there
+    are."""
+
+    def __init__(self, patterns):
+        # The transitions, failure links and (pattern index, pattern length) outputs
+        # of each state, with the root as state 0
+        self.goto = [{}]
+        self.fail = [0]
+        self.outputs = [()]
+
+        for index, pattern in enumerate(patterns):
+            state = 0
+            for char in pattern:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = self.goto[state][char] = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.outputs.append(())
+                state = next_state
+            self.outputs[state] += ((index, len(pattern)),)
+
+        # Link each state to the longest proper suffix of it that is also a state,
+        # breadth first so that the shorter suffixes are linked first
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fail = self.fail[state]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                fail = self.goto[fail].get(char, 0)
+                self.fail[next_state] = fail
+                self.outputs[next_state] += self.outputs[fail]
+
+    @classmethod
+    def from_tables(cls, goto, fail, outputs):
+        """Return the automaton with the given goto, fail and outputs tables, as saved
+        from another automaton, without building it again."""
+        automaton = cls.__new__(cls)
+        automaton.goto = goto
+        automaton.fail = fail
+        automaton.outputs = outputs
+        return automaton
+
+    def search(self, text):
+        """Yield (pattern index, start position) for every occurrence of a pattern in
+        text."""
+        goto, fail, outputs = self.goto, self.fail, self.outputs
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for index, length in outputs[state]:
+                yield index, position + 1 - length
+
+
+class RuleSet:
+    """Rules for the payee and category of YNAB transactions, based on the
+    description, category and tags of the Up transactions they come from.
+
+    Each rule is a dict with one or more conditions, all of which must hold for it to
+    match, and one or both of the actions:
+
+    - description: the description contains this text
+    - description_prefix: the description starts with this text
+    - description_exact: the description is this text
+    - description_regex: this regular expression matches the start of the description
+    - up_category: the Up category or parent category ID, e.g. "takeaway"
+    - up_tag: one of the transaction's tags
+    - payee: the payee name to use in YNAB, instead of the description
+    - category_id: the ID of the YNAB category to put the transaction in
+
+    Descriptions are matched case-insensitively. The payee comes from the first rule in
+    the list that matches and has a payee, and likewise the category.
+
+    Rather than checking each rule in turn, the rules are indexed when the RuleSet is
+    created: the text conditions are found with a single Aho-Corasick automaton, exact
+    descriptions, categories and tags with dicts, and the regular expressions are only
+    tried if their combination matches.
+    """
+
+    def __init__(self, rules):
+        self.rules = [_validate(number, rule) for number, rule in enumerate(rules, 1)]
+
+        # The indices of the rules indexed under each kind of condition
+        self.exact = {}
+        self.categories = {}
+        self.tags = {}
+        patterns = []
+        self.pattern_rules = []
+
+        for index, rule in enumerate(self.rules):
+            if "description_exact" in rule:
+                key = rule["description_exact"].casefold()
+                self.exact.setdefault(key, []).append(index)
+            elif "description" in rule or "description_prefix" in rule:
+                anchored = "description_prefix" in rule
+                patterns.append(
+                    rule["description_prefix" if anchored else "description"].casefold()
+                )
+                self.pattern_rules.append((index, anchored))
+            elif "description_regex" in rule:
+                # Indexed by _compile_regexes, as they aren't saved when cached
+                pass
+            elif "up_category" in rule:
+                self.categories.setdefault(rule["up_category"], []).append(index)
+            else:
+                self.tags.setdefault(rule["up_tag"], []).append(index)
+
+        self.automaton = _Automaton(patterns)
+        self._compile_regexes()
+
+    def _compile_regexes(self):
+        self.regexes = {
+            index: re.compile(rule["description_regex"], re.IGNORECASE)
+            for index, rule in enumerate(self.rules)
+            if "description_regex" in rule
+        }
+        # Whether any regex could match, checked in one go before trying each of them.
+        # Regexes with backreferences can't be combined, so then each is always tried.
+        self.any_regex = None
+        if self.regexes:
+            try:
+                self.any_regex = re.compile(
+                    "|".join(f"(?:{regex.pattern})" for regex in self.regexes.values()),
+                    re.IGNORECASE,
+                )
+            except re.error:
+                pass
+
+        # A bounded LRU cache, which is safe to use from several threads at once
+        self._description_candidates = functools.lru_cache(DESCRIPTION_CACHE_SIZE)(
+            self._find_description_candidates
+        )
+
+    def compiled(self):
+        """Return the indexed rules as JSON-serialisable data, which
+        RuleSet.from_compiled turns back into a RuleSet without indexing them again.
+        The regular expressions are compiled again, as Python caches them anyway."""
+        return {
+            "rules": self.rules,
+            "exact": self.exact,
+            "categories": self.categories,
+            "tags": self.tags,
+            "pattern_rules": self.pattern_rules,
+            "goto": self.automaton.goto,
+            "fail": self.automaton.fail,
+            "outputs": self.automaton.outputs,
+        }
+
+    @classmethod
+    def from_compiled(cls, data):
+        """Return the RuleSet from the data returned by RuleSet.compiled."""
+        rule_set = cls.__new__(cls)
+        rule_set.rules = data["rules"]
+        rule_set.exact = data["exact"]
+        rule_set.categories = data["categories"]
+        rule_set.tags = data["tags"]
+        rule_set.pattern_rules = data["pattern_rules"]
+        rule_set.automaton = _Automaton.from_tables(
+            data["goto"], data["fail"], data["outputs"]
+        )
+        rule_set._compile_regexes()
+        return rule_set
+
+    def _find_description_candidates(self, description):
+        """Return the indices of the rules indexed by a description condition that
+        matches description. This is cached as _description_candidates."""
+        folded = description.casefold()
+        candidates = list(self.exact.get(folded, ()))
+        for pattern_index, start in self.automaton.search(folded):
+            rule_index, anchored = self.pattern_rules[pattern_index]
+            if start == 0 or not anchored:
+                candidates.append(rule_index)
+        if self.regexes and (
+            self.any_regex is None or self.any_regex.match(description)
+        ):
+            candidates.extend(
+                index
+                for index, regex in self.regexes.items()
+                if regex.match(description)
+            )
+        # A tuple, as it's shared by every caller with the same description
+        return tuple(candidates)
+
+    def _matches(self, index, description, categories, tags):
+        """Whether every one of a rule's conditions holds."""
+        rule = self.rules[index]
+        folded = description.casefold()
+        if "description" in rule and rule["description"].casefold() not in folded:
+            return False
+        if "description_prefix" in rule and not folded.startswith(
+            rule["description_prefix"].casefold()
+        ):
+            return False
+        if (
+            "description_exact" in rule
+            and folded != rule["description_exact"].casefold()
+        ):
+            return False
+        if "description_regex" in rule and not self.regexes[index].match(description):
+            return False
+        if "up_category" in rule and rule["up_category"] not in categories:
+            return False
+        if "up_tag" in rule and rule["up_tag"] not in tags:
+            return False
+        return True
+
+    def match(self, transaction):
+        """Return the (payee, category_id) that the rules give the Up transaction
+        data, either of which is None if no rule sets it."""
+        description = transaction["attributes"]["description"]
+        relationships = transaction.get("relationships", {})
+        categories = [
+            relationships.get(name, {}).get("data") or {}
+            for name in ("category", "parentCategory")
+        ]
+        categories = [category["id"] for category in categories if "id" in category]
+        tags = [tag["id"] for tag in relationships.get("tags", {}).get("data", ())]
+
+        candidates = set(self._description_candidates(description))
+        for category in categories:
+            candidates.update(self.categories.get(category, ()))
+        for tag in tags:
+            candidates.update(self.tags.get(tag, ()))
+
+        payee = category_id = None
+        for index in sorted(candidates):
+            rule = self.rules[index]
+            if (payee is None and "payee" in rule) or (
+                category_id is None and "category_id" in rule
+            ):
+                if self._matches(index, description, categories, tags):
+                    if payee is None:
+                        payee = rule.get("payee")
+                    if category_id is None:
+                        category_id = rule.get("category_id")
+            if payee is not None and category_id is not None:
+                break
+        return payee, category_id
+
+
+def _validate(number, rule):
+    """Check that a rule is well formed, raising a ValueError if it isn't."""
+    if not isinstance(rule, dict):
+        raise ValueError(f"rule {number} is not an object")
+    unknown = set(rule) - set(CONDITIONS) - set(ACTIONS)
+    if unknown:
+        raise ValueError(f"rule {number} has unknown keys {', '.join(sorted(unknown))}")
+    if not any(key in rule for key in CONDITIONS):
+        raise ValueError(f"rule {number} has no conditions")
+    if sum(key in rule for key in DESCRIPTION_CONDITIONS) > 1:
+        raise ValueError(f"rule {number} has more than one description condition")
+    if not any(key in rule for key in ACTIONS):
+        raise ValueError(f"rule {number} sets neither a payee nor a category_id")
+    for key, value in rule.items():
+        if not isinstance(value, str) or not value:
+            raise ValueError(f"rule {number}'s {key} is not a non-empty string")
+    if "description_regex" in rule:
+        try:
+            re.compile(rule["description_regex"])
+        except re.error as e:
+            raise ValueError(f"rule {number}'s description_regex is invalid: {e}")
+    return rule
+
+
+def load_rules(path, cache_dir=None):
+    """Return the RuleSet in the JSON rules file at path, which is an object with a
+    "rules" list.
+
+    Compiled rule sets are cached as JSON in cache_dir (by default in the user's app
+    directory), in a file for each rules file along with a hash of its contents, so
+    that a large rules file is only compiled again when it changes. Raises a ValueError
+    if the file isn't a valid rules file.
+    """
+    with open(path, "rb") as f:
+        contents = f.read()
+
+    if cache_dir is None:
+        cache_dir = default_cache_dir()
+    digest = hashlib.sha256(contents + b"\0%d" % COMPILED_VERSION).hexdigest()
+    path_digest = hashlib.sha256(os.path.abspath(path).encode()).hexdigest()
+    cache_path = os.path.join(cache_dir, f"{path_digest[:32]}.json")
+
+    try:
+        with open(cache_path, encoding="utf-8") as f:
+            cached = json.load(f)
+        if cached["digest"] == digest:
+            return RuleSet.from_compiled(cached["compiled"])
+    except (OSError, ValueError, KeyError, TypeError, re.error):
+        # Missing, stale or not a cache of compiled rules, so compile them again
+        pass
+
+    try:
+        data = json.loads(contents)
+    except ValueError as e:
+        raise ValueError(f"not valid JSON: {e}")
+    if not isinstance(data, dict) or not isinstance(data.get("rules"), list):
+        raise ValueError('the file should be an object with a "rules" list')
+    rule_set = RuleSet(data["rules"])
+
+    # Replace this rules file's cache, if it was stale
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"digest": digest, "compiled": rule_set.compiled()}, f)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        # The cache only saves time, so carry on without it
+        pass
+    return rule_set
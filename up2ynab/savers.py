@@ -0,0 +1,71 @@
+import datetime
+from collections import namedtuple
+
+# A Saver whose balance is kept in a YNAB category: its name, its balance in
+# millidollars and the MirroredCategory it's kept in
+SyncedSaver = namedtuple("SyncedSaver", ("name", "balance", "category"))
+
+
+def current_month():
+    """Return the current month in UTC, which is YNAB's current month, e.g. "2021-03"."""
+    return datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m")
+
+
+def saver_balances(accounts):
+    """Return a dict mapping the name of each Saver in Up account data (as returned by
+    UpClient.get_accounts with refresh=True) to its balance in millidollars."""
+    return {
+        acc["attributes"]["displayName"]: (
+            acc["attributes"]["balance"]["valueInBaseUnits"] * 10
+        )
+        for acc in accounts
+        if acc["attributes"]["accountType"] == "SAVER"
+    }
+
+
+def match_savers(balances, categories, mappings=None):
+    """Match each Saver with the YNAB category its balance is kept in, returning the
+    list of SyncedSavers and the list of names of the Savers that weren't matched.
+
+    balances is as returned by saver_balances, and categories is a list of
+    MirroredCategories. mappings is a list of (saver_name, category_name) pairs, or
+    None to keep every Saver in the category with the same name, leaving out the ones
+    without one. Raises a ValueError if a Saver or category in mappings can't be found,
+    or if more than one category has a name being matched.
+    """
+    by_name = {}
+    for category in categories:
+        by_name.setdefault(category.name, []).append(category)
+
+    def find_category(name):
+        matching = by_name.get(name, [])
+        if len(matching) > 1:
+            raise ValueError(f"more than one category found for {name}")
+        return matching[0] if matching else None
+
+    if mappings is None:
+        synced = []
+        unmatched = []
+        for name, balance in balances.items():
+            category = find_category(name)
+            if category is None:
+                unmatched.append(name)
+            else:
+                synced.append(SyncedSaver(name, balance, category))
+        return synced, unmatched
+
+    synced = []
+    for saver_name, category_name in mappings:
+        if saver_name not in balances:
+            raise ValueError(f"no Savers found for name {saver_name}")
+        category = find_category(category_name)
+        if category is None:
+            raise ValueError(f"no categories found for name {category_name}")
+        synced.append(SyncedSaver(saver_name, balances[saver_name], category))
+    return synced, []
+
+
+def budgeted_to_match(saver):
+    """Return the amount to budget to a SyncedSaver's category this month for its
+    balance to match the Saver's, which is the amount already budgeted if it does."""
+    return saver.category.budgeted + saver.balance - saver.category.balance
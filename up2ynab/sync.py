@@ -0,0 +1,398 @@
+import datetime
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import up2ynab.clients.up as up_api
+import up2ynab.clients.ynab as ynab_api
+from up2ynab.transfers import TransferMatcher
+from up2ynab.util.metrics import Metrics
+
+# How far before the last synced transaction an incremental sync starts looking, to pick
+# up any transactions that were created out of order
+CURSOR_OVERLAP = datetime.timedelta(days=1)
+
+AccountSyncResult = namedtuple(
+    "AccountSyncResult",
+    (
+        "fetched_count",
+        "skipped_count",
+        "new_count",
+        "duplicate_count",
+        "updated_count",
+        "failed_chunks",
+    ),
+)
+
+# The IDs of a pair of Up and YNAB accounts to sync, and the name of the Up account
+SyncedAccount = namedtuple("SyncedAccount", ("up_id", "up_name", "ynab_id"))
+
+
+class TransactionSync:
+    """Syncs transactions from Up accounts into YNAB accounts, reporting progress through
+    an EchoManager.
+
+    state is an optional StateStore. If provided, transactions that it records as
+    imported are skipped, and everything uploaded is recorded in it.
+
+    mirror is an optional YNABMirror. If provided, it is refreshed before each account
+    is synced, and only transactions missing from it are created in YNAB. Those whose
+    amount or date differ from the mirrored copy are updated instead.
+
+    rules is an optional up2ynab.rules.RuleSet giving the payee and category of each
+    transaction.
+
+    If match_transfers is True, transfers between the accounts synced together by
+    sync_accounts are paired with a TransferMatcher and imported as YNAB transfers.
+
+    overlap is how far before the last synced transaction in each account to start
+    fetching from, when there is a state store. The timings of each stage of the sync
+    are recorded in metrics, if provided. The remaining options are passed through to
+    the clients.
+
+    sync_account is safe to call for several accounts at once from different threads.
+    """
+
+    def __init__(
+        self,
+        out,
+        up_client,
+        ynab_client,
+        state=None,
+        mirror=None,
+        foreign_flag=None,
+        page_size=up_api.DEFAULT_PAGE_SIZE,
+        chunk_size=ynab_api.DEFAULT_CHUNK_SIZE,
+        max_uploads=ynab_api.DEFAULT_MAX_UPLOADS,
+        overlap=CURSOR_OVERLAP,
+        metrics=None,
+        rules=None,
+        match_transfers=False,
+    ):
+        self.out = out
+        self.up_client = up_client
+        self.ynab_client = ynab_client
+        self.state = state
+        self.mirror = mirror
+        self.foreign_flag = foreign_flag
+        self.page_size = page_size
+        self.chunk_size = chunk_size
+        self.max_uploads = max_uploads
+        self.overlap = overlap
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.rules = rules
+        self.match_transfers = match_transfers
+        self.resumed = set()
+
+    def resume_since(self, up_account_id, since, name):
+        """Return the datetime to start fetching transactions in the specified Up account
+        from: just before the last synced transaction if that is more recent than since,
+        otherwise since itself."""
+        if self.state is None:
+            return since
+
+        cursor = self.state.cursor(up_account_id)
+        if cursor is not None and cursor - self.overlap > since:
+            # Only mention it the first time, for syncs that are repeated
+            if up_account_id not in self.resumed:
+                self.resumed.add(up_account_id)
+                self.out.info(
+                    f"Resuming *{name}* from the last sync at"
+                    f" *{cursor:%Y-%m-%d %H:%M}*."
+                )
+            return cursor - self.overlap
+        return since
+
+    def _converted_transactions(
+        self,
+        up_account_id,
+        since,
+        until,
+        name,
+        synced,
+        counts,
+        mirrored,
+        outdated,
+        transfers,
+    ):
+        """Yield the transactions in the Up account created from since (until until, if
+        given) converted to YNABTransactions, skipping any known to be imported already.
+
+        Each page of transaction data is converted as it arrives, while the next page is
+        being fetched in the background. Only the fields needed to record the sync are
+        kept from the raw data, by appending them to synced. The number of transactions
+        fetched and skipped are added to the counts Counter.
+
+        If the sync has a mirror, mirrored is a function that takes a list of import IDs
+        and returns the MirroredTransactions for them. Transactions that are mirrored
+        with a different amount or date are appended to outdated as (YNAB ID,
+        YNABTransaction) pairs instead of being yielded. The mirror then decides which
+        transactions are already imported instead of the state store, so that those
+        that changed since, e.g. when they settled, are still compared.
+
+        If transfers is a TransferMatcher, transfers to and from the other accounts it
+        is matching are yielded as YNAB transfers once each, with the outgoing sides
+        held back until the end to be paired.
+        """
+        outgoing = []
+        pages = self.up_client.iter_transaction_pages(
+            since, page_size=self.page_size, account_id=up_account_id, until=until
+        )
+        for page in pages:
+            counts["fetched"] += len(page)
+
+            if transfers is not None:
+                with self.metrics.stage("transfer_index"):
+                    transfers.observe(up_account_id, page)
+
+            # Drop any transactions that are already known to have been imported
+            if self.state is not None and mirrored is None:
+                with self.metrics.stage("state_lookup"):
+                    known_ids = self.state.known_ids(tx["id"] for tx in page)
+                page = [tx for tx in page if tx["id"] not in known_ids]
+                counts["skipped"] += len(known_ids)
+
+            with self.metrics.stage("conversion"):
+                converted = ynab_api.YNABTransaction.from_up_page(page, self.rules)
+                synced.extend(
+                    (tx["id"], ynab_tx.import_id, tx["attributes"]["createdAt"])
+                    for tx, ynab_tx in zip(page, converted)
+                )
+
+            if transfers is not None:
+                converted, page_outgoing = transfers.split(
+                    up_account_id, page, converted
+                )
+                outgoing.extend(page_outgoing)
+
+            # Only create the transactions that aren't in YNAB yet
+            if mirrored is not None:
+                converted = self._missing(converted, mirrored, counts, outdated)
+            yield from converted
+
+        if transfers is not None:
+            transfers.finish(up_account_id)
+            with self.metrics.stage("transfer_pairing"):
+                unpaired = transfers.pair(up_account_id, outgoing)
+            counts["transfers"] += len(outgoing) - len(unpaired)
+            counts["unpaired_transfers"] += len(unpaired)
+            if mirrored is not None and unpaired:
+                unpaired = self._missing(unpaired, mirrored, counts, outdated)
+            yield from unpaired
+
+        with self.out.grouped():
+            self.out.task_success(
+                f"Fetched *{counts['fetched']} transactions* from *{name}*.",
+                task=(name, "fetch"),
+                counts=counts,
+            )
+            if self.state is not None and mirrored is None:
+                self.out.comment(
+                    f"*{counts['skipped']} transactions* were synced before."
+                )
+            if mirrored is not None:
+                self.out.comment(
+                    f"*{counts['unchanged'] + counts['deleted']} transactions* are"
+                    " already in YNAB."
+                )
+            if counts["transfers"]:
+                self.out.comment(
+                    f"*{counts['transfers']} transfers* out of *{name}* were paired"
+                    " with their other side, and are imported as YNAB transfers."
+                )
+            if counts["unpaired_transfers"]:
+                self.out.comment(
+                    f"*{counts['unpaired_transfers']} transfers* out of *{name}*"
+                    " couldn't be paired, and are imported as ordinary transactions."
+                )
+
+    def _missing(self, converted, mirrored, counts, outdated):
+        """Return the YNABTransactions that aren't in the mirror yet, adding the ones
+        that are mirrored with a different amount or date to outdated."""
+        existing = mirrored([ynab_tx.import_id for ynab_tx in converted])
+        missing = []
+        for ynab_tx in converted:
+            mirrored_tx = existing.get(ynab_tx.import_id)
+            if mirrored_tx is None:
+                missing.append(ynab_tx)
+            elif mirrored_tx.deleted:
+                counts["deleted"] += 1
+            elif (mirrored_tx.amount, mirrored_tx.date) != (
+                ynab_tx.amount,
+                ynab_tx.date,
+            ):
+                outdated.append((mirrored_tx.id, ynab_tx))
+            else:
+                counts["unchanged"] += 1
+        return missing
+
+    def _mirrored(self, refresh_future, ynab_account_id, import_ids):
+        """Wait for the mirror to be refreshed, then look up import IDs in it."""
+        refresh_future.result()
+        with self.metrics.stage("mirror_lookup"):
+            return self.mirror.by_import_id(ynab_account_id, import_ids)
+
+    def _refresh_mirror(self, ynab_account_id):
+        with self.metrics.stage("mirror_refresh"):
+            return self.mirror.refresh(self.ynab_client, ynab_account_id)
+
+    def sync_account(
+        self, up_account_id, ynab_account_id, since, name, until=None, transfers=None
+    ):
+        """Sync the transactions created at or after since (and before until, if given)
+        in the specified Up account into the specified YNAB account.
+
+        name is the name of the Up account, used to label the progress output, so it
+        must be different for ranges of the same account synced at once. transfers is
+        the TransferMatcher for the accounts being synced at the same time, if any.
+        Returns an AccountSyncResult.
+        """
+        with self.metrics.stage("sync_account"):
+            return self._sync_account(
+                up_account_id, ynab_account_id, since, until, name, transfers
+            )
+
+    def _sync_account(
+        self, up_account_id, ynab_account_id, since, until, name, transfers
+    ):
+        synced = []
+        counts = Counter()
+        outdated = []
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            # Bring the mirror of the YNAB account up to date while the first page of
+            # transactions is fetched from Up
+            mirrored = None
+            if self.mirror is not None:
+                refresh_future = executor.submit(self._refresh_mirror, ynab_account_id)
+                mirrored = partial(self._mirrored, refresh_future, ynab_account_id)
+
+            # Import the transactions to YNAB via the client, uploading each chunk as
+            # soon as enough transactions have been fetched from Up to fill it. No
+            # request is made if every transaction has been synced before.
+            self.out.start_task(
+                f"Fetching transactions from *{name}*...", task=(name, "fetch")
+            )
+            self.out.start_task(
+                f"Uploading the transactions from *{name}* to YNAB...",
+                task=(name, "upload"),
+            )
+            result = self.ynab_client.create_transactions(
+                ynab_account_id,
+                self._converted_transactions(
+                    up_account_id,
+                    since,
+                    until,
+                    name,
+                    synced,
+                    counts,
+                    mirrored,
+                    outdated,
+                    transfers,
+                ),
+                foreign_flag=self.foreign_flag,
+                chunk_size=self.chunk_size,
+                max_workers=self.max_uploads,
+            )
+
+        # Fix up the amount and date of any transactions that changed in Up since they
+        # were imported, e.g. when they settled
+        updated_count = 0
+        if outdated:
+            with self.metrics.stage("ynab_update"):
+                updated_ids = self.ynab_client.update_transactions(
+                    [
+                        {"id": ynab_id, "amount": ynab_tx.amount, "date": ynab_tx.date}
+                        for ynab_id, ynab_tx in outdated
+                    ],
+                    chunk_size=self.chunk_size,
+                )
+            updated_count = len(updated_ids)
+
+        new_count = len(result.transaction_ids)
+        duplicate_count = len(result.duplicate_import_ids)
+        failed_import_ids = {
+            tx.import_id for chunk in result.failed_chunks for tx in chunk.transactions
+        }
+
+        # Remember everything that is now in YNAB so it is skipped next time
+        if self.state is not None:
+            with self.metrics.stage("state_record"):
+                self.state.record_imported(
+                    up_account_id,
+                    (row for row in synced if row[1] not in failed_import_ids),
+                    failed=(row for row in synced if row[1] in failed_import_ids),
+                )
+
+        with self.out.grouped():
+            if result.failed_chunks:
+                self.out.task_error(
+                    f"Failed to upload *{len(failed_import_ids)} transactions* from"
+                    f" *{name}* to YNAB.",
+                    task=(name, "upload"),
+                    counts={"failed": len(failed_import_ids), "new": new_count},
+                )
+                for chunk in result.failed_chunks:
+                    self.out.comment(
+                        f"A chunk of *{len(chunk.transactions)} transactions* failed:"
+                        f" {chunk.error}"
+                    )
+            else:
+                self.out.task_success(
+                    f"Uploaded *{new_count} new transactions* from *{name}* to YNAB.",
+                    task=(name, "upload"),
+                    counts={
+                        "new": new_count,
+                        "duplicate": duplicate_count,
+                        "updated": updated_count,
+                    },
+                )
+                self.out.comment(
+                    f"*{duplicate_count} transactions* were previously imported."
+                )
+            if updated_count:
+                self.out.comment(
+                    f"*{updated_count} transactions* that changed in Up were updated."
+                )
+
+        return AccountSyncResult(
+            counts["fetched"],
+            counts["skipped"],
+            new_count,
+            duplicate_count,
+            updated_count,
+            result.failed_chunks,
+        )
+
+    def sync_accounts(self, accounts, since):
+        """Sync every one of the given SyncedAccounts at once, starting from since or
+        just before the last sync of each if more recent. Returns a list of
+        AccountSyncResults in the same order."""
+        transfers = None
+        if self.match_transfers and len(accounts) > 1:
+            transfers = TransferMatcher(
+                accounts,
+                {
+                    acc["id"]: acc["transfer_payee_id"]
+                    for acc in self.ynab_client.get_accounts()
+                },
+            )
+
+        def sync(account):
+            try:
+                return self.sync_account(
+                    account.up_id,
+                    account.ynab_id,
+                    self.resume_since(account.up_id, since, account.up_name),
+                    account.up_name,
+                    transfers=transfers,
+                )
+            finally:
+                # Don't leave the other accounts waiting to pair transfers if this one
+                # failed before it finished fetching
+                if transfers is not None:
+                    transfers.finish(account.up_id)
+
+        with ThreadPoolExecutor(max_workers=len(accounts)) as executor:
+            futures = [executor.submit(sync, account) for account in accounts]
+            return [future.result() for future in futures]
@@ -0,0 +1,126 @@
+import bisect
+import datetime
+import threading
+from collections import defaultdict
+
+# How far apart the two sides of a transfer can have been created and still be paired
+TRANSFER_TOLERANCE = datetime.timedelta(minutes=5)
+
+
+def _transfer_account_id(transaction):
+    """Return the ID of the other Up account in a transfer, or None if the transaction
+    isn't one."""
+    relationship = transaction.get("relationships", {}).get("transferAccount") or {}
+    data = relationship.get("data")
+    return data["id"] if data else None
+
+
+def _created_timestamp(transaction):
+    return datetime.datetime.fromisoformat(
+        transaction["attributes"]["createdAt"]
+    ).timestamp()
+
+
+class TransferMatcher:
+    """Pairs up the two sides of transfers between Up accounts that are synced
+    together, so that each transfer is imported into YNAB once, as a YNAB transfer.
+
+    Up gives both sides of a move between accounts, such as to a Saver or a round up, a
+    transferAccount relationship to the other account. The incoming side is uploaded
+    with the transfer payee of the YNAB account the money came from, which makes YNAB
+    create the outgoing side itself. The outgoing sides are held back until every
+    account has been fetched, then paired with an incoming side of the same amount
+    created within TRANSFER_TOLERANCE of them. Paired outgoing sides are left out of
+    the upload, and any left unpaired (e.g. if the other side is outside the time
+    range being synced) are imported as ordinary transactions.
+
+    The incoming sides are indexed by their accounts and amount, each with a sorted
+    list of creation times, so pairing stays close to linear in the number of
+    transfers rather than comparing every pair.
+
+    accounts is the list of SyncedAccounts being synced together, and
+    transfer_payee_ids maps the ID of each YNAB account to its transfer payee ID. Every
+    account must be marked as finished once it has been fetched (or has failed), as
+    pairing waits for all of them. The matcher is safe to share between threads.
+    """
+
+    def __init__(self, accounts, transfer_payee_ids, tolerance=TRANSFER_TOLERANCE):
+        self.payee_ids = {
+            account.up_id: transfer_payee_ids[account.ynab_id]
+            for account in accounts
+            if transfer_payee_ids.get(account.ynab_id) is not None
+        }
+        self.tolerance = tolerance.total_seconds()
+        self.condition = threading.Condition()
+        self.fetching = {account.up_id for account in accounts}
+        # The creation times of the incoming sides, by (from, to, amount)
+        self.incoming = defaultdict(list)
+        self.is_sorted = True
+
+    def observe(self, up_account_id, page):
+        """Index the incoming sides of transfers in a page of transaction data from
+        one of the accounts, including any that won't be uploaded because they were
+        synced before."""
+        with self.condition:
+            for transaction in page:
+                from_id = _transfer_account_id(transaction)
+                amount = transaction["attributes"]["amount"]["valueInBaseUnits"]
+                if from_id in self.payee_ids and amount > 0:
+                    key = (from_id, up_account_id, amount)
+                    self.incoming[key].append(_created_timestamp(transaction))
+                    self.is_sorted = False
+
+    def split(self, up_account_id, page, converted):
+        """Return the YNABTransactions converted from a page of transaction data with
+        the incoming sides of transfers made into YNAB transfers, and a list of the
+        (transaction data, YNABTransaction) pairs of the outgoing sides that were taken
+        out, to be paired once every account has been fetched."""
+        kept = []
+        outgoing = []
+        for transaction, ynab_tx in zip(page, converted):
+            other_id = _transfer_account_id(transaction)
+            if other_id == up_account_id or other_id not in self.payee_ids:
+                kept.append(ynab_tx)
+            elif ynab_tx.amount > 0:
+                # Transfers between budget accounts don't have a category
+                kept.append(
+                    ynab_tx._replace(
+                        payee_id=self.payee_ids[other_id], category_id=None
+                    )
+                )
+            else:
+                outgoing.append((transaction, ynab_tx))
+        return kept, outgoing
+
+    def finish(self, up_account_id):
+        """Mark an account as fetched, or failed. Safe to call more than once."""
+        with self.condition:
+            self.fetching.discard(up_account_id)
+            self.condition.notify_all()
+
+    def pair(self, up_account_id, outgoing):
+        """Wait for every account to be fetched, then pair each of the outgoing sides
+        from split with an incoming side. Returns the YNABTransactions of the ones
+        that couldn't be paired."""
+        with self.condition:
+            self.condition.wait_for(lambda: not self.fetching)
+            if not self.is_sorted:
+                for created in self.incoming.values():
+                    created.sort()
+                self.is_sorted = True
+
+            unpaired = []
+            for transaction, ynab_tx in outgoing:
+                to_id = _transfer_account_id(transaction)
+                amount = transaction["attributes"]["amount"]["valueInBaseUnits"]
+                created = self.incoming.get((up_account_id, to_id, -amount))
+                timestamp = _created_timestamp(transaction)
+                if created:
+                    # The first incoming side created no earlier than the tolerance
+                    # allows, which is paired if it isn't too late either
+                    i = bisect.bisect_left(created, timestamp - self.tolerance)
+                    if i < len(created) and created[i] <= timestamp + self.tolerance:
+                        del created[i]
+                        continue
+                unpaired.append(ynab_tx)
+            return unpaired
@@ -0,0 +1,31 @@
+import click
+
+
+class AccountMapping(click.ParamType):
+    """A click parameter type for an "UP ACCOUNT=YNAB ACCOUNT" pair of account names,
+    converted to an (up_name, ynab_name) tuple. up_kind and ynab_kind describe the
+    names in error messages, for pairs of other things, e.g. a Saver and a category.
+
+    When used with multiple=True and an environment variable, the pairs in the variable
+    are separated by semicolons.
+    """
+
+    name = "UP=YNAB"
+    envvar_list_splitter = ";"
+
+    def __init__(self, up_kind="UP ACCOUNT", ynab_kind="YNAB ACCOUNT"):
+        self.up_kind = up_kind
+        self.ynab_kind = ynab_kind
+
+    def convert(self, value, param, ctx):
+        if isinstance(value, tuple):
+            return value
+
+        up_name, sep, ynab_name = value.partition("=")
+        if not sep or not up_name.strip() or not ynab_name.strip():
+            self.fail(
+                f"{value!r} is not of the form '{self.up_kind}={self.ynab_kind}'",
+                param,
+                ctx,
+            )
+        return up_name.strip(), ynab_name.strip()
@@ -0,0 +1,14 @@
+import os
+
+import click
+
+# The environment variable that moves up2ynab's local files out of the user's app
+# directory, e.g. to keep those of each tenant in a batch apart
+APP_DIR_ENVVAR = "UP2YNAB_APP_DIR"
+
+
+def app_dir():
+    """Return the directory that up2ynab keeps its local files in, such as the state
+    database and caches: UP2YNAB_APP_DIR if it's set, otherwise the user's app
+    directory."""
+    return os.environ.get(APP_DIR_ENVVAR) or click.get_app_dir("up2ynab")
@@ -1,19 +1,34 @@
 from functools import wraps
-from requests.exceptions import HTTPError
+
+from up2ynab.clients import MissingTokenError
 
 
 def handle_http_errors(f):
     """Handles any otherwise unhandled HTTPError in f.
     
     The errors are generally raised as a result of response.raise_for_status() after any
-    desired or specifically checked HTTP Error codes have been handled.
+    desired or specifically checked HTTP Error codes have been handled. A
+    MissingTokenError, from a command run without one of the API tokens, is handled too.
     """
 
     @wraps(f)
     def decorated(ctx, *args, **kwargs):
         try:
             return f(ctx, *args, **kwargs)
-        except HTTPError as e:
+        except MissingTokenError as e:
+            ctx.obj["echo_manager"].fatal(
+                f"Your {e.api_name} API token was not provided.",
+                "Please run `up2ynab check` to help fix this problem.",
+            )
+            ctx.exit(2)
+        except Exception as e:
+            # Imported here so that commands which don't make requests, or succeed,
+            # don't need to import requests
+            from requests.exceptions import HTTPError
+
+            if not isinstance(e, HTTPError):
+                raise
+
             out = ctx.obj["echo_manager"]
             code = e.response.status_code
 
@@ -30,11 +45,14 @@ def handle_http_errors(f):
                     "Please run `up2ynab check` to help fix this problem.",
                 )
                 ctx.exit(2)
-            elif code == 421:
+            elif code == 429:
+                retry_after = e.response.headers.get("Retry-After")
                 out.fatal(
                     "The rate limit has been exceeded for the API at the following URL:",
                     f"  *{e.request.method}* `{e.response.url}`",
-                    "Please wait before trying again.",
+                    f"Please wait *{retry_after} seconds* before trying again."
+                    if retry_after is not None and retry_after.isdigit()
+                    else "Please wait before trying again.",
                 )
                 ctx.exit(2)
             else:
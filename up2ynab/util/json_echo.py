@@ -0,0 +1,123 @@
+import datetime
+import json
+import threading
+import time
+
+import click
+
+from up2ynab.util.pretty_echo import strip_markup
+
+
+class JSONEchoManager:
+    """Output as newline-delimited JSON events, for logs and other programs to read
+    rather than a terminal.
+
+    It has the same interface as up2ynab.util.pretty_echo.EchoManager, but never starts
+    a spinner thread: starting and finishing a task each write a single event, and the
+    finishing event includes how long the task took. Each event has the time it
+    happened, the kind of event, the section it happened in and any message, without
+    its markup, and counts.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.sections = []
+        self.tasks = {}
+
+    def _emit(self, event, message=None, counts=None, **fields):
+        data = {
+            "time": datetime.datetime.now().astimezone().isoformat(),
+            "event": event,
+        }
+        with self.lock:
+            if self.sections:
+                data["section"] = self.sections[-1][0]
+            if message is not None:
+                data["message"] = message
+            data.update(fields)
+            if counts is not None:
+                data["counts"] = counts
+            # Task keys are often tuples, which are written as lists, but they could
+            # be anything hashable
+            click.echo(json.dumps(data, default=str))
+
+    @staticmethod
+    def _join(message):
+        return "\n".join(strip_markup(line).strip() for line in message)
+
+    def grouped(self):
+        """Return a context manager that keeps all output echoed within it together,
+        when tasks are being finished from several threads."""
+        return self.lock
+
+    def section(self, header):
+        with self.lock:
+            self.sections.append((strip_markup(header), time.perf_counter()))
+            self._emit("section_start")
+
+    def end_section(self):
+        with self.lock:
+            start = self.sections[-1][1]
+            self._emit(
+                "section_end", duration_seconds=round(time.perf_counter() - start, 6)
+            )
+            self.sections.pop()
+
+    def start_task(self, message, task=None):
+        """Record that a task has started.
+
+        task is any hashable key identifying the task, to allow several tasks to be in
+        progress at once. It must be passed to task_success/task_error to finish it.
+        """
+        with self.lock:
+            if task in self.tasks:
+                raise RuntimeError("Another task is already in progress")
+            self.tasks[task] = time.perf_counter()
+            self._emit("task_start", strip_markup(message), task=task)
+
+    def _finish_task(self, status, message, task, counts=None):
+        with self.lock:
+            if task not in self.tasks:
+                raise RuntimeError("No task is currently in progress")
+            start = self.tasks.pop(task)
+            self._emit(
+                "task_end",
+                message,
+                counts,
+                task=task,
+                status=status,
+                duration_seconds=round(time.perf_counter() - start, 6),
+            )
+
+    def task_success(self, message, task=None, counts=None):
+        self._finish_task("success", strip_markup(message), task, counts)
+
+    def task_error(self, message, task=None, counts=None):
+        self._finish_task("error", strip_markup(message), task, counts)
+
+    def success(self, *message, counts=None):
+        self._emit("success", self._join(message), counts)
+
+    def error(self, *message):
+        self._emit("error", self._join(message))
+
+    def warning(self, *message):
+        self._emit("warning", self._join(message))
+
+    def info(self, *message, counts=None):
+        self._emit("info", self._join(message), counts)
+
+    def comment(self, *message):
+        self._emit("comment", self._join(message))
+
+    def cancel_tasks(self):
+        """Record every task that is still in progress as cancelled."""
+        with self.lock:
+            for task in list(self.tasks):
+                self._finish_task("cancelled", None, task)
+
+    def fatal(self, *message):
+        with self.lock:
+            self.cancel_tasks()
+            self.sections.clear()
+            self._emit("fatal", self._join(message))
@@ -0,0 +1,104 @@
+import codecs
+import json
+
+_decoder = json.JSONDecoder()
+
+_WHITESPACE = " \t\n\r"
+
+
+class _StreamReader:
+    """Reads JSON values one at a time from an iterable of chunks of UTF-8 bytes,
+    keeping only the undecoded part of the text in memory."""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        """Add the next chunk to the buffer, returning False if there are no more."""
+        for chunk in self.chunks:
+            text = self.text_decoder.decode(chunk)
+            if text:
+                self.buffer = self.buffer[self.pos :] + text
+                self.pos = 0
+                return True
+        self.buffer = self.buffer[self.pos :] + self.text_decoder.decode(b"", True)
+        self.pos = 0
+        self.eof = True
+        return False
+
+    def peek(self):
+        """Return the next character that isn't whitespace, without consuming it."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                raise ValueError("unexpected end of JSON data")
+
+    def expect(self, chars):
+        """Consume the next character that isn't whitespace, which must be one of
+        chars, and return it."""
+        char = self.peek()
+        if char not in chars:
+            raise ValueError(f"expected one of {chars!r} at {char!r} in JSON data")
+        self.pos += 1
+        return char
+
+    def value(self):
+        """Decode and consume the next complete JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # Most likely the value continues in the next chunk
+                if not self._fill():
+                    raise
+                continue
+            # A number at the end of the buffer may continue in the next chunk too
+            if end == len(self.buffer) and not self.eof and self._fill():
+                continue
+            self.pos = end
+            return value
+
+
+def load_streamed(chunks, array_key, transform):
+    """Decode a JSON object from an iterable of chunks of UTF-8 bytes (such as a
+    streamed response body), passing each item of the array under array_key through
+    transform as soon as it's decoded.
+
+    Only one item is ever fully decoded at a time, so if transform keeps less than the
+    whole item, the memory used stays well below decoding the entire object at once.
+    The other values in the object are decoded as usual. Raises a ValueError if the
+    data isn't a valid JSON object.
+    """
+    reader = _StreamReader(chunks)
+    result = {}
+    reader.expect("{")
+    if reader.peek() == "}":
+        return result
+
+    while True:
+        key = reader.value()
+        reader.expect(":")
+        if key == array_key and reader.peek() == "[":
+            reader.expect("[")
+            items = []
+            if reader.peek() == "]":
+                reader.expect("]")
+            else:
+                while True:
+                    items.append(transform(reader.value()))
+                    if reader.expect(",]") == "]":
+                        break
+            result[key] = items
+        else:
+            result[key] = reader.value()
+
+        if reader.expect(",}") == "}":
+            return result
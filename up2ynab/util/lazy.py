@@ -0,0 +1,42 @@
+import importlib
+
+import click
+
+
+class LazyGroup(click.Group):
+    """A click Group whose subcommands are only imported when they are needed.
+
+    lazy_subcommands maps each command name to the "module.attribute" path of its
+    click Command. A command's module, and everything it imports, is only loaded when
+    the command is looked up, e.g. to run it, so running one command doesn't load the
+    others.
+    """
+
+    def __init__(self, *args, lazy_subcommands=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy_subcommands = lazy_subcommands or {}
+
+    def list_commands(self, ctx):
+        return sorted(set(super().list_commands(ctx)) | set(self.lazy_subcommands))
+
+    def get_command(self, ctx, cmd_name):
+        if cmd_name not in self.commands and cmd_name in self.lazy_subcommands:
+            module_name, _, attribute = self.lazy_subcommands[cmd_name].rpartition(".")
+            module = importlib.import_module(module_name)
+            self.add_command(getattr(module, attribute), cmd_name)
+        return super().get_command(ctx, cmd_name)
+
+
+class LazyDict(dict):
+    """A dict where some values are created by calling a factory the first time they
+    are looked up, for expensive objects that not every command uses."""
+
+    def __init__(self, *args, factories=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.factories = factories or {}
+
+    def __missing__(self, key):
+        if key not in self.factories:
+            raise KeyError(key)
+        value = self[key] = self.factories.pop(key)()
+        return value
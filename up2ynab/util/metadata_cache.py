@@ -0,0 +1,76 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+from up2ynab.util.app_dir import app_dir
+
+# How long cached values are used before they are fetched again
+DEFAULT_TTL = 24 * 60 * 60
+
+
+def default_cache_path():
+    """Return the default location of the cache file in the user's app directory."""
+    return os.path.join(app_dir(), "cache.json")
+
+
+def token_key(api_token, name):
+    """Return a cache key for the named value belonging to the owner of an API token,
+    without including the token itself."""
+    digest = hashlib.sha256(api_token.encode()).hexdigest()[:16]
+    return f"{digest}:{name}"
+
+
+class MetadataCache:
+    """A small on-disk JSON cache of API metadata that rarely changes, such as account
+    IDs, where each value expires ttl seconds after it was set.
+
+    If refresh is True, nothing is read from the cache, but values are still written to
+    it. The cache is safe to share between threads, and is written atomically so that
+    concurrent processes don't corrupt it.
+    """
+
+    def __init__(self, path=None, ttl=DEFAULT_TTL, refresh=False):
+        self.path = path if path is not None else default_cache_path()
+        self.ttl = ttl
+        self.refresh = refresh
+        self.lock = threading.Lock()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, entries):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, self.path)
+
+    def get(self, key):
+        """Return the cached value for key, or None if it is missing or has expired."""
+        if self.refresh:
+            return None
+        with self.lock:
+            entry = self._load().get(key)
+        if entry is None or time.time() - entry["time"] > self.ttl:
+            return None
+        return entry["value"]
+
+    def set(self, key, value):
+        with self.lock:
+            entries = self._load()
+            entries[key] = {"time": time.time(), "value": value}
+            self._save(entries)
+
+    def invalidate(self, key):
+        with self.lock:
+            entries = self._load()
+            if entries.pop(key, None) is not None:
+                self._save(entries)
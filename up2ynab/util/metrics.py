@@ -0,0 +1,182 @@
+import bisect
+import datetime
+import json
+import re
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+import click
+
+# The upper bounds of the request latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Response headers reporting on rate limits, which are kept from the latest response:
+# YNAB's X-Rate-Limit, and Up's X-RateLimit-Remaining and X-RateLimit-Limit
+RATE_LIMIT_HEADERS = (
+    "X-Rate-Limit",
+    "X-RateLimit-Remaining",
+    "X-RateLimit-Limit",
+    "Retry-After",
+)
+
+# Path segments that are IDs, which are replaced so requests are grouped by endpoint
+_ID_SEGMENT = re.compile(r"^(?=.*\d)[0-9a-fA-F-]{8,}$")
+
+
+def endpoint_name(method, url):
+    """Return the name requests to url are counted under, e.g.
+    "GET api.up.com.au/api/v1/accounts/{id}/transactions"."""
+    parsed = urlparse(url)
+    path = "/".join(
+        "{id}" if _ID_SEGMENT.match(segment) else segment
+        for segment in parsed.path.split("/")
+    )
+    return f"{method} {parsed.netloc}{path}"
+
+
+class _Timings:
+    """Running totals of a set of durations, with a histogram if buckets is given."""
+
+    def __init__(self, buckets=None):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = buckets
+        self.histogram = [0] * (len(buckets) + 1) if buckets is not None else None
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        if self.buckets is not None:
+            self.histogram[bisect.bisect_left(self.buckets, seconds)] += 1
+
+    def to_dict(self):
+        data = {
+            "count": self.count,
+            "total_seconds": round(self.total, 6),
+            "mean_seconds": round(self.total / self.count, 6) if self.count else None,
+            "max_seconds": round(self.max, 6),
+        }
+        if self.buckets is not None:
+            bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+            data["histogram"] = dict(zip(bounds, self.histogram))
+        return data
+
+
+class _EndpointMetrics:
+    def __init__(self):
+        self.latency = _Timings(LATENCY_BUCKETS)
+        self.status_codes = {}
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.decoded_response_bytes = 0
+
+    def to_dict(self):
+        return {
+            "count": self.latency.count,
+            "status_codes": self.status_codes,
+            "request_bytes": self.request_bytes,
+            "response_bytes": self.response_bytes,
+            "decoded_response_bytes": self.decoded_response_bytes,
+            "latency": self.latency.to_dict(),
+        }
+
+
+class Metrics:
+    """Timings of the stages of a command, and statistics of the HTTP requests it
+    makes, which can be written out as JSON.
+
+    Stages are timed with the stage context manager, and each response is recorded by
+    adding record_response to the "response" hooks of the requests session. Metrics
+    are safe to record from several threads at once.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_at = datetime.datetime.now().astimezone()
+        self.start_time = time.perf_counter()
+        self.stages = {}
+        self.endpoints = {}
+        self.rate_limits = {}
+
+    @contextmanager
+    def stage(self, name):
+        """Time the code run within the context as one occurrence of the named
+        stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage_time(name, time.perf_counter() - start)
+
+    def add_stage_time(self, name, seconds):
+        with self.lock:
+            self.stages.setdefault(name, _Timings()).add(seconds)
+
+    def record_response(self, r, *args, **kwargs):
+        """Record a response. This is a requests response hook, which receives the
+        arguments the request was sent with."""
+        # The size of the body once decoded, e.g. decompressed. A streamed response
+        # isn't measured, as its body is left for the caller to read.
+        decoded_bytes = 0 if kwargs.get("stream") else len(r.content)
+        # The size of the body as it was sent, which is smaller if it was compressed
+        content_length = r.headers.get("Content-Length", "")
+        if content_length.isdigit():
+            response_bytes = int(content_length)
+        elif "Content-Encoding" not in r.headers:
+            response_bytes = decoded_bytes
+        else:
+            response_bytes = 0
+        request_bytes = len(r.request.body or b"")
+        name = endpoint_name(r.request.method, r.url)
+
+        with self.lock:
+            endpoint = self.endpoints.get(name)
+            if endpoint is None:
+                endpoint = self.endpoints[name] = _EndpointMetrics()
+            endpoint.latency.add(r.elapsed.total_seconds())
+            code = str(r.status_code)
+            endpoint.status_codes[code] = endpoint.status_codes.get(code, 0) + 1
+            endpoint.request_bytes += request_bytes
+            endpoint.response_bytes += response_bytes
+            endpoint.decoded_response_bytes += decoded_bytes
+
+            rate_limits = {
+                header: r.headers[header]
+                for header in RATE_LIMIT_HEADERS
+                if header in r.headers
+            }
+            if rate_limits:
+                self.rate_limits.setdefault(urlparse(r.url).netloc, {}).update(
+                    rate_limits
+                )
+
+        return r
+
+    def to_dict(self, **extra):
+        """Return all of the metrics as a JSON-serialisable dict, including any extra
+        top-level items."""
+        with self.lock:
+            return {
+                **extra,
+                "started_at": self.started_at.isoformat(),
+                "duration_seconds": round(time.perf_counter() - self.start_time, 6),
+                "stages": {
+                    name: timings.to_dict() for name, timings in self.stages.items()
+                },
+                "http": {
+                    name: endpoint.to_dict()
+                    for name, endpoint in sorted(self.endpoints.items())
+                },
+                "rate_limits": self.rate_limits,
+            }
+
+    def write(self, path, **extra):
+        """Write the metrics as JSON to the file at path, or to stdout if path is
+        "-"."""
+        with click.open_file(path, "w") as f:
+            json.dump(self.to_dict(**extra), f, indent=2)
+            f.write("\n")
@@ -5,6 +5,9 @@ import re
 
 import click
 
+# Text within *asterisks* is highlighted, and within `backticks` is preformatted
+_MARKUP = re.compile(r"\*(.+?)\*|`(.+?)`")
+
 
 def _style_unimportant(string):
     return click.style(string, fg="white", dim=True)
@@ -39,90 +42,155 @@ def _style_header(string,):
 
 
 class EchoInProgress:
-    def __init__(self, in_progress_message, level=0):
-        self.in_progress_message = _style_unimportant(in_progress_message)
+    """A spinner on the current terminal line, showing every task that is in progress.
+
+    Several tasks can be in progress at once, started and finished from any thread. The
+    spinner thread runs for as long as there is at least one task in progress. While it
+    does, all other output must go through echo() so that it doesn't get mixed up with
+    the spinner line.
+    """
+
+    def __init__(self):
         self.spinner_cycle = itertools.cycle("⠋⠙⠹⠸⠼⠴⠦⠧⠇⠏")
-        self.stop = threading.Event()
+        self.tasks = {}
+        self.lock = threading.RLock()
         self.spin_thread = None
-        self.level = level
+        self.line_width = 0
 
     def _spin(self):
-        while not self.stop.is_set():
-            next_char = next(self.spinner_cycle)
-            click.echo(
-                f'\r{4*self.level*" "}{next_char} {self.in_progress_message}', nl=False
-            )
+        while True:
+            with self.lock:
+                if not self.tasks:
+                    self.spin_thread = None
+                    return
+                next_char = next(self.spinner_cycle)
+                level = next(iter(self.tasks.values()))[0]
+                messages = _style_unimportant(" · ").join(
+                    message for _, message in self.tasks.values()
+                )
+                line = f'{4*level*" "}{next_char} {messages}'
+                click.echo(f"\r{self._padded(line)}", nl=False)
+                self.line_width = len(click.unstyle(line))
             time.sleep(0.05)
 
-    def _stop(self):
-        assert self.spin_thread is not None
-        self.stop.set()
-        self.spin_thread.join()
+    def _padded(self, line):
+        # Pad by the visible width, so that the spinner line is fully overwritten
+        return line + " " * (self.line_width - len(click.unstyle(line)))
+
+    def echo(self, line):
+        """Echo a line of output, overwriting the spinner line if it is showing."""
+        with self.lock:
+            click.echo(f"\r{self._padded(line)}")
+            self.line_width = 0
+
+    def start(self, task, in_progress_message, level=0):
+        with self.lock:
+            self.tasks[task] = (level, in_progress_message)
+            if self.spin_thread is None:
+                # A daemon, so that an unhandled error with tasks still in progress
+                # can't keep the process from exiting
+                self.spin_thread = threading.Thread(target=self._spin, daemon=True)
+                self.spin_thread.start()
+
+    def finish(self, task, message):
+        with self.lock:
+            level, _ = self.tasks.pop(task)
+            self.echo(f'{4*level*" "}{message}')
+
+    def cancel_all(self):
+        with self.lock:
+            for level, message in self.tasks.values():
+                self.echo(click.style(f'{4*level*" "}◼︎ ', fg="red") + message)
+            self.tasks.clear()
+
+
+def _style_markup(match):
+    highlight, preformatted = match.groups()
+    if highlight is not None:
+        return _style_highlight(highlight)
+    return _style_preformatted(preformatted)
+
+
+def _style_in_progress(string):
+    """Dim the message of a task in progress, apart from its markup."""
+    parts = []
+    end = 0
+    for match in _MARKUP.finditer(string):
+        parts.append(_style_unimportant(string[end : match.start()]))
+        parts.append(_style_markup(match))
+        end = match.end()
+    parts.append(_style_unimportant(string[end:]))
+    return "".join(parts)
+
+
+def strip_markup(string):
+    """Return a message without its *highlight* and `preformatted` markup."""
+    return _MARKUP.sub(lambda match: match.group(1) or match.group(2), string)
 
-    def start(self):
-        self.spin_thread = threading.Thread(target=self._spin)
-        self.spin_thread.start()
-        return self
 
-    def finish(self, message):
-        self._stop()
-        click.echo(
-            f'\r{4*self.level*" "}{message: <{4*self.level + len(self.in_progress_message) + 11}}'
-        )
-
-    def cancel(self):
-        self._stop()
-        click.secho(f'\r{4*self.level*" "}◼︎ {self.in_progress_message}', fg="red")
+class EchoManager:
+    """Styled output for a terminal, with a spinner showing the tasks in progress.
 
+    Messages can contain *highlighted* and `preformatted` text. Several methods take
+    counts, a dict of the numbers the message reports on, which is only used by
+    machine-readable output such as up2ynab.util.json_echo.JSONEchoManager.
+    """
 
-class EchoManager:
     @staticmethod
     def _format_message(string):
-        with_highlight = re.sub(
-            r"\*(.+?)\*", lambda s: _style_highlight(s.group(1)), string
-        )
-        with_preformat = re.sub(
-            r"\`(.+?)\`", lambda s: _style_preformatted(s.group(1)), with_highlight
-        )
-        return with_preformat
+        return _MARKUP.sub(_style_markup, string)
 
     def __init__(self):
         self.current_level = 0
-        self.in_progress = None
+        self.in_progress = EchoInProgress()
 
     def _level_echo(self, string):
-        click.echo(4 * self.current_level * " " + self._format_message(string))
+        self.in_progress.echo(
+            4 * self.current_level * " " + self._format_message(string)
+        )
 
     def _hanging_pad(self, extra):
         return "\n" + ((self.current_level * 4) + extra) * " "
 
+    def grouped(self):
+        """Return a context manager that keeps all output echoed within it together,
+        when tasks are being finished from several threads."""
+        return self.in_progress.lock
+
     def section(self, header):
         self._level_echo(_style_header(header))
         self.current_level += 1
 
     def end_section(self):
-        click.echo()
+        self.in_progress.echo("")
         self.current_level -= 1
 
-    def start_task(self, message):
-        if self.in_progress is not None:
-            raise RuntimeError("Another task is already in progress")
-        self.in_progress = EchoInProgress(message, level=self.current_level)
-        self.in_progress.start()
-
-    def task_success(self, message):
-        if self.in_progress is None:
-            raise RuntimeError("No task is currently in progress")
-        self.in_progress.finish(self._format_message(_style_success(message)))
-        self.in_progress = None
-
-    def task_error(self, message):
-        if self.in_progress is None:
-            raise RuntimeError("No task is currently in progress")
-        self.in_progress.finish(self._format_message(_style_error(message)))
-        self.in_progress = None
-
-    def success(self, *message):
+    def start_task(self, message, task=None):
+        """Start showing a task as in progress.
+
+        task is any hashable key identifying the task, to allow several tasks to be in
+        progress at once. It must be passed to task_success/task_error to finish it.
+        """
+        with self.in_progress.lock:
+            if task in self.in_progress.tasks:
+                raise RuntimeError("Another task is already in progress")
+            self.in_progress.start(
+                task, _style_in_progress(message), level=self.current_level
+            )
+
+    def _finish_task(self, message, task):
+        with self.in_progress.lock:
+            if task not in self.in_progress.tasks:
+                raise RuntimeError("No task is currently in progress")
+            self.in_progress.finish(task, self._format_message(message))
+
+    def task_success(self, message, task=None, counts=None):
+        self._finish_task(_style_success(message), task)
+
+    def task_error(self, message, task=None, counts=None):
+        self._finish_task(_style_error(message), task)
+
+    def success(self, *message, counts=None):
         self._level_echo(_style_success(self._hanging_pad(2).join(message)))
 
     def error(self, *message):
@@ -131,7 +199,7 @@ class EchoManager:
     def warning(self, *message):
         self._level_echo(_style_warning(self._hanging_pad(2).join(message)))
 
-    def info(self, *message):
+    def info(self, *message, counts=None):
         self._level_echo(_style_info(self._hanging_pad(2).join(message)))
 
     def comment(self, *message):
@@ -139,9 +207,12 @@ class EchoManager:
         preceeding task/message."""
         self._level_echo("  " + _style_info(self._hanging_pad(4).join(message)))
 
+    def cancel_tasks(self):
+        """Show every task that is still in progress as cancelled."""
+        self.in_progress.cancel_all()
+
     def fatal(self, *message):
-        if self.in_progress is not None:
-            self.in_progress.cancel()
+        self.cancel_tasks()
         self.current_level = 0
-        click.echo()
+        self.in_progress.echo("")
         self.error(*message)
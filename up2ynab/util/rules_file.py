@@ -0,0 +1,21 @@
+import click
+
+from up2ynab.rules import load_rules
+
+
+class RulesFile(click.ParamType):
+    """A click parameter type for the path of a JSON payee and category rules file,
+    converted to the compiled up2ynab.rules.RuleSet."""
+
+    name = "FILE"
+
+    def convert(self, value, param, ctx):
+        if not isinstance(value, str):
+            return value
+
+        try:
+            return load_rules(value)
+        except OSError as e:
+            self.fail(f"couldn't read {value!r}: {e.strerror}", param, ctx)
+        except ValueError as e:
+            self.fail(f"{value!r} isn't a valid rules file: {e}", param, ctx)
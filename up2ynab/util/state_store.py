@@ -0,0 +1,159 @@
+import datetime
+import os
+import sqlite3
+import threading
+
+from up2ynab.util.app_dir import app_dir
+
+# The maximum number of parameters to bind in a single SQLite query
+_MAX_QUERY_PARAMS = 500
+
+_parse_timestamp = datetime.datetime.fromisoformat
+
+
+def default_state_path():
+    """Return the default location of the state database in the user's app directory."""
+    return os.path.join(app_dir(), "state.sqlite3")
+
+
+class StateStore:
+    """A persistent, local record of the Up transactions that have been imported into
+    YNAB, along with the createdAt cursor of the latest transaction synced for each Up
+    account, and the time windows of each account that a backfill has completed.
+
+    The store is safe to share between threads.
+    """
+
+    def __init__(self, path=None):
+        self.path = path if path is not None else default_state_path()
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        with self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS imported ("
+                " up_id TEXT PRIMARY KEY,"
+                " account_id TEXT NOT NULL,"
+                " import_id TEXT NOT NULL,"
+                " created_at TEXT NOT NULL)"
+            )
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS cursors ("
+                " account_id TEXT PRIMARY KEY,"
+                " created_at TEXT NOT NULL)"
+            )
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS backfill_windows ("
+                " account_id TEXT NOT NULL,"
+                " since REAL NOT NULL,"
+                " until REAL NOT NULL,"
+                " PRIMARY KEY (account_id, since, until))"
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def known_ids(self, up_ids):
+        """Return the subset of the given Up transaction IDs that have already been
+        imported."""
+        up_ids = list(up_ids)
+        known = set()
+        with self.lock:
+            for i in range(0, len(up_ids), _MAX_QUERY_PARAMS):
+                chunk = up_ids[i : i + _MAX_QUERY_PARAMS]
+                rows = self.db.execute(
+                    "SELECT up_id FROM imported WHERE up_id IN"
+                    f" ({','.join('?' * len(chunk))})",
+                    chunk,
+                )
+                known.update(row[0] for row in rows)
+        return known
+
+    def record_imported(self, account_id, transactions, failed=()):
+        """Record the given (up_id, import_id, created_at) tuples as imported from the
+        Up account with the specified ID, and advance that account's cursor to the
+        latest created_at among them.
+
+        failed are the tuples of any transactions that failed to import, which aren't
+        recorded. The cursor is kept at or before the created_at of the oldest of them
+        (moving it back if need be), so that the next sync fetches them again.
+        """
+        transactions = list(transactions)
+        failed = list(failed)
+        if not transactions and not failed:
+            return
+
+        limit = None
+        if failed:
+            limit = min(
+                (created_at for _, _, created_at in failed), key=_parse_timestamp
+            )
+        latest = limit
+        if transactions:
+            latest = max(
+                (created_at for _, _, created_at in transactions),
+                key=_parse_timestamp,
+            )
+            if limit is not None and _parse_timestamp(limit) < _parse_timestamp(latest):
+                latest = limit
+
+        with self.lock, self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO imported VALUES (?, ?, ?, ?)",
+                [
+                    (up_id, account_id, import_id, created_at)
+                    for up_id, import_id, created_at in transactions
+                ],
+            )
+            row = self.db.execute(
+                "SELECT created_at FROM cursors WHERE account_id = ?", (account_id,)
+            ).fetchone()
+            if (
+                row is None
+                or _parse_timestamp(row[0]) < _parse_timestamp(latest)
+                or (
+                    limit is not None
+                    and _parse_timestamp(row[0]) > _parse_timestamp(limit)
+                )
+            ):
+                self.db.execute(
+                    "INSERT OR REPLACE INTO cursors VALUES (?, ?)", (account_id, latest)
+                )
+
+    def cursor(self, account_id):
+        """Return the createdAt datetime of the latest transaction synced from the Up
+        account with the specified ID, or None if nothing has been synced yet."""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT created_at FROM cursors WHERE account_id = ?", (account_id,)
+            ).fetchone()
+        return None if row is None else _parse_timestamp(row[0])
+
+    def record_window(self, account_id, since, until):
+        """Record that every transaction in the Up account with the specified ID
+        created from since until until has been imported by a backfill."""
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO backfill_windows VALUES (?, ?, ?)",
+                (account_id, since.timestamp(), until.timestamp()),
+            )
+
+    def window_completed(self, account_id, since, until):
+        """Return whether a backfill has imported every transaction in the Up account
+        with the specified ID created from since until until, in a window covering
+        it."""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT 1 FROM backfill_windows"
+                " WHERE account_id = ? AND since <= ? AND until >= ?",
+                (account_id, since.timestamp(), until.timestamp()),
+            ).fetchone()
+        return row is not None
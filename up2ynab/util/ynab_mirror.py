@@ -0,0 +1,242 @@
+import os
+import sqlite3
+import threading
+from collections import namedtuple
+
+from up2ynab.clients import MissingTokenError
+from up2ynab.util.app_dir import app_dir
+from up2ynab.util.metadata_cache import token_key
+
+# The maximum number of parameters to bind in a single SQLite query
+_MAX_QUERY_PARAMS = 500
+
+MirroredTransaction = namedtuple(
+    "MirroredTransaction", ("id", "import_id", "date", "amount", "deleted")
+)
+
+# A category's budgeted amount and balance in the month it was refreshed for
+MirroredCategory = namedtuple("MirroredCategory", ("id", "name", "budgeted", "balance"))
+
+
+def default_mirror_path():
+    """Return the default location of the mirror database in the user's app directory."""
+    return os.path.join(app_dir(), "ynab_mirror.sqlite3")
+
+
+class YNABMirror:
+    """A local copy of the transactions in YNAB accounts, and of the budget's
+    categories, kept up to date with YNAB's delta requests so that each refresh only
+    transfers what changed since the last.
+
+    Only the fields needed to compare against Up transactions and balances are kept. The mirror is
+    safe to share between threads.
+    """
+
+    def __init__(self, path=None):
+        self.path = path if path is not None else default_mirror_path()
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        with self.db:
+            # The categories used to be kept for a single budget, so start them again
+            # if the tables are from then
+            columns = [
+                row[1] for row in self.db.execute("PRAGMA table_info(categories)")
+            ]
+            if columns and "budget" not in columns:
+                self.db.execute("DROP TABLE categories")
+                self.db.execute("DROP TABLE IF EXISTS category_knowledge")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS transactions ("
+                " id TEXT PRIMARY KEY,"
+                " account_id TEXT NOT NULL,"
+                " import_id TEXT,"
+                " date TEXT NOT NULL,"
+                " amount INTEGER NOT NULL,"
+                " deleted INTEGER NOT NULL)"
+            )
+            self.db.execute(
+                "CREATE INDEX IF NOT EXISTS transactions_import_id"
+                " ON transactions (account_id, import_id)"
+            )
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS knowledge ("
+                " account_id TEXT PRIMARY KEY,"
+                " server_knowledge INTEGER NOT NULL)"
+            )
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS categories ("
+                " budget TEXT NOT NULL,"
+                " id TEXT NOT NULL,"
+                " name TEXT NOT NULL,"
+                " budgeted INTEGER NOT NULL,"
+                " balance INTEGER NOT NULL,"
+                " PRIMARY KEY (budget, id))"
+            )
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS category_knowledge ("
+                " owner TEXT PRIMARY KEY,"
+                " budget TEXT NOT NULL,"
+                " month TEXT NOT NULL,"
+                " server_knowledge INTEGER NOT NULL)"
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def server_knowledge(self, account_id):
+        """Return the server knowledge the account was last refreshed at, or None if it
+        has never been refreshed."""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT server_knowledge FROM knowledge WHERE account_id = ?",
+                (account_id,),
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def refresh(self, ynab_client, account_id):
+        """Bring the copy of the specified YNAB account up to date, fetching only the
+        transactions changed since the last refresh. Returns the number of transactions
+        that changed."""
+        transactions, server_knowledge = ynab_client.get_account_transactions(
+            account_id, last_knowledge=self.server_knowledge(account_id)
+        )
+
+        with self.lock, self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO transactions VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        tx["id"],
+                        account_id,
+                        tx["import_id"],
+                        tx["date"],
+                        tx["amount"],
+                        tx["deleted"],
+                    )
+                    for tx in transactions
+                ],
+            )
+            self.db.execute(
+                "INSERT OR REPLACE INTO knowledge VALUES (?, ?)",
+                (account_id, server_knowledge),
+            )
+
+        return len(transactions)
+
+    def by_import_id(self, account_id, import_ids):
+        """Return a dict mapping each of the given import IDs that is in the specified
+        account to its MirroredTransaction."""
+        import_ids = list(import_ids)
+        found = {}
+        with self.lock:
+            for i in range(0, len(import_ids), _MAX_QUERY_PARAMS):
+                chunk = import_ids[i : i + _MAX_QUERY_PARAMS]
+                rows = self.db.execute(
+                    "SELECT id, import_id, date, amount, deleted FROM transactions"
+                    " WHERE account_id = ? AND import_id IN"
+                    f" ({','.join('?' * len(chunk))})",
+                    [account_id] + chunk,
+                )
+                for row in rows:
+                    tx = MirroredTransaction(*row[:4], bool(row[4]))
+                    found[tx.import_id] = tx
+        return found
+
+    def imported_after(self, account_id, date):
+        """Return the MirroredTransactions in the specified account that have an import
+        ID, are dated after date (an ISO date string) and haven't been deleted."""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT id, import_id, date, amount, deleted FROM transactions"
+                " WHERE account_id = ? AND import_id IS NOT NULL AND date > ?"
+                " AND NOT deleted",
+                (account_id, date),
+            ).fetchall()
+        return [MirroredTransaction(*row[:4], bool(row[4])) for row in rows]
+
+    def refresh_categories(self, ynab_client, month):
+        """Bring the copy of the budget's categories up to date for month (e.g.
+        "2021-03"), fetching only the categories changed since the last refresh in the
+        same month. Returns the key of the budget, to pass to categories and
+        update_category, and the number of categories that changed.
+
+        YNAB returns the amounts of the current month, so a new month starts from a
+        full fetch. The categories are kept separately for each API token and budget.
+        The budget is YNAB's last-used one, so its ID is looked up after each refresh,
+        and if it isn't the one the token's last refresh was for, the categories are
+        fetched again in full, as the changes were relative to the other budget.
+        """
+        if ynab_client.api_token is None:
+            raise MissingTokenError("YNAB")
+        owner = token_key(ynab_client.api_token, "ynab_categories")
+        with self.lock:
+            row = self.db.execute(
+                "SELECT budget, month, server_knowledge FROM category_knowledge"
+                " WHERE owner = ?",
+                (owner,),
+            ).fetchone()
+        last_knowledge = None
+        if row is not None and row[1] == month:
+            last_knowledge = row[2]
+
+        categories, server_knowledge = ynab_client.get_categories(
+            last_knowledge=last_knowledge
+        )
+        budget = token_key(
+            ynab_client.api_token, ynab_client.get_budget_id(server_knowledge)
+        )
+        if last_knowledge is not None and budget != row[0]:
+            last_knowledge = None
+            categories, server_knowledge = ynab_client.get_categories()
+
+        with self.lock, self.db:
+            if last_knowledge is None:
+                self.db.execute("DELETE FROM categories WHERE budget = ?", (budget,))
+            self.db.executemany(
+                "DELETE FROM categories WHERE budget = ? AND id = ?",
+                [(budget, cat["id"]) for cat in categories if cat["deleted"]],
+            )
+            self.db.executemany(
+                "INSERT OR REPLACE INTO categories VALUES (?, ?, ?, ?, ?)",
+                [
+                    (budget, cat["id"], cat["name"], cat["budgeted"], cat["balance"])
+                    for cat in categories
+                    if not cat["deleted"]
+                ],
+            )
+            self.db.execute(
+                "INSERT OR REPLACE INTO category_knowledge VALUES (?, ?, ?, ?)",
+                (owner, budget, month, server_knowledge),
+            )
+
+        return budget, len(categories)
+
+    def update_category(self, budget, category):
+        """Record the data of a category in the budget (as returned by
+        refresh_categories) returned by YNAB after changing it, so that the mirror
+        matches without another refresh."""
+        with self.lock, self.db:
+            self.db.execute(
+                "UPDATE categories SET budgeted = ?, balance = ?"
+                " WHERE budget = ? AND id = ?",
+                (category["budgeted"], category["balance"], budget, category["id"]),
+            )
+
+    def categories(self, budget):
+        """Return the MirroredCategories of every category in the budget (as returned
+        by refresh_categories) that hasn't been deleted."""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT id, name, budgeted, balance FROM categories WHERE budget = ?",
+                (budget,),
+            ).fetchall()
+        return [MirroredCategory(*row) for row in rows]
@@ -0,0 +1,372 @@
+import datetime
+import hashlib
+import hmac
+import json
+import queue
+import time
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import up2ynab.clients.ynab as ynab_api
+
+TRANSACTION_CREATED = "TRANSACTION_CREATED"
+TRANSACTION_SETTLED = "TRANSACTION_SETTLED"
+TRANSACTION_DELETED = "TRANSACTION_DELETED"
+TRANSACTION_EVENT_TYPES = (
+    TRANSACTION_CREATED,
+    TRANSACTION_SETTLED,
+    TRANSACTION_DELETED,
+)
+
+# How long to keep collecting events after the first one arrives before pushing them
+# to YNAB together, in seconds
+DEFAULT_BATCH_WINDOW = 2.0
+
+# The header Up signs each webhook event body in
+SIGNATURE_HEADER = "X-Up-Authenticity-Signature"
+
+# The largest request body accepted, in bytes. Up's events are a few hundred bytes.
+MAX_BODY_SIZE = 2**20
+
+# The type of a single transaction event, and the ID of the Up transaction
+WebhookEvent = namedtuple("WebhookEvent", ("event_type", "transaction_id"))
+
+
+def verify_signature(secret_key, body, signature):
+    """Whether signature is the valid Up signature of the raw body bytes, i.e. the hex
+    SHA-256 HMAC of the body keyed with the webhook's secret key."""
+    expected = hmac.new(secret_key.encode(), body, hashlib.sha256).hexdigest()
+    # Compared as bytes, as compare_digest only takes ASCII strings and the header
+    # could contain anything
+    return hmac.compare_digest(
+        expected.encode(), (signature or "").encode("latin-1", "replace")
+    )
+
+
+def parse_event(body):
+    """Return the WebhookEvent in a webhook event body, or None if it isn't a
+    transaction event (e.g. a PING). Raises ValueError if the body is malformed."""
+    try:
+        data = json.loads(body)["data"]
+        event_type = data["attributes"]["eventType"]
+        if event_type not in TRANSACTION_EVENT_TYPES:
+            return None
+        transaction_id = data["relationships"]["transaction"]["data"]["id"]
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"malformed webhook event: missing {e}")
+    return WebhookEvent(event_type, transaction_id)
+
+
+class WebhookBatcher:
+    """Queues Up webhook events, and pushes them to YNAB in micro-batches.
+
+    Once an event arrives, events keep being collected for batch_window seconds (or
+    until chunk_size of them have arrived), then the transactions are fetched from Up
+    and created in YNAB together. Transactions that settle after being imported have
+    their amount and date updated. Deleted transactions are removed from YNAB if there
+    is a mirror to find them in.
+
+    accounts is the list of SyncedAccounts to push transactions for; events for other
+    accounts are ignored. state, mirror, rules and the remaining options are as for
+    TransactionSync.
+    """
+
+    def __init__(
+        self,
+        out,
+        up_client,
+        ynab_client,
+        accounts,
+        state=None,
+        mirror=None,
+        foreign_flag=None,
+        batch_window=DEFAULT_BATCH_WINDOW,
+        chunk_size=ynab_api.DEFAULT_CHUNK_SIZE,
+        max_uploads=ynab_api.DEFAULT_MAX_UPLOADS,
+        rules=None,
+    ):
+        self.out = out
+        self.up_client = up_client
+        self.ynab_client = ynab_client
+        self.accounts = {account.up_id: account for account in accounts}
+        self.state = state
+        self.mirror = mirror
+        self.foreign_flag = foreign_flag
+        self.batch_window = batch_window
+        self.chunk_size = chunk_size
+        self.max_uploads = max_uploads
+        self.rules = rules
+        self.queue = queue.Queue()
+        self.total_count = 0
+
+    def put(self, event):
+        """Queue a WebhookEvent to be pushed in the next batch. Safe to call from any
+        thread."""
+        self.queue.put(event)
+
+    def stop(self):
+        """Make run return once the events already queued have been pushed."""
+        self.queue.put(None)
+
+    def _next_batch(self):
+        """Wait for the next batch of events, returning None once stopped."""
+        event = self.queue.get()
+        if event is None:
+            return None
+
+        batch = [event]
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.chunk_size:
+            try:
+                event = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if event is None:
+                # Push what has been collected, then stop on the next call
+                self.queue.put(None)
+                break
+            batch.append(event)
+        return batch
+
+    def run(self):
+        """Push batches of queued events to YNAB until stopped."""
+        from requests.exceptions import ConnectionError, HTTPError, Timeout
+
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+
+            now = datetime.datetime.now().astimezone()
+            self.out.section(f"Received *{len(batch)} events* by *{now:%H:%M:%S}*")
+            try:
+                with self.up_client.metrics.stage("webhook_batch"):
+                    self.flush(batch)
+            except (HTTPError, ConnectionError, Timeout) as e:
+                # Up won't send these events again, so suggest how to catch up on them
+                self.out.cancel_tasks()
+                self.out.warning(
+                    "Failed to push the events to YNAB:",
+                    str(e),
+                    "Run `up2ynab transactions -i` to import any missed transactions.",
+                )
+            except Exception as e:
+                # Anything else, e.g. unexpected data from Up, is reported too, so that
+                # one bad batch doesn't stop every later event from being pushed
+                self.out.cancel_tasks()
+                self.out.error(
+                    "An unexpected error occurred pushing the events to YNAB:",
+                    f"{type(e).__name__}: {e}",
+                    "Run `up2ynab transactions -i` to import any missed transactions.",
+                )
+            finally:
+                self.out.end_section()
+
+    def flush(self, events):
+        """Push a batch of WebhookEvents to YNAB."""
+
+        # Only the latest event for each transaction matters
+        latest = {}
+        for event in events:
+            latest[event.transaction_id] = event.event_type
+        deleted_ids = {
+            up_id
+            for up_id, event_type in latest.items()
+            if event_type == TRANSACTION_DELETED
+        }
+        settled_ids = {
+            up_id
+            for up_id, event_type in latest.items()
+            if event_type == TRANSACTION_SETTLED
+        }
+        fetch_ids = [up_id for up_id in latest if up_id not in deleted_ids]
+
+        # The events only contain transaction IDs, so get the rest from Up
+        by_account = defaultdict(list)
+        if fetch_ids:
+            self.out.start_task(f"Fetching *{len(fetch_ids)} transactions* from Up...")
+            with ThreadPoolExecutor(max_workers=self.max_uploads) as executor:
+                transactions = list(
+                    executor.map(self.up_client.get_transaction, fetch_ids)
+                )
+            for tx in transactions:
+                # Skip transactions deleted since the event was sent, and those in
+                # accounts that aren't being synced
+                if tx is None:
+                    continue
+                account = self.accounts.get(
+                    tx["relationships"]["account"]["data"]["id"]
+                )
+                if account is not None:
+                    by_account[account].append(tx)
+            self.out.task_success(
+                f"Fetched *{sum(map(len, by_account.values()))} transactions* to"
+                " push from Up."
+            )
+
+        for account, transactions in by_account.items():
+            self._push(account, transactions, settled_ids)
+
+        if deleted_ids:
+            self._delete(deleted_ids)
+
+    def _push(self, account, transactions, settled_ids):
+        """Create the Up transaction data in the account's YNAB account, updating any
+        of the settled_ids that were already imported."""
+        converted = ynab_api.YNABTransaction.from_up_page(transactions, self.rules)
+
+        self.out.start_task(
+            f"Uploading the transactions from *{account.up_name}* to YNAB..."
+        )
+        result = self.ynab_client.create_transactions(
+            account.ynab_id,
+            converted,
+            foreign_flag=self.foreign_flag,
+            chunk_size=self.chunk_size,
+            max_workers=self.max_uploads,
+        )
+
+        # Settling can change the amount, e.g. of foreign currency transactions, so
+        # update any that were already imported when they were created
+        duplicate_import_ids = set(result.duplicate_import_ids)
+        updates = [
+            {
+                "import_id": ynab_tx.import_id,
+                "amount": ynab_tx.amount,
+                "date": ynab_tx.date,
+            }
+            for tx, ynab_tx in zip(transactions, converted)
+            if tx["id"] in settled_ids and ynab_tx.import_id in duplicate_import_ids
+        ]
+        updated_ids = []
+        if updates:
+            updated_ids = self.ynab_client.update_transactions(
+                updates, chunk_size=self.chunk_size
+            )
+
+        failed_import_ids = {
+            tx.import_id for chunk in result.failed_chunks for tx in chunk.transactions
+        }
+        if self.state is not None:
+            rows = [
+                (tx["id"], ynab_tx.import_id, tx["attributes"]["createdAt"])
+                for tx, ynab_tx in zip(transactions, converted)
+            ]
+            self.state.record_imported(
+                account.up_id,
+                [row for row in rows if row[1] not in failed_import_ids],
+                failed=[row for row in rows if row[1] in failed_import_ids],
+            )
+
+        new_count = len(result.transaction_ids)
+        self.total_count += new_count + len(updated_ids)
+        if result.failed_chunks:
+            self.out.task_error(
+                f"Failed to upload *{len(failed_import_ids)} transactions* from"
+                f" *{account.up_name}* to YNAB."
+            )
+            for chunk in result.failed_chunks:
+                self.out.comment(
+                    f"A chunk of *{len(chunk.transactions)} transactions* failed:"
+                    f" {chunk.error}"
+                )
+        else:
+            self.out.task_success(
+                f"Uploaded *{new_count} new transactions* from *{account.up_name}* to"
+                " YNAB.",
+                counts={"new": new_count, "updated": len(updated_ids)},
+            )
+        if updated_ids:
+            self.out.comment(f"*{len(updated_ids)} settled transactions* were updated.")
+
+    def _delete(self, up_ids):
+        """Delete the transactions with the given Up IDs from YNAB, if they are in
+        one of the mirrored YNAB accounts."""
+        if self.mirror is None:
+            self.out.warning(
+                f"*{len(up_ids)} transactions* were deleted in Up, but can only be"
+                " removed from YNAB with `--mirror`."
+            )
+            return
+
+        self.out.start_task(
+            f"Removing *{len(up_ids)} deleted transactions* from YNAB..."
+        )
+        import_ids = [ynab_api.import_id_from_up_id(up_id) for up_id in up_ids]
+        deleted_count = 0
+        for ynab_id in {account.ynab_id for account in self.accounts.values()}:
+            self.mirror.refresh(self.ynab_client, ynab_id)
+            for mirrored_tx in self.mirror.by_import_id(ynab_id, import_ids).values():
+                if not mirrored_tx.deleted:
+                    self.ynab_client.delete_transaction(mirrored_tx.id)
+                    deleted_count += 1
+        self.out.task_success(
+            f"Removed *{deleted_count} deleted transactions* from YNAB."
+        )
+
+
+def make_server(host, port, secret_key, batcher, out):
+    """Return a ThreadingHTTPServer listening on host and port that verifies the
+    signature of each Up webhook event it is sent, and queues the transaction events
+    in the batcher.
+
+    Requests are answered as soon as the event is queued, so that Up doesn't time out
+    waiting for YNAB.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class WebhookHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            # Requests are reported through the echo manager instead
+            pass
+
+        def _respond(self, code):
+            self.send_response(code)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def _reject_body(self, code, reason):
+            """Respond to a request without reading its body, which can't be, and
+            close the connection so it isn't read as the next request."""
+            out.warning(f"Ignored a request {reason} from `{self.client_address[0]}`.")
+            self.close_connection = True
+            self._respond(code)
+
+        def do_POST(self):
+            if self.headers["Content-Length"] is None:
+                self._reject_body(411, "without a Content-Length")
+                return
+            try:
+                length = int(self.headers["Content-Length"])
+            except ValueError:
+                length = -1
+            if length < 0:
+                self._reject_body(400, "with an invalid Content-Length")
+                return
+            if length > MAX_BODY_SIZE:
+                self._reject_body(413, f"with a body of {length} bytes")
+                return
+            body = self.rfile.read(length)
+
+            if not verify_signature(
+                secret_key, body, self.headers.get(SIGNATURE_HEADER)
+            ):
+                out.warning(
+                    "Ignored a request with an invalid signature from"
+                    f" `{self.client_address[0]}`."
+                )
+                self._respond(401)
+                return
+
+            try:
+                event = parse_event(body)
+            except ValueError as e:
+                out.warning(f"Ignored a webhook event: {e}.")
+                self._respond(400)
+                return
+
+            if event is not None:
+                batcher.put(event)
+            self._respond(200)
+
+    return ThreadingHTTPServer((host, port), WebhookHandler)